@@ -0,0 +1,4 @@
+"""
+Reference handlers used by tello_benchmark.py.  Each one is a regular user
+handler script with an init and a handler method.
+"""
@@ -0,0 +1,28 @@
+"""
+Benchmark handler that thresholds a color range in HSV and finds the centroid of the mask.
+"""
+import cv2
+
+# HSV range of a green target
+LOWER_COLOR = (40, 70, 70)
+UPPER_COLOR = (80, 255, 255)
+
+target = None
+
+
+def init(tello, fly_flag=False):
+    global target
+    target = None
+
+
+def handler(tello, frame, fly_flag=False):
+    global target
+    if frame is None:
+        return
+
+    mask = cv2.inRange(frame.hsv, LOWER_COLOR, UPPER_COLOR)
+    moments = cv2.moments(mask, binaryImage=True)
+    if moments['m00'] > 0:
+        target = (moments['m10'] / moments['m00'], moments['m01'] / moments['m00'])
+    else:
+        target = None
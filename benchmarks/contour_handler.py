@@ -0,0 +1,22 @@
+"""
+Benchmark handler that blurs the gray image, finds edges and the largest contour.
+"""
+import cv2
+
+largest_contour = None
+
+
+def init(tello, fly_flag=False):
+    global largest_contour
+    largest_contour = None
+
+
+def handler(tello, frame, fly_flag=False):
+    global largest_contour
+    if frame is None:
+        return
+
+    blurred = cv2.GaussianBlur(frame.gray, (5, 5), 0)
+    edges = cv2.Canny(blurred, 50, 150)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    largest_contour = max(contours, key=cv2.contourArea) if contours else None
@@ -0,0 +1,38 @@
+"""
+Benchmark handler that runs an OpenCV DNN model on every frame.
+
+Set TELLO_BENCH_DNN_MODEL, and TELLO_BENCH_DNN_CONFIG if the model needs one, to any
+model cv2.dnn.readNet can load, for example the MobileNet SSD caffe model:
+
+    export TELLO_BENCH_DNN_MODEL=models/MobileNetSSD_deploy.caffemodel
+    export TELLO_BENCH_DNN_CONFIG=models/MobileNetSSD_deploy.prototxt
+"""
+import os
+
+import cv2
+
+DNN_MODEL = os.environ.get('TELLO_BENCH_DNN_MODEL', '')
+DNN_CONFIG = os.environ.get('TELLO_BENCH_DNN_CONFIG', '')
+DNN_INPUT_SIZE = (300, 300)
+DNN_SCALE = 0.007843
+DNN_MEAN = (127.5, 127.5, 127.5)
+
+net = None
+detections = None
+
+
+def init(tello, fly_flag=False):
+    global net
+    if not DNN_MODEL or not os.path.exists(DNN_MODEL):
+        raise FileNotFoundError("Set TELLO_BENCH_DNN_MODEL to the DNN model file to run the DNN benchmark")
+    net = cv2.dnn.readNet(DNN_MODEL, DNN_CONFIG)
+
+
+def handler(tello, frame, fly_flag=False):
+    global detections
+    if frame is None:
+        return
+
+    blob = cv2.dnn.blobFromImage(frame, DNN_SCALE, DNN_INPUT_SIZE, DNN_MEAN)
+    net.setInput(blob)
+    detections = net.forward()
@@ -0,0 +1,11 @@
+"""
+Benchmark handler that does nothing.  Measures the overhead of the runner pipeline itself.
+"""
+
+
+def init(tello, fly_flag=False):
+    pass
+
+
+def handler(tello, frame, fly_flag=False):
+    pass
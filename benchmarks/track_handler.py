@@ -0,0 +1,34 @@
+"""
+Benchmark handler that detects green blobs every 10 frames and follows them with KCF trackers in between.
+"""
+import cv2
+
+from tello_tracking import DetectTrackScheduler
+
+# HSV range of a green target
+LOWER_COLOR = (40, 70, 70)
+UPPER_COLOR = (80, 255, 255)
+MIN_AREA = 200
+
+tracking = None
+tracks = []
+
+
+def detect(frame):
+    mask = cv2.inRange(frame.hsv, LOWER_COLOR, UPPER_COLOR)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [(cv2.boundingRect(c), 'green', 1.0) for c in contours if cv2.contourArea(c) >= MIN_AREA]
+
+
+def init(tello, fly_flag=False):
+    global tracking, tracks
+    tracking = DetectTrackScheduler(detect, tracker='kcf', detect_every=10)
+    tracks = []
+
+
+def handler(tello, frame, fly_flag=False):
+    global tracks
+    if frame is None:
+        return
+
+    tracks = tracking.update(frame)
@@ -0,0 +1,378 @@
+"""
+asyncio runtime for the Tello script runner.
+
+Capture, handler, display, telemetry, command and recording work run as tasks
+on one event loop, or as threads the loop owns, instead of a daemon thread and
+a polling while loop.  Handlers can be coroutines:
+
+    async def handler(tello, frame, fly_flag=False):
+        await asyncio.wrap_future(tello.move_up(30))
+
+A regular handler runs on a worker thread so it never blocks the loop.
+
+Shutdown is deterministic.  Every task is cancelled, the RC setpoint is zeroed
+and land is sent right away, and the components and the Tello connection are
+told to stop, all within SHUTDOWN_DEADLINE seconds.  Blocking work runs on the
+runner's own daemon threads, never on the loop's default executor, so neither
+asyncio.run nor the interpreter exit waits for a component, or a sync handler,
+that is still busy after the deadline.  Landing itself completes after that,
+the drone does not need the runner for it.  The only exception is the video
+recording: an MP4 file that is not closed cannot be played, so it gets up to
+RECORDER_STOP_TIMEOUT seconds more to write its last frame and close the file.
+
+    python tello_script_runner.py --asyncio --handler sample_user_script --fly --display-video
+
+"""
+import asyncio
+import importlib
+import inspect
+import logging
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+# frame width and the None heartbeat period are the same as in the thread based runner
+from tello_script_runner import IMAGE_WIDTH, NO_VIDEO_HANDLER_PERIOD
+
+LOGGER = logging.getLogger()
+
+# seconds the shutdown may take from cancel to closed Tello connection
+SHUTDOWN_DEADLINE = 0.1
+
+# seconds the video recording may take to close its file, it is not cut off at the shutdown deadline
+RECORDER_STOP_TIMEOUT = 2.0
+
+# seconds between keyboard window updates
+DISPLAY_PERIOD = 1.0 / 60
+
+
+# daemon threads for blocking work: setup, waiting for frames, sync handlers and stopping components
+EXECUTOR_THREADS = 8
+
+
+class DaemonExecutor(Executor):
+    """
+    Thread pool with daemon threads.  Work still running after shutdown(wait=False) does
+    not hold up the event loop or the interpreter exit, unlike ThreadPoolExecutor.
+
+    :param max_workers: Maximum number of threads, they are started when work is waiting
+    :type max_workers: int
+    """
+
+    def __init__(self, max_workers=EXECUTOR_THREADS, name="async-runner"):
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new work after shutdown")
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            if not self._idle.acquire(blocking=False) and len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as exc:
+                    future.set_exception(exc)
+            self._idle.release()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            for _ in self._threads:
+                self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+
+class AsyncRunner:
+    """
+    Run a handler against the Tello on an asyncio event loop.
+
+    :param handler_file: Module name of the handler, without .py.  None - no handler
+    :type handler_file: str
+    :param fly: Take off and let the handler fly the drone
+    :type fly: bool
+    :param display_video: Show the video and the keyboard window
+    :type display_video: bool
+    :param tello_video_sim: Use the computer webcam instead of the Tello video
+    :type tello_video_sim: bool
+    :param tello_host: IP address of the Tello or of a simulator.  None - djitellopy default
+    :type tello_host: str
+    :param save_video: Record the decoded video
+    :type save_video: bool
+    :param shutdown_deadline: Seconds the shutdown may take
+    :type shutdown_deadline: float
+    """
+
+    def __init__(self, handler_file=None, fly=False, display_video=False, tello_video_sim=False, tello_host=None,
+                 save_video=False, shutdown_deadline=SHUTDOWN_DEADLINE):
+        self.handler_file = handler_file
+        self.fly = fly
+        self.display_video = display_video or tello_video_sim
+        self.tello_video_sim = tello_video_sim
+        self.tello_host = tello_host
+        self.save_video = save_video
+        self.shutdown_deadline = shutdown_deadline
+
+        self.tello = None
+        self.dispatcher = None
+        self.telemetry = None
+        self.frame_source = None
+        self.recorder = None
+        self.handler_module = None
+        self.keyboard_window = None
+
+        self._loop = None
+        self._executor = None
+        self._stop_event = None
+        self._tasks = []
+        self._frame_ready = None
+        self._latest_frame = None
+        self._display_frame = None
+        self.shutdown_seconds = None
+
+    def request_stop(self):
+        """
+        Stop the runner.  Safe to call from any thread or a signal handler.
+        """
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def _setup(self):
+        """
+        Blocking setup, runs on a worker thread: connect, load the handler and start the video.
+        """
+        from tello_command_dispatcher import CommandDispatcher
+        from tello_frame_source import tello_frame_source, webcam_frame_source
+        from tello_metrics import METRICS
+
+        if self.fly or (not self.tello_video_sim and self.display_video):
+            from djitellopy import Tello
+
+            from tello_telemetry import TelemetryService
+
+            self.tello = Tello(host=self.tello_host) if self.tello_host else Tello()
+            self.tello.connect()
+            self.telemetry = TelemetryService().follow(self.tello)
+            self.tello.telemetry = self.telemetry
+            self.dispatcher = CommandDispatcher(self.tello, metrics=METRICS).start()
+
+        if self.handler_file:
+            self.handler_module = importlib.import_module(self.handler_file.replace(".py", ""))
+            init_method = self.handler_module.init
+            if not inspect.iscoroutinefunction(init_method):
+                init_method(self.dispatcher or self.tello, fly_flag=self.fly)
+
+        if self.tello:
+            self.tello.streamon()
+            self.frame_source = tello_frame_source(self.tello).start()
+        elif self.tello_video_sim:
+            self.frame_source = webcam_frame_source(0).start()
+
+        if self.save_video and self.frame_source:
+            from tello_video_recorder import VideoRecorder
+            self.recorder = VideoRecorder(self.frame_source.mailbox).start()
+
+        if self.fly:
+            self.tello.takeoff()
+            self.tello.send_rc_control(0, 0, 0, 0)
+
+    async def _capture_task(self):
+        last_seq = 0
+        while True:
+            # next_frame blocks, so it waits on a worker thread
+            frame = await self._loop.run_in_executor(self._executor, self.frame_source.next_frame, last_seq, 0.1)
+            if frame is None:
+                if self.frame_source.finished:
+                    self._stop_event.set()
+                    return
+                continue
+            last_seq = frame.seq
+            self._latest_frame = frame
+            self._frame_ready.set()
+
+    async def _handler_task(self):
+        from tello_frame import TelloFrame
+        from tello_metrics import METRICS
+
+        handler_method = self.handler_module.handler if self.handler_module else None
+        is_async = inspect.iscoroutinefunction(handler_method)
+        handler_tello = self.dispatcher or self.tello
+        last_seq = 0
+
+        while True:
+            frame = None
+            try:
+                await asyncio.wait_for(self._frame_ready.wait(), NO_VIDEO_HANDLER_PERIOD)
+                self._frame_ready.clear()
+                video_frame = self._latest_frame
+                if video_frame.seq - last_seq > 1 and last_seq > 0:
+                    METRICS.count('video_frame_drops', video_frame.seq - last_seq - 1)
+                last_seq = video_frame.seq
+                METRICS.stamp(last_seq, 'decode', video_frame.timestamp)
+                frame = TelloFrame.from_image(video_frame.image, IMAGE_WIDTH, video_frame.seq, video_frame.timestamp)
+            except asyncio.TimeoutError:
+                pass
+
+            if handler_method:
+                start = time.time()
+                if is_async:
+                    await handler_method(handler_tello, frame, self.fly)
+                else:
+                    await self._loop.run_in_executor(self._executor, handler_method, handler_tello, frame, self.fly)
+                if frame is not None:
+                    METRICS.span('handler', start, time.time(), last_seq)
+
+            if frame is not None:
+                self._display_frame = frame
+
+    async def _display_task(self):
+        import cv2
+
+        from tello_keyboard import KeyboardControlWindow
+        from tello_metrics import METRICS
+
+        self.keyboard_window = KeyboardControlWindow(width=IMAGE_WIDTH)
+        if self.display_video:
+            cv2.namedWindow("Tello Video")
+        last_seq = 0
+        while True:
+            battery = self.telemetry.latest('bat') if self.telemetry and self.telemetry.count else "??"
+            if self.keyboard_window.poll(self.dispatcher or self.tello, self.fly, battery) == 0:
+                self._stop_event.set()
+                return
+
+            frame = self._display_frame
+            if self.display_video and frame is not None and frame.seq != last_seq:
+                last_seq = frame.seq
+                cv2.imshow("Tello Video", frame)
+                METRICS.stamp(frame.seq, 'display')
+            await asyncio.sleep(DISPLAY_PERIOD)
+
+    async def run(self):
+        """
+        Connect, take off when flying, and run the tasks until the keyboard window exits,
+        the video ends, a task fails or request_stop is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._executor = DaemonExecutor()
+        self._stop_event = asyncio.Event()
+        self._frame_ready = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not the main thread
+                pass
+
+        try:
+            await self._loop.run_in_executor(self._executor, self._setup)
+
+            if self.handler_module and inspect.iscoroutinefunction(self.handler_module.init):
+                await self.handler_module.init(self.dispatcher or self.tello, fly_flag=self.fly)
+
+            if self.frame_source:
+                self._tasks.append(asyncio.create_task(self._capture_task(), name="capture"))
+            if self.handler_module:
+                self._tasks.append(asyncio.create_task(self._handler_task(), name="handler"))
+            # the keyboard window is always shown, the video only with display_video
+            self._tasks.append(asyncio.create_task(self._display_task(), name="display"))
+
+            stop_waiter = asyncio.create_task(self._stop_event.wait())
+            # a task that fails stops the runner as well
+            done, _ = await asyncio.wait(self._tasks + [stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+            stop_waiter.cancel()
+            for task in done:
+                if task is not stop_waiter and not task.cancelled() and task.exception():
+                    LOGGER.error(f"Task {task.get_name()} failed: {task.exception()}")
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Cancel every task, stop the drone and end the Tello connection within the shutdown deadline,
+        then wait up to RECORDER_STOP_TIMEOUT for the recording to close its file.
+        """
+        start = time.time()
+        deadline = start + self.shutdown_deadline
+
+        for task in self._tasks:
+            task.cancel()
+
+        if self.tello and self.fly:
+            # sent straight to the drone, not queued behind a command the dispatcher is waiting on
+            try:
+                if self.dispatcher:
+                    self.dispatcher.clear()
+                self.tello.send_rc_control(0, 0, 0, 0)
+                self.tello.send_command_without_return("land")
+                self.tello.is_flying = False
+            except Exception as exc:
+                LOGGER.error(f"Error stopping the drone: {exc}")
+
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=max(0.0, deadline - time.time()))
+
+        # started first, it runs next to the other stops and may outlast the deadline
+        recording = self._loop.run_in_executor(self._executor, self.recorder.stop, RECORDER_STOP_TIMEOUT) \
+            if self.recorder else None
+
+        remaining = max(0.0, deadline - time.time())
+        stops = []
+        if self.dispatcher:
+            stops.append(lambda: self.dispatcher.stop(remaining))
+        for component in (self.frame_source, self.telemetry):
+            if component:
+                stops.append(component.stop)
+        if stops:
+            futures = [self._loop.run_in_executor(self._executor, stop) for stop in stops]
+            done, pending = await asyncio.wait(futures, timeout=remaining)
+            if pending:
+                # they finish on their daemon threads, or are cut off when the process exits
+                LOGGER.error(f"{len(pending)} components did not stop within the shutdown deadline")
+
+        if self.tello:
+            # after the dispatcher, so no queued command shares the socket with it
+            ending = self._loop.run_in_executor(self._executor, self.tello.end)
+            done, pending = await asyncio.wait([ending], timeout=max(0.0, deadline - time.time()))
+            if pending:
+                LOGGER.error("The Tello connection did not end within the shutdown deadline")
+
+        if recording:
+            done, pending = await asyncio.wait([recording], timeout=RECORDER_STOP_TIMEOUT)
+            if pending:
+                LOGGER.error(f"The recording did not close within {RECORDER_STOP_TIMEOUT} seconds")
+        # nothing waits for the threads, a frame wait, a sync handler or a stop may still be running
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+        self.shutdown_seconds = time.time() - start
+        LOGGER.info(f"Shutdown took {self.shutdown_seconds * 1000.0:.1f} ms")
@@ -0,0 +1,372 @@
+"""
+Benchmark the runner pipeline without a drone.
+
+Frames from a video file, a directory of images or a synthetic generator are
+pushed through process_tello_video_feed with one of the reference handlers in
+the benchmarks package.  Frames are either paced at the source frame rate, like
+a camera, or delivered as fast as the handler loop takes them: in fast mode the
+source waits until the runner took the previous frame, so no frame is dropped
+and the numbers are those of the handler, not of the source overrunning it.
+
+For every handler the benchmark reports throughput, p50 and p99 latency from
+decode until the frame reaches the display mailbox, both over the frames the
+handler saw, the fraction of source frames the handler loop never got to, and
+the peak resident memory.  Every handler runs in its own process, so the peak
+memory of one handler does not show up in the next.  Results are written as
+JSON so runs from different versions can be compared:
+
+    python tello_benchmark.py --source synthetic --pacing fast --frames 600 --output new.json
+    python tello_benchmark.py --source synthetic --pacing realtime --fps 30 --output camera.json
+    python tello_benchmark.py --compare old.json new.json
+
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import tello_script_runner
+from tello_frame_source import FrameMailbox, FrameSource
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+logging.basicConfig(format=FORMAT)
+LOGGER = logging.getLogger()
+
+REFERENCE_HANDLERS = {
+    'noop': 'benchmarks.noop_handler',
+    'color': 'benchmarks.color_threshold_handler',
+    'contour': 'benchmarks.contour_handler',
+    'dnn': 'benchmarks.dnn_handler',
+    'track': 'benchmarks.track_handler',
+}
+
+# Tello camera resolution
+SYNTHETIC_SIZE = (960, 720)
+
+# name of the thread running process_tello_video_feed, it takes the source frames under this name
+RUNNER_THREAD = "benchmark-runner"
+
+
+class _Pacer:
+    """
+    Sleep so frames are released at fps.  fps of None or 0 means no pacing: once attached
+    to the source mailbox, a frame is only released after the runner took the previous one.
+    """
+
+    def __init__(self, fps):
+        self.period = 1.0 / fps if fps else 0
+        self.next_time = None
+        self.mailbox = None
+
+    def attach(self, mailbox):
+        self.mailbox = mailbox
+
+    def wait(self):
+        if not self.period:
+            if self.mailbox is not None:
+                # without this the single slot mailbox drops most frames and the
+                # benchmark measures the source overrunning the handler loop
+                self.mailbox.wait_taken(RUNNER_THREAD)
+            return
+        now = time.time()
+        if self.next_time is None:
+            self.next_time = now
+        self.next_time += self.period
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+
+
+def video_file_source(path, realtime=True, max_frames=None, fps=None):
+    """
+    Frames from a video file.
+
+    :param realtime: Release frames at the file frame rate. False - as fast as they decode
+    :type realtime: bool
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Cannot open video file {path}")
+    fps = fps or capture.get(cv2.CAP_PROP_FPS) or 30
+    pacer = _Pacer(fps if realtime else None)
+    count = [0]
+
+    def read_frame():
+        if max_frames and count[0] >= max_frames:
+            raise EOFError
+        ok, image = capture.read()
+        if not ok:
+            raise EOFError
+        count[0] += 1
+        pacer.wait()
+        return image
+
+    source = FrameSource(read_frame, name="video-file", close=capture.release)
+    pacer.attach(source.mailbox)
+    return source
+
+
+def image_directory_source(path, realtime=True, max_frames=None, fps=30, loop=False):
+    """
+    Frames from the .jpg and .png images in a directory, in file name order.  The
+    images are loaded before the benchmark starts so disk reads are not measured.
+    """
+    files = sorted(glob.glob(os.path.join(path, '*.jpg')) + glob.glob(os.path.join(path, '*.png')))
+    if not files:
+        raise FileNotFoundError(f"No .jpg or .png images in {path}")
+    images = [cv2.imread(f) for f in files]
+    pacer = _Pacer(fps if realtime else None)
+    count = [0]
+
+    def read_frame():
+        if (max_frames and count[0] >= max_frames) or (not loop and count[0] >= len(images)):
+            raise EOFError
+        image = images[count[0] % len(images)]
+        count[0] += 1
+        pacer.wait()
+        return image
+
+    source = FrameSource(read_frame, name="image-directory")
+    pacer.attach(source.mailbox)
+    return source
+
+
+def synthetic_source(realtime=True, max_frames=None, fps=30, size=SYNTHETIC_SIZE):
+    """
+    Generated frames: a green square and a red circle moving over a noisy background,
+    so the reference handlers have something to find.
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    pacer = _Pacer(fps if realtime else None)
+    count = [0]
+
+    def read_frame():
+        if max_frames and count[0] >= max_frames:
+            raise EOFError
+        i = count[0]
+        count[0] += 1
+        image = background.copy()
+        x = int((i * 7) % (width - 120))
+        y = int(height / 2 + np.sin(i / 15.0) * height / 4)
+        cv2.rectangle(image, (x, y - 60), (x + 120, y + 60), (40, 200, 40), -1)
+        cv2.circle(image, (width - x - 60, height - y), 50, (40, 40, 220), -1)
+        pacer.wait()
+        return image
+
+    source = FrameSource(read_frame, name="synthetic")
+    pacer.attach(source.mailbox)
+    return source
+
+
+def make_source(spec, realtime, max_frames, fps):
+    """
+    Create a frame source from 'synthetic', 'video:<file>' or 'images:<directory>'.
+    """
+    kind, _, path = spec.partition(':')
+    if kind == 'synthetic':
+        return synthetic_source(realtime, max_frames, fps or 30)
+    if kind == 'video':
+        return video_file_source(path, realtime, max_frames, fps)
+    if kind == 'images':
+        return image_directory_source(path, realtime, max_frames, fps or 30, loop=bool(max_frames))
+    raise ValueError(f"Unknown frame source: {spec}")
+
+
+def _peak_rss_mb():
+    # the high-water mark of the whole process, so every handler runs in a process of its own
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on MacOS
+    return round(peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0, 1)
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _LatencyMailbox(FrameMailbox):
+    """
+    Display mailbox that records the latency of every frame the handler loop publishes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+
+    def put(self, frame):
+        self.latencies.append(time.time() - frame.timestamp)
+        super().put(frame)
+
+
+def run_benchmark(source, handler_module, timeout=None):
+    """
+    Push every frame of source through process_tello_video_feed with handler_module.
+
+    Throughput and latency are over the frames the handler saw, the drop rate
+    is the fraction of decoded frames it never saw.
+
+    :param source: Unstarted FrameSource
+    :type source: FrameSource
+    :param handler_module: Module name of the handler, for example benchmarks.noop_handler
+    :type handler_module: str
+    :param timeout: Stop after this many seconds. None - run until the source ends
+    :type timeout: float
+    :return: Benchmark results
+    :rtype: dict
+    """
+    # stands in for the display, the runner publishes every frame the handler saw
+    video_mailbox = _LatencyMailbox()
+    stop_event = threading.Event()
+    video_event = threading.Event()
+    video_event.set()
+
+    runner = threading.Thread(target=tello_script_runner.process_tello_video_feed,
+                              args=(handler_module, video_mailbox, stop_event, video_event),
+                              kwargs={'video_source': source}, name=RUNNER_THREAD)
+
+    start = time.time()
+    runner.start()
+    runner.join(timeout)
+    if runner.is_alive():
+        stop_event.set()
+        runner.join()
+    elapsed = time.time() - start
+    video_mailbox.close()
+    source.stop()
+    # the runner keeps the source in a global for the signal handler
+    tello_script_runner.frame_source = None
+
+    decoded = source.mailbox.puts
+    processed = video_mailbox.puts
+    ordered = sorted(video_mailbox.latencies)
+    return {
+        'handler': handler_module,
+        'frames_decoded': decoded,
+        'frames_processed': processed,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_fps': round(processed / elapsed, 2) if elapsed else None,
+        'latency_p50_ms': round(_percentile(ordered, 0.50) * 1000.0, 3) if ordered else None,
+        'latency_p99_ms': round(_percentile(ordered, 0.99) * 1000.0, 3) if ordered else None,
+        'drop_rate': round(1.0 - processed / decoded, 4) if decoded else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _run_source_benchmark(source_spec, realtime, max_frames, fps, handler_module, log_level):
+    LOGGER.setLevel(log_level)
+    return run_benchmark(make_source(source_spec, realtime, max_frames, fps), handler_module)
+
+
+def run_benchmark_process(source_spec, realtime, max_frames, fps, handler_module):
+    """
+    run_benchmark in a new process, so peak_rss_mb is the peak of this handler alone.
+
+    :param source_spec: 'synthetic', 'video:<file>' or 'images:<directory>', see make_source
+    :type source_spec: str
+    :return: Benchmark results
+    :rtype: dict
+    """
+    # spawn, a forked child would start with the memory of the parent
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(_run_source_benchmark,
+                          (source_spec, realtime, max_frames, fps, handler_module, LOGGER.level))
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_file, new_file):
+    """
+    Print the change of every metric between two result files.
+    """
+    with open(old_file) as f:
+        old = {r['handler']: r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new = json.load(f)['results']
+
+    for result in new:
+        previous = old.get(result['handler'])
+        if previous is None:
+            continue
+        print(result['handler'])
+        for key in ('throughput_fps', 'latency_p50_ms', 'latency_p99_ms', 'drop_rate', 'peak_rss_mb'):
+            before, after = previous.get(key), result.get(key)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100.0 if before else 0.0
+            print(f"    {key:16s} {before:10.3f} -> {after:10.3f}  ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Benchmark the Tello script runner pipeline")
+    ap.add_argument("--source", type=str, default="synthetic",
+                    help="synthetic, video:<file> or images:<directory>.  Default: synthetic")
+    ap.add_argument("--pacing", choices=['realtime', 'fast'], default='realtime',
+                    help="Release frames at the source frame rate or as fast as possible.  Default: realtime")
+    ap.add_argument("--fps", type=float, default=None, help="Frame rate for realtime pacing. Default: source rate or 30")
+    ap.add_argument("--frames", type=int, default=300, help="Number of frames per handler. 0 - whole source.  Default: 300")
+    ap.add_argument("--handlers", type=str, default="noop,color,contour",
+                    help=f"Comma separated handlers: {', '.join(REFERENCE_HANDLERS)} or a module name.  Default: noop,color,contour")
+    ap.add_argument("--output", type=str, default=None, help="JSON file to write the results to")
+    ap.add_argument("--compare", nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files and exit")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.ERROR)
+    if args["verbose"]:
+        LOGGER.setLevel(logging.INFO)
+
+    if args['compare']:
+        compare(*args['compare'])
+        sys.exit(0)
+
+    results = []
+    for name in args['handlers'].split(','):
+        handler_module = REFERENCE_HANDLERS.get(name.strip(), name.strip())
+        result = run_benchmark_process(args['source'], args['pacing'] == 'realtime', args['frames'] or None,
+                                       args['fps'], handler_module)
+        results.append(result)
+        print(json.dumps(result))
+
+    report = {
+        'version': _version(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'source': args['source'],
+        'pacing': args['pacing'],
+        'frames': args['frames'],
+        'results': results,
+    }
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,325 @@
+"""
+Camera calibration from a checkerboard video, and precomputed lens undistortion.
+
+The Tello camera has a wide lens with visible barrel distortion.  cv2.undistort
+corrects it, but computes the pixel mapping again for every frame.  Undistorter
+builds the mapping with cv2.initUndistortRectifyMap once per frame resolution,
+keeps it on disk next to the calibration file, and after that every frame only
+costs a cv2.remap into a pooled buffer.
+
+Record a video of a printed checkerboard, moved slowly through the whole
+picture and tilted in different directions, then calibrate from it:
+
+    python tello_script_runner.py --display-video --save-video
+    python tello_calibration.py calibrate video_01-02-2021_10-00-00_AM.mp4 --board 9x6 --square 0.024
+
+--board is the number of inner corners per row and column, --square the size
+of one square in any unit.  A session recorded with --record-session can be
+used instead of a video file.  The result is written to calibration.json, and
+the runner undistorts every frame with it before the handler sees the frame:
+
+    python tello_script_runner.py --handler my_handler --calibration calibration.json --display-video
+
+    python tello_calibration.py preview video.mp4 --calibration calibration.json
+
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zipfile
+
+import cv2
+import numpy as np
+
+from tello_frame import FRAME_POOL
+
+FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+logging.basicConfig(format=FORMAT)
+LOGGER = logging.getLogger()
+
+CALIBRATION_FILE = 'calibration.json'
+# inner corners per row and per column
+BOARD_SIZE = (9, 6)
+# use every nth video frame, neighbouring frames show the board in almost the same pose
+FRAME_STEP = 10
+# checkerboard views used for the calibration
+MAX_VIEWS = 40
+MIN_VIEWS = 5
+# 0 - crop to the valid pixels, 1 - keep every source pixel and show black borders
+ALPHA = 0.0
+
+_SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def video_frames(path):
+    """
+    Yield the images of a video file or of a session directory recorded by the runner.
+    """
+    if os.path.isdir(path):
+        from tello_session import RECORD_FRAME, SessionReader
+        reader = SessionReader(path)
+        for position, record_type, seq, timestamp in reader.records():
+            if record_type == RECORD_FRAME:
+                yield reader.frame(position)
+        return
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Cannot open video {path}")
+    try:
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            yield image
+    finally:
+        capture.release()
+
+
+def calibrate(path, board_size=BOARD_SIZE, square_size=1.0, frame_step=FRAME_STEP, max_views=MAX_VIEWS):
+    """
+    Find the camera matrix and the distortion coefficients from a checkerboard video.
+
+    :param path: Video file or session directory
+    :type path: str
+    :param board_size: (columns, rows) of inner corners
+    :type board_size: tuple
+    :param square_size: Size of one square, the unit of the translations
+    :type square_size: float
+    :param frame_step: Look for the board in every nth frame
+    :type frame_step: int
+    :param max_views: Stop after the board was found this many times
+    :type max_views: int
+    :return: Calibration, as written to the calibration file
+    :rtype: dict
+    """
+    board = np.zeros((board_size[0] * board_size[1], 3), np.float32)
+    board[:, :2] = np.mgrid[0:board_size[0], 0:board_size[1]].T.reshape(-1, 2) * square_size
+
+    object_points, image_points = [], []
+    image_size = None
+    frames = 0
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+    for index, image in enumerate(video_frames(path)):
+        if index % frame_step:
+            continue
+        frames += 1
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if image_size is None:
+            image_size = (gray.shape[1], gray.shape[0])
+        elif image_size != (gray.shape[1], gray.shape[0]):
+            raise ValueError(f"Frame {index} is {gray.shape[1]}x{gray.shape[0]}, earlier frames were "
+                             f"{image_size[0]}x{image_size[1]}")
+
+        found, corners = cv2.findChessboardCorners(gray, board_size, flags)
+        if not found:
+            continue
+        corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), _SUBPIX_CRITERIA)
+        object_points.append(board)
+        image_points.append(corners)
+        LOGGER.info(f"Board found in frame {index}, {len(image_points)} views")
+        if len(image_points) >= max_views:
+            break
+
+    if len(image_points) < MIN_VIEWS:
+        raise RuntimeError(f"The board was found in {len(image_points)} of {frames} frames, at least {MIN_VIEWS} "
+                           f"are needed.  Check --board, it counts inner corners")
+
+    rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(object_points, image_points, image_size, None, None)
+    return {'image_size': list(image_size), 'camera_matrix': camera_matrix.tolist(),
+            'dist_coeffs': dist_coeffs.ravel().tolist(), 'rms': float(rms), 'views': len(image_points),
+            'board_size': list(board_size), 'square_size': square_size}
+
+
+def save_calibration(calibration, path=CALIBRATION_FILE):
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+
+
+class Undistorter:
+    """
+    Undistort frames with remap maps built once per resolution and cached on disk.
+
+    Frames of another resolution than the calibration video, with the same aspect ratio, use the camera
+    matrix scaled to their size.
+
+    With the default alpha of 0 the undistorted frame only shows the pixels that are valid everywhere, scaled
+    up to the full frame: the field of view is narrower than without undistortion.  new_camera_matrix is the
+    camera matrix of the undistorted frames.
+
+    :param calibration_file: JSON file written by tello_calibration.py calibrate
+    :type calibration_file: str
+    :param alpha: 0 - crop to the valid pixels, 1 - keep every source pixel
+    :type alpha: float
+    :param cache_dir: Directory for the maps.  None - a directory next to the calibration file
+    :type cache_dir: str
+    """
+
+    def __init__(self, calibration_file=CALIBRATION_FILE, alpha=ALPHA, cache_dir=None, pool=FRAME_POOL):
+        with open(calibration_file, 'rb') as f:
+            contents = f.read()
+        calibration = json.loads(contents.decode('utf-8'))
+        self.image_size = tuple(calibration['image_size'])
+        self.camera_matrix = np.array(calibration['camera_matrix'], dtype=np.float64)
+        self.dist_coeffs = np.array(calibration['dist_coeffs'], dtype=np.float64)
+        self.alpha = alpha
+        self.cache_dir = cache_dir or os.path.splitext(calibration_file)[0] + '_maps'
+        # maps made from an older calibration have another name and are not used
+        self._digest = hashlib.sha1(contents).hexdigest()[:12]
+        self._pool = pool
+        self._maps = {}
+        self._new_matrices = {}
+        # size of the frames undistorted last
+        self._last_size = None
+        self._lock = threading.Lock()
+        self.frames = 0
+
+    def _cache_path(self, width, height):
+        return os.path.join(self.cache_dir, f"{width}x{height}_alpha{self.alpha:g}_{self._digest}.npz")
+
+    def _optimal_matrix(self, width, height):
+        cal_width, cal_height = self.image_size
+        camera_matrix = self.camera_matrix.copy()
+        camera_matrix[0] *= width / float(cal_width)
+        camera_matrix[1] *= height / float(cal_height)
+        new_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, self.dist_coeffs, (width, height), self.alpha,
+                                                      (width, height))
+        return camera_matrix, new_matrix
+
+    def _build_maps(self, width, height):
+        cal_width, cal_height = self.image_size
+        if abs(width / float(height) - cal_width / float(cal_height)) > 0.01:
+            LOGGER.warning(f"Frames are {width}x{height}, the calibration was made at {cal_width}x{cal_height}, "
+                           f"the undistortion will not be accurate")
+        camera_matrix, new_matrix = self._optimal_matrix(width, height)
+        # fixed point maps make remap about twice as fast as float maps
+        map1, map2 = cv2.initUndistortRectifyMap(camera_matrix, self.dist_coeffs, None, new_matrix, (width, height),
+                                                 cv2.CV_16SC2)
+        return map1, map2, new_matrix
+
+    def maps(self, width, height):
+        """
+        Remap maps for frames of this size, from memory, from disk or built now.
+        """
+        with self._lock:
+            maps = self._maps.get((width, height))
+            if maps is not None:
+                return maps
+            path = self._cache_path(width, height)
+            start = time.time()
+            try:
+                with np.load(path) as cached:
+                    maps = (cached['map1'], cached['map2'])
+                    new_matrix = cached['new_matrix']
+                LOGGER.info(f"Loaded undistort maps for {width}x{height} from {path}")
+            except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+                map1, map2, new_matrix = self._build_maps(width, height)
+                maps = (map1, map2)
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    np.savez(path, map1=map1, map2=map2, new_matrix=new_matrix)
+                except OSError as exc:
+                    LOGGER.warning(f"Could not cache the undistort maps in {path}: {exc}")
+                LOGGER.info(f"Built undistort maps for {width}x{height} in {(time.time() - start) * 1000.0:.0f} ms")
+            self._maps[(width, height)] = maps
+            self._new_matrices[(width, height)] = new_matrix
+            self._last_size = (width, height)
+            return maps
+
+    def new_camera_matrix(self, width=None, height=None):
+        """
+        Camera matrix of the undistorted frames, for handlers that measure angles or distances in them.
+
+        With alpha below 1 the undistortion crops to the valid pixels and scales them back up to the frame size,
+        so the undistorted frames have a narrower field of view and another focal length than the calibrated
+        camera_matrix says.
+
+        :param width: Width of the frames the matrix is for, for example the handler frame.  None - the size of
+                        the frames that were undistorted
+        :type width: int
+        :param height: Height of those frames
+        :type height: int
+        :rtype: numpy.ndarray
+        """
+        with self._lock:
+            size = self._last_size or self.image_size
+            matrix = self._new_matrices.get(size)
+        if matrix is None:
+            matrix = self._optimal_matrix(*size)[1]
+        matrix = matrix.copy()
+        if width is not None and height is not None:
+            # the handler frame is resized from the undistorted frame
+            matrix[0] *= width / float(size[0])
+            matrix[1] *= height / float(size[1])
+        return matrix
+
+    def __call__(self, image):
+        """
+        Undistort the image into a pooled buffer.
+
+        :param image: BGR or gray image
+        :type image: numpy.ndarray
+        :return: The undistorted image, the same size as the input
+        :rtype: numpy.ndarray
+        """
+        height, width = image.shape[:2]
+        map1, map2 = self.maps(width, height)
+        dst = self._pool.acquire(image.shape, image.dtype)
+        cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst)
+        self.frames += 1
+        return dst
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Calibrate the Tello camera and undistort its video")
+    sub = ap.add_subparsers(dest='command', required=True)
+    calibrate_ap = sub.add_parser('calibrate', help="Calibrate from a checkerboard video or session")
+    calibrate_ap.add_argument("video", type=str, help="Video file or session directory")
+    calibrate_ap.add_argument("--board", type=str, default=f"{BOARD_SIZE[0]}x{BOARD_SIZE[1]}",
+                              help=f"Inner corners per row x per column.  Default: {BOARD_SIZE[0]}x{BOARD_SIZE[1]}")
+    calibrate_ap.add_argument("--square", type=float, default=1.0, help="Size of one square.  Default: 1")
+    calibrate_ap.add_argument("--step", type=int, default=FRAME_STEP,
+                              help=f"Look for the board in every nth frame.  Default: {FRAME_STEP}")
+    calibrate_ap.add_argument("--max-views", type=int, default=MAX_VIEWS,
+                              help=f"Checkerboard views to calibrate with.  Default: {MAX_VIEWS}")
+    calibrate_ap.add_argument("--output", type=str, default=CALIBRATION_FILE,
+                              help=f"Calibration file to write.  Default: {CALIBRATION_FILE}")
+    preview_ap = sub.add_parser('preview', help="Show a video next to its undistorted version")
+    preview_ap.add_argument("video", type=str, help="Video file or session directory")
+    preview_ap.add_argument("--calibration", type=str, default=CALIBRATION_FILE,
+                            help=f"Calibration file.  Default: {CALIBRATION_FILE}")
+    preview_ap.add_argument("--alpha", type=float, default=ALPHA,
+                            help="0 - crop to the valid pixels, 1 - keep every source pixel.  Default: 0")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.INFO if args['verbose'] else logging.ERROR)
+
+    if args['command'] == 'calibrate':
+        try:
+            board_size = tuple(int(v) for v in args['board'].lower().split('x'))
+        except ValueError:
+            board_size = ()
+        if len(board_size) != 2:
+            ap.error(f"--board must be columns x rows, e.g. 9x6, not {args['board']}")
+        try:
+            calibration = calibrate(args['video'], board_size, args['square'], args['step'], args['max_views'])
+        except (RuntimeError, ValueError, FileNotFoundError) as exc:
+            print(exc)
+            sys.exit(-1)
+        save_calibration(calibration, args['output'])
+        print(f"Calibrated from {calibration['views']} views, reprojection error {calibration['rms']:.3f} pixels, "
+              f"written to {args['output']}")
+        sys.exit(0)
+
+    undistorter = Undistorter(args['calibration'], alpha=args['alpha'])
+    for image in video_frames(args['video']):
+        cv2.imshow("Distorted | Undistorted", np.hstack((image, undistorter(image))))
+        if cv2.waitKey(30) & 0xFF in (ord('q'), 27):
+            break
+    cv2.destroyAllWindows()
@@ -0,0 +1,200 @@
+"""
+Non-blocking command dispatcher for the Tello.
+
+Most Tello commands, like move_up, wait for the drone to reply "ok" which can
+take seconds.  When a handler calls them directly, the video loop stops until
+the drone answers.  The CommandDispatcher looks like the Tello object to the
+handler, but commands are queued to a worker thread and the call returns a
+concurrent.futures.Future right away.
+
+query_* calls, like query_battery, are queued too and return a Future, only
+the get_* methods, which read the latest state packet, run on the caller's
+thread.
+
+send_rc_control is not queued.  It only updates the RC setpoint, and a timer
+thread sends the latest setpoint at a fixed rate, so a handler that updates
+the setpoint on every frame does not flood the drone: superseded setpoints are
+simply never sent.
+
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+LOGGER = logging.getLogger()
+
+# rate, in Hz, at which the RC setpoint is sent to the drone
+RC_RATE_HZ = 20
+
+# commands that are sent right away and clear everything that is queued
+_IMMEDIATE_COMMANDS = ('emergency',)
+
+
+class CommandDispatcher:
+    """
+    Queue Tello commands on a worker thread and coalesce RC setpoints.
+
+    :param tello: The djitellopy Tello object
+    :type tello: Tello
+    :param rc_rate_hz: Rate the latest RC setpoint is sent at
+    :type rc_rate_hz: float
+    :param metrics: PipelineMetrics that queue wait and acknowledgement times are recorded in. None - do not record
+    :type metrics: PipelineMetrics
+    """
+
+    def __init__(self, tello, rc_rate_hz=RC_RATE_HZ, metrics=None):
+        self.tello = tello
+        self.metrics = metrics
+        self.rc_period = 1.0 / rc_rate_hz
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._rc_lock = threading.Lock()
+        self._rc_setpoint = None
+        self._rc_dirty = False
+        self._threads = []
+        # called with (name, args, kwargs) for every command and RC setpoint, for example by a session recorder
+        self.listeners = []
+
+        self.commands_sent = 0
+        self.rc_updates = 0
+        self.rc_sent = 0
+
+    def start(self):
+        for target, name in ((self._command_loop, "tello-commands"), (self._rc_loop, "tello-rc")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        self.clear()
+        self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        LOGGER.info(f"Command dispatcher commands: {self.commands_sent}, rc updates: {self.rc_updates}, "
+                    f"rc sent: {self.rc_sent}")
+
+    def submit(self, name, *args, **kwargs):
+        """
+        Queue a Tello method call.
+
+        :param name: Name of the Tello method, for example 'move_up'
+        :type name: str
+        :return: Future that completes with the return value of the Tello method
+        :rtype: concurrent.futures.Future
+        """
+        for listener in self.listeners:
+            listener(name, args, kwargs)
+
+        future = Future()
+        if self._stop_event.is_set():
+            future.set_exception(RuntimeError("Command dispatcher is stopped"))
+            return future
+
+        if name in _IMMEDIATE_COMMANDS:
+            self.clear()
+            self._execute(future, name, args, kwargs, time.time())
+            return future
+
+        self._queue.put((future, name, args, kwargs, time.time()))
+        return future
+
+    def clear(self):
+        """
+        Cancel every command that has not been sent yet.
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        """
+        Update the RC setpoint.  Returns immediately, the rc timer sends it.
+        """
+        for listener in self.listeners:
+            listener('send_rc_control', (left_right_velocity, forward_backward_velocity, up_down_velocity,
+                                         yaw_velocity), {})
+        with self._rc_lock:
+            self._rc_setpoint = (int(left_right_velocity), int(forward_backward_velocity),
+                                 int(up_down_velocity), int(yaw_velocity))
+            if self._rc_dirty and self.metrics:
+                # the previous setpoint was never sent
+                self.metrics.count('rc_coalesced')
+            self._rc_dirty = True
+            self.rc_updates += 1
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        attr = getattr(self.tello, name)
+        # get_* reads the last state packet djitellopy received and attributes are plain
+        # values, neither talks to the drone.  query_* is a round trip on the command
+        # socket like any other command, so it is queued and returns a Future
+        if not callable(attr) or name.startswith('get_'):
+            return attr
+
+        def queued(*args, **kwargs):
+            return self.submit(name, *args, **kwargs)
+
+        return queued
+
+    def _execute(self, future, name, args, kwargs, queued_time):
+        if not future.set_running_or_notify_cancel():
+            return
+        sent_time = time.time()
+        try:
+            result = getattr(self.tello, name)(*args, **kwargs)
+            self.commands_sent += 1
+            future.set_result(result)
+        except Exception as exc:
+            LOGGER.error(f"Tello command {name}{args} failed: {exc}")
+            future.set_exception(exc)
+        finally:
+            if self.metrics:
+                self.metrics.span('command_queue', queued_time, sent_time)
+                self.metrics.span(f'command_ack_{name}', sent_time, time.time())
+                self.metrics.count('commands_sent')
+
+    def _command_loop(self):
+        while not self._stop_event.is_set():
+            item = self._queue.get()
+            if item is None:
+                break
+            self._execute(*item)
+
+    def _rc_loop(self):
+        next_send = time.time()
+        while not self._stop_event.is_set():
+            with self._rc_lock:
+                setpoint = self._rc_setpoint
+                dirty = self._rc_dirty
+                self._rc_dirty = False
+
+            # keep sending a moving setpoint so the drone does not time it out,
+            # a hover setpoint only needs to be sent once
+            if setpoint is not None and (dirty or any(setpoint)):
+                try:
+                    self.tello.send_rc_control(*setpoint)
+                    self.rc_sent += 1
+                    if self.metrics:
+                        self.metrics.count('rc_sent')
+                except Exception as exc:
+                    LOGGER.error(f"send_rc_control failed: {exc}")
+
+            next_send += self.rc_period
+            delay = next_send - time.time()
+            if delay < 0:
+                next_send = time.time()
+                delay = 0
+            self._stop_event.wait(delay)
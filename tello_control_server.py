@@ -0,0 +1,196 @@
+"""
+Control the Tello script runner without any windows.
+
+ControlServer takes the keyboard window commands, the same keys as
+KEY_COMMANDS, from a local TCP port, a local UDP port or stdin.  A command is
+one line, or one datagram, holding the key or the command name, for example
+'w', 'forward', 'l' or 'land'.  'esc' or 'quit' stops the runner like the ESC
+key does.  Every command gets one reply line: 'ok <command>' or 'error <reason>'.
+
+Commands are sent from the thread that received them, so there is no polling
+interval between a command arriving and it being handed to the Tello.
+
+    python tello_script_runner.py --headless --control-tcp 8899 --handler sample_user_script --fly
+    printf 'r\\n' | nc -q 1 127.0.0.1 8899
+
+"""
+import logging
+import socket
+import sys
+import threading
+import time
+
+from tello_key_commands import ALWAYS_SEND_KEYS, EXIT_KEYS, KEY_COMMANDS, LatencyStats
+
+LOGGER = logging.getLogger()
+
+# only local clients can fly the drone
+CONTROL_HOST = '127.0.0.1'
+
+# command words that stop the runner, like the ESC key
+QUIT_COMMANDS = ('esc', 'quit')
+
+
+def _command_aliases():
+    """
+    Map every key and every lower case display text, with spaces replaced by _, to its key.
+    """
+    aliases = {}
+    for key, (text, _, _) in KEY_COMMANDS.items():
+        aliases[key] = key
+        aliases[text.lower().replace(' ', '_')] = key
+    return aliases
+
+
+class ControlServer:
+    """
+    Receive keyboard commands over TCP, UDP or stdin and send them to the Tello.
+
+    :param get_tello: Function returning the Tello or command dispatcher to send commands to, None while not connected
+    :type get_tello: callable
+    :param fly: Flag indicating if the Tello is set to fly.  Like the keyboard, only the emergency stop is sent without it
+    :type fly: bool
+    :param tcp_port: Local TCP port to listen on.  None - no TCP
+    :type tcp_port: int
+    :param udp_port: Local UDP port to listen on.  None - no UDP
+    :type udp_port: int
+    :param stdin: Read commands from stdin
+    :type stdin: bool
+    :param host: Address to listen on
+    :type host: str
+    """
+
+    def __init__(self, get_tello, fly=False, tcp_port=None, udp_port=None, stdin=False, host=CONTROL_HOST):
+        self.get_tello = get_tello
+        self.fly = fly
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        self.stdin = stdin
+        self.host = host
+        # set by a land, emergency or quit command
+        self.exit_event = threading.Event()
+        self.dispatch_latency = LatencyStats()
+        self.ack_latency = LatencyStats()
+        self._aliases = _command_aliases()
+        self._stop_event = threading.Event()
+        self._sockets = []
+        self._threads = []
+
+    def start(self):
+        if self.tcp_port is not None:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.tcp_port))
+            server.listen(4)
+            self._sockets.append(server)
+            self._start_thread(self._tcp_accept_loop, "control-tcp", server)
+        if self.udp_port is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.host, self.udp_port))
+            self._sockets.append(sock)
+            self._start_thread(self._udp_loop, "control-udp", sock)
+        if self.stdin:
+            self._start_thread(self._stdin_loop, "control-stdin")
+        return self
+
+    def _start_thread(self, target, name, *args):
+        t = threading.Thread(target=target, args=args, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self):
+        self._stop_event.set()
+        for sock in self._sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        LOGGER.info(f"Control command latency: {self.latency_stats()}")
+
+    def handle(self, line):
+        """
+        Carry out one command.
+
+        :param line: Key or command name
+        :type line: str
+        :return: The reply line, without a newline
+        :rtype: str
+        """
+        received = time.time()
+        word = line.strip().lower()
+        if not word:
+            return "error empty command"
+        if word in QUIT_COMMANDS:
+            self.exit_event.set()
+            return "ok quit"
+
+        key = self._aliases.get(word)
+        if key is None:
+            return f"error unknown command {word}"
+
+        text, method, args = KEY_COMMANDS[key]
+        tello = self.get_tello()
+        if method and (self.fly or key in ALWAYS_SEND_KEYS):
+            if tello is None:
+                return "error not connected"
+            try:
+                self._send(tello, method, args, received)
+            except Exception as exc:
+                LOGGER.error(f"Control command {text} failed: {exc}")
+                return f"error {exc}"
+
+        if key in EXIT_KEYS:
+            self.exit_event.set()
+        return f"ok {text}"
+
+    def _send(self, tello, method, args, received):
+        result = getattr(tello, method)(*args)
+        self.dispatch_latency.add(time.time() - received)
+
+        if hasattr(result, 'add_done_callback'):
+            # the command dispatcher returns a Future
+            result.add_done_callback(lambda f: self.ack_latency.add(time.time() - received))
+        else:
+            self.ack_latency.add(time.time() - received)
+
+    def _tcp_accept_loop(self, server):
+        while not self._stop_event.is_set():
+            try:
+                conn, address = server.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            LOGGER.info(f"Control client connected from {address}")
+            self._start_thread(self._tcp_client_loop, "control-tcp-client", conn)
+
+    def _tcp_client_loop(self, conn):
+        with conn, conn.makefile('r', encoding='ascii', errors='ignore') as lines:
+            for line in lines:
+                reply = self.handle(line)
+                try:
+                    conn.sendall((reply + "\n").encode('ascii'))
+                except OSError:
+                    break
+                if self._stop_event.is_set():
+                    break
+
+    def _udp_loop(self, sock):
+        while not self._stop_event.is_set():
+            try:
+                packet, address = sock.recvfrom(256)
+            except OSError:
+                break
+            reply = self.handle(packet.decode('ascii', errors='ignore'))
+            try:
+                sock.sendto(reply.encode('ascii'), address)
+            except OSError:
+                pass
+
+    def _stdin_loop(self):
+        for line in sys.stdin:
+            print(self.handle(line), flush=True)
+            if self._stop_event.is_set():
+                break
+
+    def latency_stats(self):
+        return {'dispatch': self.dispatch_latency.summary(), 'ack': self.ack_latency.summary()}
@@ -0,0 +1,306 @@
+"""
+Run an OpenCV DNN model next to the handler instead of inside it.
+
+A handler that calls cv2.dnn itself loads the network in init, builds a new
+blob for every frame and waits for forward() before the video loop can go on.
+InferenceStage does this for the handler:
+
+    python tello_script_runner.py --handler my_handler --dnn-model models/MobileNetSSD_deploy.caffemodel \\
+        --dnn-config models/MobileNetSSD_deploy.prototxt --dnn-threads 2 --fly
+
+The runner loads the model before takeoff, runs one forward pass on an empty
+blob so the first real frame does not pay for the lazy setup of the backend,
+and hands every new frame to a pool of worker threads.  Each worker has its own
+copy of the network and its own preallocated input blob, so after the first
+frame no blob memory is allocated.  The frame is resized into the worker's
+input buffer before submit returns, so the handler can draw on the frame while
+the model runs.  When all workers are busy the frame is not queued, the next
+frame will be newer anyway.
+
+Results arrive asynchronously.  Every result carries the sequence number of
+the frame it was computed on, and the newest one is attached to the frame the
+handler gets:
+
+    def handler(tello, frame, fly_flag=False):
+        if frame is None or frame.inference is None:
+            return
+        result = frame.inference
+        print(frame.seq - result.seq, result.output.shape)
+
+Loaded networks are kept in a module level cache, keyed by model file and
+worker, so a handler reloaded with --hot-reload, or a second InferenceStage on
+the same model, gets the already loaded and warmed up network.  A handler that
+runs its own model can use load_model for the same cache.
+
+"""
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from tello_frame_source import FrameMailbox
+from tello_metrics import METRICS
+
+LOGGER = logging.getLogger()
+
+# defaults suit the MobileNet SSD caffe model, see benchmarks/dnn_handler.py
+DNN_INPUT_SIZE = (300, 300)
+DNN_SCALE = 0.007843
+DNN_MEAN = (127.5, 127.5, 127.5)
+DNN_THREADS = 1
+
+# seq, timestamp - of the frame the model ran on
+# output - return value of net.forward
+# inference_ms - blob preparation and forward pass
+InferenceResult = namedtuple('InferenceResult', ['seq', 'timestamp', 'output', 'inference_ms'])
+
+# (model, config, backend, target, instance): network
+_NETS = {}
+# keys of the networks that ran their warm up pass
+_WARM = set()
+_NETS_LOCK = threading.Lock()
+
+
+def load_model(model, config='', backend=None, target=None, instance=0):
+    """
+    Load a network with cv2.dnn.readNet, or return the one loaded before.
+
+    :param model: Model file, e.g. .caffemodel, .onnx or .pb
+    :type model: str
+    :param config: Config file the model needs, e.g. .prototxt.  '' - none
+    :type config: str
+    :param backend: cv2.dnn.DNN_BACKEND_* value.  None - the OpenCV default
+    :param target: cv2.dnn.DNN_TARGET_* value.  None - the OpenCV default
+    :param instance: Networks cannot run two forward passes at the same time, every thread uses its own instance
+    :type instance: int
+    :rtype: cv2.dnn.Net
+    """
+    key = (model, config, backend, target, instance)
+    with _NETS_LOCK:
+        net = _NETS.get(key)
+        if net is None:
+            start = time.time()
+            net = cv2.dnn.readNet(model, config)
+            if backend is not None:
+                net.setPreferableBackend(backend)
+            if target is not None:
+                net.setPreferableTarget(target)
+            _NETS[key] = net
+            LOGGER.info(f"Loaded {model} instance {instance} in {(time.time() - start) * 1000.0:.0f} ms")
+        return net
+
+
+def clear_models():
+    """
+    Forget all cached networks.
+    """
+    with _NETS_LOCK:
+        _NETS.clear()
+        _WARM.clear()
+
+
+class _Worker:
+    """
+    Network and input buffers of one worker thread.
+    """
+
+    def __init__(self, key, net, input_size):
+        width, height = input_size
+        self.key = key
+        self.net = net
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.swapped = np.empty((height, width, 3), dtype=np.uint8)
+        self.scaled = np.empty((height, width, 3), dtype=np.float32)
+        self.blob = np.zeros((1, 3, height, width), dtype=np.float32)
+
+
+class InferenceStage:
+    """
+    Run a DNN model on video frames on a pool of worker threads.
+
+    :param model: Model file cv2.dnn.readNet can load
+    :type model: str
+    :param config: Config file the model needs.  '' - none
+    :type config: str
+    :param input_size: (width, height) of the model input
+    :type input_size: tuple
+    :param scale: Multiplier applied after the mean is subtracted, like in cv2.dnn.blobFromImage
+    :type scale: float
+    :param mean: Subtracted from every channel, in the channel order of the model input
+    :type mean: tuple
+    :param swap_rb: Give the model RGB instead of BGR
+    :type swap_rb: bool
+    :param threads: Worker threads, each with its own network.  OpenCV releases the GIL during forward
+    :type threads: int
+    :param outputs: Output layer names to return.  None - the default output of forward()
+    :type outputs: list
+    """
+
+    def __init__(self, model, config='', input_size=DNN_INPUT_SIZE, scale=DNN_SCALE, mean=DNN_MEAN, swap_rb=False,
+                 threads=DNN_THREADS, outputs=None, backend=None, target=None):
+        if threads < 1:
+            raise ValueError("An inference stage needs at least one thread")
+        self.model = model
+        self.config = config
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.mean = np.array(mean, dtype=np.float32)
+        self.swap_rb = swap_rb
+        self.threads = threads
+        self.outputs = outputs
+        self.backend = backend
+        self.target = target
+        # newest result, readers can wait on it like on the video mailbox
+        self.results = FrameMailbox()
+        self.listeners = []
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        # frames not run because every worker was busy
+        self.frames_dropped = 0
+        # results that finished after a result for a newer frame
+        self.results_stale = 0
+        self.busy_seconds = 0.0
+        self._free = queue.Queue()
+        self._pool = None
+        self._stopped = False
+        self._result_lock = threading.Lock()
+
+    def start(self, warm_up=True):
+        """
+        Load, or take from the cache, one network per thread and run the warm up pass.  Blocks until done.
+        """
+        for instance in range(self.threads):
+            key = (self.model, self.config, self.backend, self.target, instance)
+            net = load_model(self.model, self.config, self.backend, self.target, instance)
+            worker = _Worker(key, net, self.input_size)
+            if warm_up:
+                self._warm_up(worker)
+            self._free.put(worker)
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="inference")
+        return self
+
+    def _warm_up(self, worker):
+        with _NETS_LOCK:
+            if worker.key in _WARM:
+                return
+            _WARM.add(worker.key)
+        start = time.time()
+        self._forward(worker)
+        LOGGER.info(f"Warmed up {self.model} instance {worker.key[-1]} in {(time.time() - start) * 1000.0:.0f} ms")
+
+    def _prepare(self, worker):
+        # the same steps as cv2.dnn.blobFromImage, from the resized input into the worker's buffers
+        pixels = worker.resized
+        if self.swap_rb:
+            cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB, dst=worker.swapped)
+            pixels = worker.swapped
+        np.subtract(pixels, self.mean, out=worker.scaled)
+        if self.scale != 1.0:
+            np.multiply(worker.scaled, self.scale, out=worker.scaled)
+        np.copyto(worker.blob[0], worker.scaled.transpose(2, 0, 1))
+
+    def _forward(self, worker):
+        worker.net.setInput(worker.blob)
+        if self.outputs:
+            return worker.net.forward(self.outputs)
+        return worker.net.forward()
+
+    def submit(self, frame):
+        """
+        Start inference on the frame if a worker is free.  Never blocks.
+
+        :param frame: Video frame.  It is copied into the worker's input buffer before submit returns
+        :type frame: TelloFrame
+        :return: Future of the InferenceResult, None when the frame was dropped
+        """
+        if frame is None or self._pool is None or self._stopped:
+            return None
+        try:
+            worker = self._free.get_nowait()
+        except queue.Empty:
+            self.frames_dropped += 1
+            METRICS.count('inference_frames_dropped')
+            return None
+
+        start = time.time()
+        # the full size source, when there is one, is never drawn on and gives the sharper input
+        source = getattr(frame, 'source', None)
+        cv2.resize(source if source is not None else frame, self.input_size, dst=worker.resized)
+        self.submitted += 1
+        try:
+            return self._pool.submit(self._run, worker, frame.seq, frame.timestamp, start)
+        except RuntimeError:
+            # stopped meanwhile
+            self._free.put(worker)
+            return None
+
+    def _run(self, worker, seq, timestamp, start):
+        try:
+            self._prepare(worker)
+            output = self._forward(worker)
+        except Exception as exc:
+            with self._result_lock:
+                self.errors += 1
+            LOGGER.error(f"Inference failed on frame {seq}: {exc}")
+            return None
+        finally:
+            self._free.put(worker)
+        end = time.time()
+        METRICS.span('inference', start, end, seq)
+        result = InferenceResult(seq, timestamp, output, (end - start) * 1000.0)
+
+        with self._result_lock:
+            if self._stopped:
+                # the results mailbox is closed
+                return result
+            self.completed += 1
+            self.busy_seconds += end - start
+            latest = self.results.latest
+            if latest is not None and latest.seq > seq:
+                # with several threads a slow frame can finish after a newer one
+                self.results_stale += 1
+            else:
+                self.results.put(result)
+        for listener in self.listeners:
+            listener(result)
+        return result
+
+    @property
+    def latest(self):
+        """
+        Newest InferenceResult, or None before the first one.
+        """
+        return self.results.latest
+
+    def __call__(self, tello, frame, fly=False):
+        self.submit(frame)
+
+    def stop(self, timeout=1.0):
+        """
+        Wait up to timeout seconds for running forward passes, then close the results.  Later results are dropped.
+        """
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            # every worker is back in the free queue once its forward pass is done
+            deadline = time.time() + timeout
+            for _ in range(self.threads):
+                try:
+                    self._free.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    LOGGER.error("Inference did not finish within the stop timeout")
+                    break
+        with self._result_lock:
+            self._stopped = True
+            self.results.close()
+        LOGGER.info(f"Inference: {self.stats()}")
+
+    def stats(self):
+        return {'submitted': self.submitted, 'completed': self.completed, 'errors': self.errors,
+                'dropped': self.frames_dropped, 'stale': self.results_stale,
+                'mean_ms': round(self.busy_seconds / self.completed * 1000.0, 2) if self.completed else None}
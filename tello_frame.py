@@ -0,0 +1,186 @@
+"""
+Video frame handed to the user handler.
+
+TelloFrame is a numpy array holding the resized BGR image, so existing handlers
+that treat the frame as an image keep working.  On top of that it computes
+derived views the first time they are asked for, and caches them on the frame:
+
+    frame.gray          grayscale
+    frame.hsv           HSV
+    frame.pyramid(2)    image downscaled twice with pyrDown
+    frame.resized(320)  image resized to another width, made from the full size source
+
+The handler, the display and any other consumer of the same frame share one
+copy of every view, so converting to gray or HSV happens at most once per frame.
+
+All images are written into buffers from a BufferPool.  A buffer goes back to
+the pool automatically when nothing references it any more, so after the first
+few frames no new image memory is allocated.  The views are shared, treat
+them as read only.
+
+"""
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+# references to a pooled buffer while the pool checks it: the pool list,
+# the loop variable and the getrefcount argument
+_FREE_REFCOUNT = 3
+
+
+class BufferPool:
+    """
+    Reuse image buffers of the same shape and dtype.
+
+    :param max_per_shape: Maximum number of buffers kept for one shape and dtype
+    :type max_per_shape: int
+    """
+
+    def __init__(self, max_per_shape=8):
+        self.max_per_shape = max_per_shape
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Return a buffer nobody else references, allocating one if needed.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._buffers.setdefault(key, [])
+            for buf in buffers:
+                if sys.getrefcount(buf) <= _FREE_REFCOUNT:
+                    self.reused += 1
+                    return buf
+
+            buf = np.empty(shape, dtype=dtype)
+            self.allocated += 1
+            if len(buffers) < self.max_per_shape:
+                buffers.append(buf)
+            return buf
+
+    def stats(self):
+        return {'allocated': self.allocated, 'reused': self.reused}
+
+
+FRAME_POOL = BufferPool()
+
+
+def _resized_shape(image, width):
+    (h, w) = image.shape[:2]
+    height = int(h * width / float(w))
+    return (height, width) + image.shape[2:]
+
+
+class TelloFrame(np.ndarray):
+    """
+    Resized video frame with lazily computed, cached derived views.
+
+    Use TelloFrame.from_image to create one.
+
+    :ivar seq: Frame sequence number from the FrameSource
+    :ivar timestamp: Capture time of the frame
+    :ivar source: Full size decoded image the frame was made from
+    :ivar unchanged: True when the motion gate saw no change since the last frame that changed
+    :ivar inference: Newest InferenceResult of the runner's DNN stage, possibly of an earlier frame, or None
+    """
+
+    @classmethod
+    def from_image(cls, source, width, seq=0, timestamp=None, pool=FRAME_POOL):
+        """
+        Resize the decoded image into a pooled buffer and wrap it in a TelloFrame.
+
+        :param source: Decoded BGR image
+        :type source: numpy.ndarray
+        :param width: Width of the frame, the height keeps the aspect ratio
+        :type width: int
+        :param pool: BufferPool for the frame and its views.  None - allocate them
+        :type pool: BufferPool
+        """
+        shape = _resized_shape(source, width)
+        if shape == source.shape:
+            buf = source
+        else:
+            buf = pool.acquire(shape, source.dtype) if pool is not None else np.empty(shape, dtype=source.dtype)
+            cv2.resize(source, (shape[1], shape[0]), dst=buf, interpolation=cv2.INTER_AREA)
+
+        frame = buf.view(cls)
+        frame.seq = seq
+        frame.timestamp = timestamp
+        frame.source = source
+        frame.unchanged = False
+        frame.inference = None
+        frame._pool = pool
+        return frame
+
+    def __array_finalize__(self, obj):
+        # slices and numpy results of a frame do not share its cached views
+        self.seq = getattr(obj, 'seq', 0)
+        self.timestamp = getattr(obj, 'timestamp', None)
+        self.source = None
+        self.unchanged = getattr(obj, 'unchanged', False)
+        self.inference = getattr(obj, 'inference', None)
+        self._pool = getattr(obj, '_pool', FRAME_POOL)
+        self._views = {}
+
+    def _image(self):
+        return self.view(np.ndarray)
+
+    def _acquire(self, shape, dtype):
+        if self._pool is None:
+            # frames in shared memory, in the handler process, are not pooled
+            return np.empty(shape, dtype=dtype)
+        return self._pool.acquire(shape, dtype)
+
+    def _cached(self, key, shape, compute):
+        view = self._views.get(key)
+        if view is None:
+            view = self._acquire(shape, np.uint8)
+            compute(view)
+            self._views[key] = view
+        return view
+
+    @property
+    def gray(self):
+        return self._cached('gray', self.shape[:2],
+                            lambda dst: cv2.cvtColor(self._image(), cv2.COLOR_BGR2GRAY, dst=dst))
+
+    @property
+    def hsv(self):
+        return self._cached('hsv', self.shape,
+                            lambda dst: cv2.cvtColor(self._image(), cv2.COLOR_BGR2HSV, dst=dst))
+
+    def pyramid(self, level=1):
+        """
+        The frame downscaled level times with cv2.pyrDown.  Level 0 is the frame itself.
+        """
+        if level <= 0:
+            return self._image()
+        key = ('pyramid', level)
+        view = self._views.get(key)
+        if view is None:
+            upper = self.pyramid(level - 1)
+            (h, w) = upper.shape[:2]
+            shape = ((h + 1) // 2, (w + 1) // 2) + upper.shape[2:]
+            view = self._acquire(shape, upper.dtype)
+            cv2.pyrDown(upper, dst=view, dstsize=(shape[1], shape[0]))
+            self._views[key] = view
+        return view
+
+    def resized(self, width):
+        """
+        The image resized to width, made from the full size source when there is one.
+        """
+        key = ('resize', width)
+        view = self._views.get(key)
+        if view is None:
+            source = self.source if self.source is not None else self._image()
+            shape = _resized_shape(source, width)
+            view = self._acquire(shape, source.dtype)
+            cv2.resize(source, (shape[1], shape[0]), dst=view, interpolation=cv2.INTER_AREA)
+            self._views[key] = view
+        return view
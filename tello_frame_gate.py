@@ -0,0 +1,93 @@
+"""
+Detect duplicate and unchanged video frames before the handler sees them.
+
+A FrameSource publishes every decoded frame once, but a decoder can still hand
+out the same image again, or the same pixels in a new buffer, for example when
+it repeats the last picture over lost packets.  FrameGate catches both: the
+same image object is a duplicate, and so is an image whose downsampled
+thumbnail has the same checksum as the previous one.  Duplicates are dropped
+before they are resized.
+
+With a motion threshold the gate also compares a small grayscale thumbnail
+with the thumbnail of the last frame that changed.  A mean absolute difference
+below the threshold, in gray levels from 0 to 255, makes the frame still.
+Still frames skip the handler, or reach it with frame.unchanged set, so a
+hovering drone looking at the same scene costs next to nothing.  The
+reference only moves when a frame changed, so slow drift still adds up to a
+change.
+
+"""
+import zlib
+
+DUPLICATE = 'duplicate'
+STILL = 'still'
+CHANGED = 'changed'
+
+# size of the thumbnails the checks are made on
+THUMBNAIL_SIZE = (64, 48)
+
+
+class FrameGate:
+    """
+    Classify each decoded image as DUPLICATE, STILL or CHANGED.
+
+    :param motion_threshold: Mean absolute gray level difference below which a frame is still.  None - no motion gate
+    :type motion_threshold: float
+    :param skip_still: True - the handler is not called for still frames.  False - it is, with frame.unchanged set
+    :type skip_still: bool
+    :param size: (width, height) of the thumbnails
+    :type size: tuple
+    """
+
+    def __init__(self, motion_threshold=None, skip_still=True, size=THUMBNAIL_SIZE):
+        self.motion_threshold = motion_threshold
+        self.skip_still = skip_still
+        self.size = size
+        self.frames_checked = 0
+        self.duplicates = 0
+        self.still = 0
+        self._last_image = None
+        self._last_checksum = None
+        self._reference = None
+        # allocated by the first check and reused after that
+        self._thumbnail = None
+        self._gray = None
+
+    def check(self, image):
+        """
+        :param image: Full size decoded BGR image
+        :type image: numpy.ndarray
+        :return: DUPLICATE, STILL or CHANGED
+        :rtype: str
+        """
+        # imported here so the runner can create a gate before OpenCV and numpy are loaded
+        import cv2
+
+        self.frames_checked += 1
+        if image is self._last_image:
+            self.duplicates += 1
+            return DUPLICATE
+        self._last_image = image
+
+        self._thumbnail = cv2.resize(image, self.size, dst=self._thumbnail, interpolation=cv2.INTER_AREA)
+        checksum = zlib.crc32(self._thumbnail)
+        if checksum == self._last_checksum:
+            self.duplicates += 1
+            return DUPLICATE
+        self._last_checksum = checksum
+
+        if self.motion_threshold is None:
+            return CHANGED
+
+        self._gray = cv2.cvtColor(self._thumbnail, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        if self._reference is not None:
+            if cv2.absdiff(self._gray, self._reference).mean() < self.motion_threshold:
+                self.still += 1
+                return STILL
+            self._reference[...] = self._gray
+        else:
+            self._reference = self._gray.copy()
+        return CHANGED
+
+    def stats(self):
+        return {'frames_checked': self.frames_checked, 'duplicates': self.duplicates, 'still': self.still}
@@ -0,0 +1,114 @@
+"""
+Choose which video frames the handler runs on.
+
+The runner loop always takes the newest decoded frame, so a slow handler never
+works through a backlog.  FrameScheduler decides whether the handler runs on
+that frame, the frame is displayed and recorded either way:
+
+    latest      every new frame.  A handler slower than the video skips the frames decoded while it ran
+    every-nth   every nth decoded frame
+    target-fps  at most fps frames a second
+    adaptive    as many frames as keep the measured handler cost below a fraction, the budget, of the
+                wall clock time.  An 80 ms handler with a budget of 0.5 runs about 6 times a second
+
+The handler cost is measured on every call and smoothed, and the frames the
+handler did not run on are counted, so the decision latency and the skipped
+frames show up in the metrics.
+
+"""
+import logging
+import time
+
+LOGGER = logging.getLogger()
+
+LATEST = 'latest'
+EVERY_NTH = 'every-nth'
+TARGET_FPS = 'target-fps'
+ADAPTIVE = 'adaptive'
+POLICIES = (LATEST, EVERY_NTH, TARGET_FPS, ADAPTIVE)
+
+# weight of the newest handler run in the smoothed handler cost
+COST_SMOOTHING = 0.2
+
+
+class FrameScheduler:
+    """
+    Frame selection policy for the handler.
+
+    :param policy: One of POLICIES
+    :type policy: str
+    :param every: Run on every nth frame, for every-nth
+    :type every: int
+    :param fps: Maximum handler runs per second, for target-fps
+    :type fps: float
+    :param budget: Fraction of the time the handler may run, for adaptive.  Between 0 and 1
+    :type budget: float
+    """
+
+    def __init__(self, policy=LATEST, every=2, fps=10.0, budget=0.5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown frame policy {policy}, use one of {', '.join(POLICIES)}")
+        if policy == EVERY_NTH and every < 1:
+            raise ValueError("every must be at least 1")
+        if policy == TARGET_FPS and fps <= 0:
+            raise ValueError("fps must be greater than 0")
+        if policy == ADAPTIVE and not 0 < budget <= 1:
+            raise ValueError("budget must be greater than 0 and at most 1")
+        self.policy = policy
+        self.every = every
+        self.fps = fps
+        self.budget = budget
+
+        # smoothed seconds per handler run, None until the handler ran once
+        self.handler_cost = None
+        self.frames_offered = 0
+        self.frames_handled = 0
+        # frames the policy chose not to run the handler on
+        self.frames_skipped = 0
+        self._last_handled_seq = 0
+        self._next_time = 0
+
+    def select(self, seq, now=None):
+        """
+        Should the handler run on frame seq?
+
+        :param seq: Sequence number of the newest decoded frame
+        :type seq: int
+        :rtype: bool
+        """
+        self.frames_offered += 1
+        if self.policy == LATEST:
+            run = True
+        elif self.policy == EVERY_NTH:
+            run = self._last_handled_seq == 0 or seq - self._last_handled_seq >= self.every
+        else:
+            now = time.time() if now is None else now
+            run = now >= self._next_time
+        if not run:
+            self.frames_skipped += 1
+        return run
+
+    def handled(self, seq, start, end):
+        """
+        Record a handler run on frame seq from start to end.
+        """
+        cost = end - start
+        if self.handler_cost is None:
+            self.handler_cost = cost
+        else:
+            self.handler_cost += COST_SMOOTHING * (cost - self.handler_cost)
+        self.frames_handled += 1
+        self._last_handled_seq = seq
+
+        if self.policy == TARGET_FPS:
+            self._next_time = start + 1.0 / self.fps
+        elif self.policy == ADAPTIVE:
+            # the handler runs for cost, then the rest of the period belongs to everything else
+            self._next_time = start + self.handler_cost / self.budget
+
+    def stats(self):
+        return {'policy': self.policy,
+                'frames_offered': self.frames_offered,
+                'frames_handled': self.frames_handled,
+                'frames_skipped': self.frames_skipped,
+                'handler_cost_ms': round(self.handler_cost * 1000.0, 2) if self.handler_cost is not None else None}
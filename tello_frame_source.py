@@ -0,0 +1,252 @@
+"""
+Event driven video frame delivery.
+
+A FrameSource owns a capture thread that blocks on the video decoder and
+publishes every decoded frame exactly once, tagged with a monotonically
+increasing sequence number and the capture timestamp.  Consumers block on
+`next_frame` until a frame newer than the last one they saw is available,
+so nothing is ever processed twice and nobody spins while waiting.
+
+Frames are handed between threads through a FrameMailbox: a single slot that
+is overwritten on every put.  Readers get a reference to the newest frame,
+never a copy, and a slow reader simply skips the frames it was too slow for
+instead of building up a backlog.
+
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+LOGGER = logging.getLogger()
+
+# seq - starts at 1 and increases by one for every decoded frame
+# timestamp - time.time() when the decoder returned the frame
+# image - the decoded BGR image
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image'])
+
+
+class FrameMailbox:
+    """
+    Single slot, overwrite-on-write channel holding the latest Frame.
+
+    Any number of readers can wait on the mailbox.  Each reader remembers the
+    sequence number of the last frame it took, and gets the newest frame after
+    that one.  The frame object is shared, so readers must not modify the image.
+
+    Frames a reader never saw because newer ones were put before it came back
+    are counted per reader, by the thread name or the reader argument of get.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest = None
+        self._closed = False
+        self.puts = 0
+        # reader name: number of puts when it last took a frame
+        self._readers = {}
+        # reader name: frames put that the reader skipped
+        self.reader_drops = {}
+        # reader_drops summed over all readers
+        self.dropped = 0
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def put(self, frame):
+        with self._condition:
+            self._latest = frame
+            self.puts += 1
+            self._condition.notify_all()
+
+    def get(self, after_seq=0, timeout=None, reader=None):
+        """
+        Block until a frame with a sequence number greater than after_seq is available.
+
+        :param after_seq: Sequence number of the last frame the caller took
+        :type after_seq: int
+        :param timeout: Maximum number of seconds to wait. None - wait forever, 0 - do not wait
+        :type timeout: float
+        :param reader: Name the skipped frames are counted under.  None - the name of the calling thread
+        :type reader: str
+        :return: The newest Frame, or None on timeout or when the mailbox was closed
+        :rtype: Frame
+        """
+        with self._condition:
+            ready = self._condition.wait_for(
+                lambda: self._closed or (self._latest is not None and self._latest.seq > after_seq),
+                timeout=timeout)
+            if not ready or self._latest is None or self._latest.seq <= after_seq:
+                # timed out, or closed with nothing new left to read
+                return None
+
+            # counted from the puts, not the seq numbers, a producer may skip seq numbers on purpose
+            name = reader if reader is not None else threading.current_thread().name
+            taken = self._readers.get(name)
+            if taken is not None and self.puts - taken > 1:
+                missed = self.puts - taken - 1
+                self.reader_drops[name] = self.reader_drops.get(name, 0) + missed
+                self.dropped += missed
+            self._readers[name] = self.puts
+            # wakes a producer waiting in wait_taken
+            self._condition.notify_all()
+            return self._latest
+
+    def wait_taken(self, reader, timeout=None):
+        """
+        Block until the reader took the newest frame, so a producer can hand over frames without drops.
+
+        :param reader: Name the reader takes frames under, see get
+        :type reader: str
+        :param timeout: Maximum number of seconds to wait. None - wait forever
+        :type timeout: float
+        :return: False on timeout, True otherwise, also when the mailbox was closed
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._closed or self._readers.get(reader, 0) >= self.puts,
+                                            timeout=timeout)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {'puts': self.puts, 'dropped': self.dropped, 'reader_drops': dict(self.reader_drops)}
+
+
+class FrameSource:
+    """
+    Publish frames from a blocking reader.
+
+    :param read_frame: Callable that blocks until the next frame is decoded and returns it.  Returns None
+                        when no frame could be read, raises EOFError at the end of a finite source
+                        like a video file.
+    :type read_frame: callable
+    :param name: Name of the capture thread
+    :type name: str
+    :param close: Optional callable used to release the underlying capture when the source stops
+    :type close: callable
+    """
+
+    def __init__(self, read_frame, name="frame-source", close=None):
+        self._read_frame = read_frame
+        self._close = close
+        self._name = name
+        self.mailbox = FrameMailbox()
+        self._seq = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.read_errors = 0
+        # set when a finite source has no more frames
+        self.finished = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._capture_loop, name=self._name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self.mailbox.close()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        if self._close:
+            try:
+                self._close()
+            except Exception as exc:
+                LOGGER.error(f"Error closing frame source: {exc}")
+
+    @property
+    def latest(self):
+        """
+        Most recently published Frame, or None if no frame has been decoded yet.
+        """
+        return self.mailbox.latest
+
+    def publish(self, image, timestamp=None):
+        """
+        Publish a frame.  Normally called by the capture thread, but it can also be
+        used to push frames from an external decoder.
+        """
+        self._seq += 1
+        frame = Frame(self._seq, timestamp if timestamp is not None else time.time(), image)
+        self.mailbox.put(frame)
+        return frame
+
+    def next_frame(self, after_seq=0, timeout=None):
+        """
+        Block until a frame with a sequence number greater than after_seq is available.
+
+        :param after_seq: Sequence number of the last frame the caller processed
+        :type after_seq: int
+        :param timeout: Maximum number of seconds to wait. None - wait forever
+        :type timeout: float
+        :return: The newest Frame, or None on timeout or when the source was stopped
+        :rtype: Frame
+        """
+        return self.mailbox.get(after_seq, timeout=timeout)
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                image = self._read_frame()
+            except EOFError:
+                break
+            except Exception as exc:
+                self.read_errors += 1
+                LOGGER.error(f"Exception getting video frame: {exc}")
+                image = None
+
+            if image is None:
+                # the decoder had nothing for us, do not spin on it
+                self._stop_event.wait(0.01)
+                continue
+
+            self.publish(image)
+
+        # readers still get the last frame, then next_frame returns None
+        self.finished = True
+        self.mailbox.close()
+        LOGGER.debug(f"Leaving {self._name} capture thread")
+
+
+def capture_frame_source(capture, name="frame-source"):
+    """
+    Create a FrameSource from an OpenCV VideoCapture.  VideoCapture.read blocks
+    until the next frame is decoded, so each frame is published once.
+    """
+    def read_frame():
+        ok, image = capture.read()
+        return image if ok else None
+
+    return FrameSource(read_frame, name=name, close=capture.release)
+
+
+def tello_frame_source(tello, address=None):
+    """
+    Create a FrameSource that decodes the Tello UDP video stream.  The caller must
+    have sent streamon.
+
+    :param address: Video address to decode. None - the Tello video address
+    :type address: str
+    """
+    import cv2
+
+    address = address or tello.get_udp_video_address()
+    # Tello video is only useful with the smallest possible decoder buffer
+    capture = cv2.VideoCapture(address)
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return capture_frame_source(capture, name="tello-video")
+
+
+def webcam_frame_source(src=0):
+    """
+    Create a FrameSource from a local camera, used as a simulated Tello video feed.
+    """
+    import cv2
+
+    return capture_frame_source(cv2.VideoCapture(src), name="webcam-video")
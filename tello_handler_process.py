@@ -0,0 +1,376 @@
+"""
+Run a user handler script in its own process.
+
+The handler's init and handler methods run in a worker process so a CPU heavy
+handler gets its own core and its own GIL, and cannot freeze the keyboard
+window or delay the emergency stop.
+
+Frames are passed through a preallocated multiprocessing.shared_memory ring.
+The video thread copies each frame into a free slot once, and the worker sees
+the slot as a TelloFrame without any further copy or pickling.  Only the slot
+number and the frame's seq, timestamp, unchanged and inference attributes
+travel over the pipe, so the handler gets the same frame as in the runner.  While the worker is busy, newer frames overwrite
+the pending slot, so the handler always gets the freshest frame.
+
+Tello commands issued by the handler are proxied back over a pipe and executed
+on the real Tello object in the runner process.  Attributes are read from the
+real Tello too, and objects like tello.telemetry are proxied the same way.  A
+command the command dispatcher queues returns a Future in the runner, the
+proxy waits for it, so the handler gets the drone's reply.  The handler runs in
+its own process, waiting does not hold up the video loop.
+
+"""
+import importlib
+import logging
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tello_frame import TelloFrame
+
+LOGGER = logging.getLogger()
+
+# number of frame slots in the shared memory ring.  One slot is held by the
+# worker while the next frame is written to another one
+RING_SLOTS = 2
+
+# seconds a proxied command may wait for the drone's reply, djitellopy itself retries for about 21
+COMMAND_REPLY_TIMEOUT = 30
+
+
+class TelloProxy:
+    """
+    Stand-in for the Tello object inside the worker process.  Every method call is
+    sent to the runner process, executed on the real Tello object and the result,
+    or exception, is returned.
+
+    Plain attribute values, like is_flying, are read from the runner process every
+    time.  Attributes that are objects, like telemetry, become a TelloProxy of
+    their own, so tello.telemetry.latest() runs on the real telemetry service.
+
+    :param conn: Pipe to serve_tello_commands in the runner process
+    :param path: Dotted attribute path of the proxied object, '' - the Tello itself
+    :type path: str
+    """
+
+    def __init__(self, conn, path='', lock=None):
+        self._conn = conn
+        self._path = path
+        self._lock = lock or threading.Lock()
+        # name: method or proxy, for the attributes that are not plain values
+        self._members = {}
+
+    def _request(self, msg):
+        with self._lock:
+            self._conn.send(msg)
+            return self._conn.recv()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        member = self._members.get(name)
+        if member is not None:
+            return member
+
+        path = f"{self._path}{name}"
+        status, result = self._request(('getattr', path))
+        if status == 'error':
+            raise AttributeError(f"Tello has no attribute {path}: {result}")
+        if status == 'value':
+            return result
+        member = self._method(path) if status == 'method' else TelloProxy(self._conn, f"{path}.", self._lock)
+        self._members[name] = member
+        return member
+
+    def _method(self, path):
+        def call(*args, **kwargs):
+            status, result = self._request(('call', path, args, kwargs))
+            if status == 'error':
+                raise RuntimeError(f"Tello.{path} failed: {result}")
+            return result
+
+        return call
+
+
+def _resolve(obj, path):
+    for name in path.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def serve_tello_commands(conn, tello):
+    """
+    Execute the calls and attribute reads a TelloProxy sends over conn on the tello
+    object and send back the results, until the other end of the pipe closes.
+    """
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind, path = msg[0], msg[1]
+        try:
+            target = _resolve(tello, path)
+            if kind == 'call':
+                result = target(*msg[2], **msg[3])
+                if isinstance(result, Future):
+                    # queued on the command dispatcher, the handler wants the reply, not the Future
+                    result = result.result(timeout=COMMAND_REPLY_TIMEOUT)
+                reply = ('ok', result)
+            elif callable(target):
+                reply = ('method', None)
+            else:
+                reply = ('value', target)
+        except Exception as exc:
+            reply = ('error', f"{exc}")
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+        except Exception as exc:
+            # the value could not be pickled: an object like the telemetry service is
+            # proxied, a return value the handler cannot get is an error
+            conn.send(('error', f"the result cannot be sent to the handler process: {exc}") if kind == 'call'
+                      else ('object', None))
+
+
+def _detach(attached):
+    for shm in attached.values():
+        try:
+            shm.close()
+        except BufferError:
+            # the handler kept a reference to a frame
+            pass
+    attached.clear()
+
+
+def _worker_main(handler_name, fly, has_tello, frame_conn, command_conn):
+    """
+    Entry point of the handler process.
+    """
+    tello = TelloProxy(command_conn) if has_tello else None
+    attached = {}
+    try:
+        handler_module = importlib.import_module(handler_name)
+        init_method = getattr(handler_module, 'init')
+        handler_method = getattr(handler_module, 'handler')
+        init_method(tello, fly_flag=fly)
+    except Exception:
+        frame_conn.send(('failed', traceback.format_exc()))
+        return
+
+    frame_conn.send(('ready', None))
+
+    while True:
+        try:
+            msg = frame_conn.recv()
+        except EOFError:
+            break
+
+        if msg[0] == 'stop':
+            break
+
+        slot = None
+        frame = None
+        if msg[0] == 'frame':
+            _, shm_name, slot, shape, dtype, seq, timestamp, unchanged, inference = msg
+            shm = attached.get(shm_name)
+            if shm is None:
+                # a new ring, the runner unlinked the old one when the frame size changed
+                _detach(attached)
+                shm = shared_memory.SharedMemory(name=shm_name)
+                attached[shm_name] = shm
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            image = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * nbytes)
+            # the frame has the full width already, this only wraps the shared memory
+            frame = TelloFrame.from_image(image, shape[1], seq, timestamp, pool=None)
+            frame.unchanged = unchanged
+            frame.inference = inference
+            del image
+
+        try:
+            handler_method(tello, frame, fly)
+        except Exception as exc:
+            LOGGER.error(f"Handler process exception: {exc}")
+            traceback.print_exc()
+        finally:
+            # drop our view before telling the runner the slot is free
+            del frame
+            frame_conn.send(('done', slot))
+
+    _detach(attached)
+
+
+class HandlerProcess:
+    """
+    Runs a handler module in a worker process.
+
+    :param handler_name: Module name of the user handler script, without .py
+    :type handler_name: str
+    :param tello: Tello object that proxied commands are executed on.  May be None
+    :type tello: Tello
+    :param fly: Fly flag passed to the handler init and handler methods
+    :type fly: bool
+    :param slots: Number of frame slots in the shared memory ring
+    :type slots: int
+    """
+
+    def __init__(self, handler_name, tello, fly=False, slots=RING_SLOTS):
+        self.handler_name = handler_name.replace(".py", "")
+        self.tello = tello
+        self.fly = fly
+        self.slots = max(2, slots)
+
+        self._lock = threading.Lock()
+        self._shm = None
+        self._shape = None
+        self._dtype = None
+        self._ring = None
+        self._next_slot = 0
+        self._busy_slot = None
+        self._worker_busy = False
+        self._pending = None
+        self._stopped = False
+        self.frames_submitted = 0
+        self.frames_handled = 0
+        self.frames_replaced = 0
+
+        ctx = multiprocessing.get_context('spawn')
+        self._frame_conn, worker_frame_conn = ctx.Pipe()
+        self._command_conn, worker_command_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_main, name=f"handler-{self.handler_name}",
+                                    args=(self.handler_name, fly, tello is not None,
+                                          worker_frame_conn, worker_command_conn),
+                                    daemon=True)
+        self._threads = []
+
+    def start(self, timeout=30):
+        """
+        Start the worker process and wait for the handler init method to complete.
+        """
+        self._process.start()
+        command_thread = threading.Thread(target=serve_tello_commands, args=(self._command_conn, self.tello),
+                                          name="handler-commands", daemon=True)
+        command_thread.start()
+        self._threads.append(command_thread)
+
+        if not self._frame_conn.poll(timeout):
+            raise RuntimeError(f"Handler process {self.handler_name} did not start")
+        status, detail = self._frame_conn.recv()
+        if status != 'ready':
+            raise RuntimeError(f"Handler process {self.handler_name} init failed:\n{detail}")
+
+        result_thread = threading.Thread(target=self._receive_results, name="handler-results", daemon=True)
+        result_thread.start()
+        self._threads.append(result_thread)
+        return self
+
+    def _allocate(self, image):
+        if self._shm is not None:
+            self._ring = None
+            self._shm.close()
+            self._shm.unlink()
+        self._shape = image.shape
+        self._dtype = image.dtype
+        self._shm = shared_memory.SharedMemory(create=True, size=image.nbytes * self.slots)
+        self._ring = [np.ndarray(image.shape, dtype=image.dtype, buffer=self._shm.buf, offset=i * image.nbytes)
+                      for i in range(self.slots)]
+
+    def _send_locked(self, msg, slot):
+        self._worker_busy = True
+        self._busy_slot = slot
+        self._frame_conn.send(msg)
+
+    def submit(self, image):
+        """
+        Hand a frame to the worker.  Never blocks on the handler: if the worker is
+        still busy, the frame waits in the ring and is replaced by any newer frame.
+
+        :param image: Video frame, or None when no video is available
+        :type image: TelloFrame
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self.frames_submitted += 1
+
+            if image is None:
+                if not self._worker_busy and self._pending is None:
+                    self._send_locked(('none',), None)
+                return
+
+            if self._shm is None or image.shape != self._shape or image.dtype != self._dtype:
+                if self._worker_busy:
+                    # wait for the worker to let go of the old ring before resizing it
+                    return
+                self._allocate(image)
+
+            if self._pending is not None:
+                slot = self._pending[2]
+                self.frames_replaced += 1
+            else:
+                slot = self._next_slot
+                if slot == self._busy_slot:
+                    slot = (slot + 1) % self.slots
+                self._next_slot = (slot + 1) % self.slots
+
+            np.copyto(self._ring[slot], image)
+            msg = ('frame', self._shm.name, slot, self._shape, self._dtype.str, getattr(image, 'seq', 0),
+                   getattr(image, 'timestamp', None), getattr(image, 'unchanged', False),
+                   getattr(image, 'inference', None))
+
+            if self._worker_busy:
+                self._pending = msg
+            else:
+                self._send_locked(msg, slot)
+
+    def __call__(self, tello, frame, fly_flag=False):
+        # same signature as a user handler method so the runner can call it directly
+        self.submit(frame)
+
+    def _receive_results(self):
+        while True:
+            try:
+                status, _ = self._frame_conn.recv()
+            except (EOFError, OSError):
+                break
+            if status != 'done':
+                continue
+            with self._lock:
+                self.frames_handled += 1
+                self._worker_busy = False
+                self._busy_slot = None
+                if self._pending is not None and not self._stopped:
+                    msg = self._pending
+                    self._pending = None
+                    self._send_locked(msg, msg[2])
+
+    def stop(self, timeout=2):
+        with self._lock:
+            self._stopped = True
+            try:
+                self._frame_conn.send(('stop',))
+            except (OSError, BrokenPipeError):
+                pass
+
+        self._process.join(timeout)
+        if self._process.is_alive():
+            LOGGER.error(f"Handler process {self.handler_name} did not stop, terminating it")
+            self._process.terminate()
+            self._process.join(1)
+
+        self._frame_conn.close()
+        self._command_conn.close()
+
+        if self._shm is not None:
+            self._ring = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+        LOGGER.info(f"Handler process frames submitted: {self.frames_submitted}, handled: {self.frames_handled}, "
+                    f"replaced while busy: {self.frames_replaced}")
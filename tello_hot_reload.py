@@ -0,0 +1,143 @@
+"""
+Reload a user handler script while the drone keeps flying.
+
+HotReloadHandler stands in for the handler method.  Between two frames it
+checks the modification time of the handler file, and when the file changed it
+reloads the module in place and calls init again.  The Tello connection, the
+video stream and the flight state are not touched, so there is no connect,
+streamon or takeoff to wait for.
+
+While the module is swapped the drone hovers: queued commands are dropped and
+the RC setpoint is zeroed.  If the new version fails to import, its init raises,
+or its handler raises on its first frame, the module is put back the way it was
+and the previous version keeps running until the file changes again.
+
+    python tello_script_runner.py --handler sample_user_script --fly --display-video --hot-reload
+
+"""
+import importlib
+import logging
+import os
+import time
+import traceback
+
+LOGGER = logging.getLogger()
+
+# seconds between checks of the handler file modification time
+POLL_INTERVAL = 0.5
+
+
+class HotReloadHandler:
+    """
+    Handler method that reloads its module when the module file changes.
+
+    :param handler_name: Module name of the handler script, with or without .py
+    :type handler_name: str
+    :param tello: Tello, or command dispatcher, that init and the handler are given
+    :param fly: Flag passed to init
+    :type fly: bool
+    :param poll_interval: Seconds between modification time checks
+    :type poll_interval: float
+    """
+
+    def __init__(self, handler_name, tello, fly=False, poll_interval=POLL_INTERVAL):
+        self.handler_name = handler_name.replace(".py", "")
+        self.tello = tello
+        self.fly = fly
+        self.poll_interval = poll_interval
+        self.module = None
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._mtime = None
+        self._next_check = 0
+        # module namespace to go back to when the new version fails on its first frame
+        self._previous = None
+
+    def start(self):
+        """
+        Import the handler and call its init.  Errors are raised, there is no previous version yet.
+        """
+        self.module = importlib.import_module(self.handler_name)
+        self._mtime = self._file_mtime()
+        self.module.init(self.tello, fly_flag=self.fly)
+        return self
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.module.__file__).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def _hover(self):
+        if not self.fly or self.tello is None:
+            return
+        try:
+            # a command dispatcher has queued commands, drop them
+            clear = getattr(self.tello, 'clear', None)
+            if callable(clear):
+                clear()
+            self.tello.send_rc_control(0, 0, 0, 0)
+        except Exception as exc:
+            LOGGER.error(f"Could not hover for the handler reload: {exc}")
+
+    def _restore(self, namespace):
+        self.module.__dict__.clear()
+        self.module.__dict__.update(namespace)
+
+    def reload(self):
+        """
+        Reload the module and call its init.  On failure the previous version is restored.
+
+        :return: True when the new version is running
+        :rtype: bool
+        """
+        self._hover()
+        start = time.time()
+        previous = dict(self.module.__dict__)
+        try:
+            importlib.reload(self.module)
+            self.module.init(self.tello, fly_flag=self.fly)
+        except Exception as exc:
+            self._restore(previous)
+            self.failed_reloads += 1
+            LOGGER.error(f"Reloading {self.handler_name} failed, keeping the previous version: {exc}")
+            traceback.print_exc()
+            return False
+
+        self._previous = previous
+        self.reloads += 1
+        LOGGER.info(f"Reloaded {self.handler_name} in {(time.time() - start) * 1000.0:.1f} ms")
+        return True
+
+    def check(self):
+        """
+        Reload the module when its file changed since the last check.
+        """
+        now = time.time()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.poll_interval
+
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self._mtime:
+            return
+        # a failed version is not retried until the file is saved again
+        self._mtime = mtime
+        self.reload()
+
+    def __call__(self, tello, frame, fly=False):
+        self.check()
+        try:
+            self.module.handler(tello, frame, fly)
+        except Exception:
+            if self._previous is None:
+                raise
+            # the freshly reloaded version fails on its first frame, go back
+            LOGGER.error(f"Reloaded {self.handler_name} handler failed, going back to the previous version")
+            traceback.print_exc()
+            self._restore(self._previous)
+            self._previous = None
+            self.failed_reloads += 1
+            self._hover()
+            return
+        self._previous = None
@@ -0,0 +1,58 @@
+"""
+Keyboard command table shared by the keyboard window and the headless control server.
+
+Nothing here needs OpenCV, so the control server works on a machine without a
+GUI capable OpenCV.
+
+"""
+from collections import deque
+
+# number of latency samples kept for the statistics
+LATENCY_SAMPLES = 100
+
+MOVE_DISTANCE = 30
+
+# key: (display text, Tello method, arguments).  A None method means the key
+# stops the handler processing
+KEY_COMMANDS = {
+    'w': ("Forward", 'move_forward', (MOVE_DISTANCE,)),
+    's': ("Backward", 'move_back', (MOVE_DISTANCE,)),
+    'a': ("Left", 'move_left', (MOVE_DISTANCE,)),
+    'd': ("Right", 'move_right', (MOVE_DISTANCE,)),
+    'e': ("Clockwise", 'rotate_clockwise', (MOVE_DISTANCE,)),
+    'q': ("Counter Clockwise", 'rotate_counter_clockwise', (MOVE_DISTANCE,)),
+    'r': ("Up", 'move_up', (MOVE_DISTANCE,)),
+    'f': ("Down", 'move_down', (MOVE_DISTANCE,)),
+    'h': ("Hover", 'send_rc_control', (0, 0, 0, 0)),
+    'l': ("Land", None, ()),
+    'x': ("Emergency", 'emergency', ()),
+}
+
+# keys that stop processing the handler
+EXIT_KEYS = ('l', 'x')
+
+# keys sent even when the fly flag is not set
+ALWAYS_SEND_KEYS = ('x',)
+
+
+class LatencyStats:
+    """
+    Keep the last samples of a latency measurement.
+    """
+
+    def __init__(self, size=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return {'count': 0}
+        ordered = sorted(self.samples)
+        return {'count': self.count,
+                'last_ms': round(self.samples[-1] * 1000.0, 2),
+                'p50_ms': round(ordered[len(ordered) // 2] * 1000.0, 2),
+                'max_ms': round(ordered[-1] * 1000.0, 2)}
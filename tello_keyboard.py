@@ -0,0 +1,160 @@
+"""
+Keyboard control window for the Tello script runner.
+
+The background image and the text overlays are rendered once and cached.  A
+tick only copies the overlay regions that changed into the window image and
+only calls imshow when something changed.  Keys are polled with a 1 ms wait so
+a key press, including the emergency stop, is acted on right away.
+
+Key to command latency is measured for every command: dispatch is the time from
+reading the key to the command being handed to the Tello, ack is the time until
+the drone acknowledged it.
+
+"""
+import logging
+import time
+
+import cv2
+import imutils
+
+from tello_key_commands import ALWAYS_SEND_KEYS, EXIT_KEYS, KEY_COMMANDS, LatencyStats
+
+LOGGER = logging.getLogger()
+
+WINDOW_NAME = "Keyboard Cmds"
+
+# milliseconds cv2.waitKey waits for a key press
+KEY_WAIT_MS = 1
+
+# seconds a command stays on screen.  New keys are ignored while it is
+# shown so holding a key down does not repeat the command
+COMMAND_DISPLAY_TIME = 2
+
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_TEXT_COLOR = (255, 0, 0)
+
+
+class KeyboardControlWindow:
+    """
+    OpenCV window that shows the last command and battery level and turns key presses into Tello commands.
+
+    :param image_path: Background image of the window
+    :type image_path: str
+    :param width: Width of the window in pixels
+    :type width: int
+    """
+
+    def __init__(self, image_path="./media/tello_drone_image2.png", width=500):
+        background = cv2.imread(image_path)
+        self.background = imutils.resize(background, width=width)
+        h, w = self.background.shape[:2]
+
+        # (top, bottom, left, right) of the regions the text is drawn in
+        command_baseline = int(h * 0.90)
+        self.command_region = (max(0, command_baseline - 35), min(h, command_baseline + 12), 0, w)
+        self.battery_region = (0, 55, int(w * 0.55), w)
+        self.command_origin = (50, command_baseline)
+        self.battery_origin = (int(w * 0.55), 40)
+
+        self.canvas = self.background.copy()
+        self._overlay_cache = {}
+        self._shown = {}
+        self._dirty = True
+
+        self.last_command = ""
+        self.last_command_timestamp = 0
+
+        self.dispatch_latency = LatencyStats()
+        self.ack_latency = LatencyStats()
+
+    def _overlay(self, region, origin, text):
+        """
+        Pre-rendered pixels of a region with the text drawn on the background.
+        """
+        key = (region, text)
+        patch = self._overlay_cache.get(key)
+        if patch is None:
+            top, bottom, left, right = region
+            patch = self.background[top:bottom, left:right].copy()
+            if text:
+                cv2.putText(patch, text, (origin[0] - left, origin[1] - top), _FONT, 1, _TEXT_COLOR, 2, cv2.LINE_AA)
+            self._overlay_cache[key] = patch
+        return patch
+
+    def _set_text(self, region, origin, text):
+        if self._shown.get(region) == text:
+            return
+        top, bottom, left, right = region
+        self.canvas[top:bottom, left:right] = self._overlay(region, origin, text)
+        self._shown[region] = text
+        self._dirty = True
+
+    def render(self, battery_left):
+        self._set_text(self.command_region, self.command_origin, self.last_command)
+        self._set_text(self.battery_region, self.battery_origin, f"Battery: {battery_left}%")
+        if self._dirty:
+            cv2.imshow(WINDOW_NAME, self.canvas)
+            self._dirty = False
+
+    def _send(self, tello, method, args, key_time):
+        result = getattr(tello, method)(*args)
+        self.dispatch_latency.add(time.time() - key_time)
+
+        if hasattr(result, 'add_done_callback'):
+            # the command dispatcher returns a Future
+            result.add_done_callback(lambda f: self.ack_latency.add(time.time() - key_time))
+        else:
+            self.ack_latency.add(time.time() - key_time)
+
+    def poll(self, tello, fly, battery_left):
+        """
+        Redraw what changed, read a key and send its command.
+
+        :param tello: Tello object or command dispatcher the commands are sent to
+        :type tello: Tello
+        :param fly: Flag indicating if the Tello is set to fly
+        :type fly: bool
+        :param battery_left: Battery percentage to display
+        :type battery_left: int
+        :return: 0 - Exit, 1 - continue processing
+        :rtype: int
+        """
+        if time.time() - self.last_command_timestamp > COMMAND_DISPLAY_TIME:
+            self.last_command = ""
+
+        self.render(battery_left)
+        key = cv2.waitKey(KEY_WAIT_MS) & 0xff
+        key_time = time.time()
+
+        if key == 255:
+            return 1
+        LOGGER.debug(f"key: {key}")
+
+        if key == 27:  # ESC
+            return 0
+
+        command = KEY_COMMANDS.get(chr(key))
+        if command is None:
+            return 1
+
+        key_char = chr(key)
+        # because getting keyboard input is a polling process, someone might
+        # hold down a key to get the command to register. To avoid getting
+        # multiple keyboard commands only look for new commands once the
+        # last_command string is empty.  The emergency stop is always sent
+        if self.last_command != "" and key_char not in ALWAYS_SEND_KEYS:
+            return 1
+
+        text, method, args = command
+        self.last_command = text
+        self.last_command_timestamp = key_time
+        self.render(battery_left)
+
+        if method and tello and (fly or key_char in ALWAYS_SEND_KEYS):
+            self._send(tello, method, args, key_time)
+
+        # stop processing the handler function but continue to fly and see video
+        return 0 if key_char in EXIT_KEYS else 1
+
+    def latency_stats(self):
+        return {'dispatch': self.dispatch_latency.summary(), 'ack': self.ack_latency.summary()}
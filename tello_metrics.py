@@ -0,0 +1,269 @@
+"""
+Latency instrumentation for the runner pipeline.
+
+Every frame is stamped as it moves through the pipeline: decode, resize,
+handler start and end, and display.  Tello commands are stamped when they are
+queued, sent and acknowledged.  The time between stamps is aggregated into
+fixed bucket histograms, and counters track frames, drops and commands.
+
+PipelineMetrics can export, on a background thread:
+
+    a log line every interval seconds
+    metrics.prom     Prometheus text format, for the node exporter textfile collector
+    trace.json       Chrome trace of the most recent spans, open it in chrome://tracing or Perfetto
+
+Recording a stamp is a dict update and a bisect into a short list, cheap
+enough to leave on all the time.
+
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger()
+
+# upper bounds, in seconds, of the histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3,
+                   0.5, 0.75, 1.0, 2.0, 5.0, 10.0)
+
+# number of frames whose stage stamps are kept while they move through the pipeline
+STAMPED_FRAMES = 64
+
+# number of spans kept for the Chrome trace
+TRACE_EVENTS = 10000
+
+METRICS_INTERVAL = 10
+
+
+class Histogram:
+    """
+    Fixed bucket latency histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last bucket counts everything above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket the q quantile falls in.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+class PipelineMetrics:
+    """
+    Stage latency histograms, counters and a trace of recent spans.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self._frames = {}
+        self._frame_order = deque()
+        self._trace = deque(maxlen=TRACE_EVENTS)
+        self._last_export = time.time()
+        self._last_counters = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.start_time = time.time()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def stamp(self, seq, stage, timestamp=None):
+        """
+        Record that frame seq reached stage.  The time since the frame was decoded
+        is observed as '<stage>' in the latency histograms.  The first stamp of a
+        frame should be its decode stamp.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            stamps = self._frames.get(seq)
+            if stamps is None:
+                stamps = self._frames[seq] = {}
+                self._frame_order.append(seq)
+                if len(self._frame_order) > STAMPED_FRAMES:
+                    self._frames.pop(self._frame_order.popleft(), None)
+            stamps[stage] = timestamp
+            self.counters[f"frames_{stage}"] = self.counters.get(f"frames_{stage}", 0) + 1
+            decoded = stamps.get('decode')
+        if decoded is not None and stage != 'decode':
+            self.observe(f"decode_to_{stage}", timestamp - decoded)
+
+    def span(self, name, start, end, seq=None):
+        """
+        Record a span that started and ended at the given times.
+        """
+        self.observe(name, end - start)
+        event = {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if seq is not None:
+            event['args'] = {'seq': seq}
+        self._trace.append(event)
+
+    @contextmanager
+    def timed(self, name, seq=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.span(name, start, time.time(), seq)
+
+    def summary_line(self):
+        now = time.time()
+        interval = max(1e-6, now - self._last_export)
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = list(self.histograms.items())
+        rates = []
+        for name, value in sorted(counters.items()):
+            if name.startswith('frames_'):
+                rate = (value - self._last_counters.get(name, 0)) / interval
+                rates.append(f"{name[7:]}={rate:.1f}fps")
+        latencies = []
+        for name, h in sorted(histograms):
+            p50 = h.quantile(0.5)
+            p99 = h.quantile(0.99)
+            latencies.append(f"{name}=p50<{p50 * 1000:.1f}ms,p99<{p99 * 1000:.1f}ms")
+        drops = [f"{name}={value}" for name, value in sorted(counters.items()) if 'drop' in name]
+        self._last_counters = counters
+        self._last_export = now
+        return "Metrics " + " ".join(rates + drops + latencies)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = [(name, list(h.counts), h.count, h.sum) for name, h in self.histograms.items()]
+        for name, value in sorted(counters.items()):
+            metric = f"tello_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, counts, count, total in sorted(histograms):
+            metric = f"tello_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, c in zip(LATENCY_BUCKETS, counts):
+                cumulative += c
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum {total}")
+            lines.append(f"{metric}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def chrome_trace(self):
+        return {'traceEvents': list(self._trace), 'displayTimeUnit': 'ms'}
+
+    def export(self, metrics_dir=None):
+        LOGGER.info(self.summary_line())
+        if metrics_dir:
+            _write_atomic(os.path.join(metrics_dir, "metrics.prom"), self.prometheus_text())
+            _write_atomic(os.path.join(metrics_dir, "trace.json"), json.dumps(self.chrome_trace()))
+
+    def start_exporter(self, metrics_dir=None, interval=METRICS_INTERVAL):
+        """
+        Export the metrics every interval seconds on a background thread.
+
+        :param metrics_dir: Directory for metrics.prom and trace.json. None - only log
+        :type metrics_dir: str
+        """
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+
+        def export_loop():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.export(metrics_dir)
+                except Exception as exc:
+                    LOGGER.error(f"Metrics export failed: {exc}")
+
+        self._metrics_dir = metrics_dir
+        self._thread = threading.Thread(target=export_loop, name="metrics-export", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_exporter(self):
+        if self._thread:
+            self._stop_event.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+            self.export(self._metrics_dir)
+
+
+class StartupProfile:
+    """
+    Time of every startup milestone, like connected or first_frame, since the runner started.
+    Only the first mark of a milestone counts.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.marks = {}
+
+    def mark(self, name, timestamp=None):
+        # setdefault is atomic, marks can come from any thread
+        self.marks.setdefault(name, time.time() if timestamp is None else timestamp)
+
+    def elapsed(self, name):
+        """
+        Seconds from the runner start to the milestone, or None if it was not reached.
+        """
+        timestamp = self.marks.get(name)
+        return None if timestamp is None else timestamp - self.start_time
+
+    def report(self):
+        lines = ["Startup profile"]
+        for name, timestamp in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"    {name:24s} {(timestamp - self.start_time) * 1000.0:9.1f} ms")
+        for label, name in (("time to first frame", 'first_frame_shown'), ("time to airborne", 'airborne')):
+            elapsed = self.elapsed(name)
+            lines.append(f"    {label:24s} " + (f"{elapsed * 1000.0:9.1f} ms" if elapsed is not None else "      n/a"))
+        return "\n".join(lines)
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# metrics shared by the runner, the command dispatcher and the handlers
+METRICS = PipelineMetrics()
+
+# startup milestones of the runner, see --profile-startup
+STARTUP = StartupProfile()
@@ -0,0 +1,356 @@
+"""
+Fly a declarative flight plan without fixed sleeps.
+
+A scripted flight usually waits a fixed time.sleep(2) after every command.
+MissionExecutor instead moves on as soon as the drone acknowledged a command
+and the state stream shows the drone has settled: the speeds are about zero
+and the height and heading stopped changing.
+
+Plans are a Python list, or a JSON or YAML file holding one.  A step is:
+
+    "takeoff"                                    command without arguments
+    "move_up 40"                                 command and arguments
+    {"move_up": 40}                              the same as a mapping
+    {"command": "rotate_clockwise", "args": [180], "duration": 3, "settle": false}
+    {"repeat": 4, "steps": [...]}                the steps 4 times
+
+get_* steps, like get_battery or get_height, are answered from the state
+stream right away, without a round trip to the drone.  query_* steps, which do
+ask the drone, run on a thread so the plan does not wait for the answer.  The
+djitellopy Tello is not thread safe, a query and a move sent at the same time
+can swap their replies, so every command holds one lock while it waits for the
+drone.
+
+Every step gets a planned duration, given with "duration" or estimated from
+the command, and the executor reports the planned against the achieved
+timeline:
+
+    python tello_mission.py missions/test_tello_setup.json
+    python tello_mission.py missions/test_tello_setup.json --dry-run
+
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger()
+
+# speeds below this many dm/s, on every axis, count as standing still
+SETTLE_SPEED = 1
+# height change, in cm, and heading change, in degrees, allowed while settled
+SETTLE_HEIGHT = 3
+SETTLE_YAW = 2
+# seconds of state that have to look settled
+SETTLE_WINDOW = 0.3
+# seconds to wait for the drone to settle before moving on anyway
+SETTLE_TIMEOUT = 3.0
+
+# commands after which the drone is not moving and does not need to settle
+NO_SETTLE_COMMANDS = ('land', 'emergency', 'streamon', 'streamoff', 'send_rc_control', 'set_speed')
+
+# planned duration estimates
+MOVE_SPEED = 50.0  # cm/s
+ROTATE_SPEED = 90.0  # degrees/s
+COMMAND_OVERHEAD = 0.5
+PLANNED_DURATIONS = {'takeoff': 5.0, 'land': 5.0, 'connect': 1.0}
+
+# get_* methods answered from the telemetry ring: method -> field, or function of a telemetry row
+TELEMETRY_QUERIES = {
+    'get_battery': 'bat',
+    'get_height': 'h',
+    'get_distance_tof': 'tof',
+    'get_barometer': 'baro',
+    'get_pitch': 'pitch',
+    'get_roll': 'roll',
+    'get_yaw': 'yaw',
+    'get_speed_x': 'vgx',
+    'get_speed_y': 'vgy',
+    'get_speed_z': 'vgz',
+    'get_acceleration_x': 'agx',
+    'get_acceleration_y': 'agy',
+    'get_acceleration_z': 'agz',
+    'get_flight_time': 'time',
+    'get_lowest_temperature': 'templ',
+    'get_highest_temperature': 'temph',
+    'get_temperature': lambda row: (row['templ'] + row['temph']) / 2.0,
+}
+
+
+def _parse_value(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _normalize(step):
+    """
+    Turn one plan step into a dict with command, args, duration and settle.
+    """
+    if isinstance(step, str):
+        parts = step.split()
+        return {'command': parts[0], 'args': [_parse_value(p) for p in parts[1:]]}
+    if not isinstance(step, dict):
+        raise ValueError(f"Mission step must be a string or a mapping: {step!r}")
+    step = dict(step)
+    if 'command' not in step:
+        # {"move_up": 40} style, the one key that is not an option is the command
+        commands = [k for k in step if k not in ('duration', 'settle')]
+        if len(commands) != 1:
+            raise ValueError(f"Cannot tell the command of mission step {step!r}")
+        command = commands[0]
+        args = step.pop(command)
+        step['command'] = command
+        step['args'] = [] if args is None else (list(args) if isinstance(args, (list, tuple)) else [args])
+    step.setdefault('args', [])
+    return step
+
+
+def expand_plan(plan):
+    """
+    Flatten repeats and normalize every step of a plan.
+
+    :param plan: List of steps
+    :type plan: list
+    :rtype: list
+    """
+    steps = []
+    for step in plan:
+        if isinstance(step, dict) and 'repeat' in step:
+            inner = expand_plan(step['steps'])
+            for _ in range(int(step['repeat'])):
+                steps.extend(dict(s) for s in inner)
+        else:
+            steps.append(_normalize(step))
+    return steps
+
+
+def load_plan(source):
+    """
+    Load a plan from a list, a .json file or a .yaml/.yml file.  YAML needs PyYAML.
+    """
+    if isinstance(source, (list, tuple)):
+        return expand_plan(source)
+    with open(source) as f:
+        if source.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("YAML flight plans need PyYAML: pip install pyyaml")
+            plan = yaml.safe_load(f)
+        else:
+            plan = json.load(f)
+    if isinstance(plan, dict):
+        plan = plan['steps']
+    return expand_plan(plan)
+
+
+def planned_duration(step):
+    """
+    Seconds the step is planned to take: its duration, or an estimate from the command.
+    """
+    if 'duration' in step:
+        return float(step['duration'])
+    command, args = step['command'], step['args']
+    if command.startswith(('get_', 'query_')):
+        return 0.0
+    if command in PLANNED_DURATIONS:
+        return PLANNED_DURATIONS[command]
+    if command.startswith('move_') and args:
+        return COMMAND_OVERHEAD + abs(float(args[0])) / MOVE_SPEED
+    if command.startswith('rotate_') and args:
+        return COMMAND_OVERHEAD + abs(float(args[0])) / ROTATE_SPEED
+    return COMMAND_OVERHEAD
+
+
+class MissionExecutor:
+    """
+    Run flight plans step by step, driven by command acknowledgements and the state stream.
+
+    :param tello: Tello, or command dispatcher, the commands are sent to
+    :param telemetry: TelemetryService with the state stream.  None - tello.telemetry if there is one,
+                        without telemetry the executor does not wait for the drone to settle
+    :type telemetry: TelemetryService
+    :param settle_timeout: Seconds to wait for the drone to settle after a command
+    :type settle_timeout: float
+    """
+
+    def __init__(self, tello, telemetry=None, settle_timeout=SETTLE_TIMEOUT):
+        self.tello = tello
+        self.telemetry = telemetry if telemetry is not None else getattr(tello, 'telemetry', None)
+        self.settle_timeout = settle_timeout
+        # query threads and the plan share the command socket, one command at a time
+        self._command_lock = threading.Lock()
+
+    def _call(self, command, args):
+        with self._command_lock:
+            result = getattr(self.tello, command)(*args)
+            if hasattr(result, 'result'):
+                # the command dispatcher returns a Future, wait for the acknowledgement
+                result = result.result()
+            return result
+
+    def _answer(self, command, args):
+        """
+        Answer a get_* step from the state stream, or from the Tello when there is no state for it.
+        """
+        field = TELEMETRY_QUERIES.get(command)
+        if field is not None and self.telemetry is not None and self.telemetry.count:
+            row = self.telemetry.latest()
+            return field(row) if callable(field) else row[field].item()
+        return self._call(command, args)
+
+    def wait_settled(self, timeout=None):
+        """
+        Block until the state stream shows no motion for SETTLE_WINDOW seconds.
+
+        :return: True when settled, False on timeout, None without telemetry
+        :rtype: bool
+        """
+        if self.telemetry is None:
+            return None
+        deadline = time.time() + (self.settle_timeout if timeout is None else timeout)
+        while True:
+            rows = self.telemetry.window(SETTLE_WINDOW)
+            if len(rows) >= 2 and \
+                    max(abs(rows['vgx']).max(), abs(rows['vgy']).max(), abs(rows['vgz']).max()) <= SETTLE_SPEED and \
+                    rows['h'].max() - rows['h'].min() <= SETTLE_HEIGHT and \
+                    _yaw_span(rows['yaw']) <= SETTLE_YAW:
+                return True
+            if time.time() >= deadline:
+                return False
+            # state packets arrive at 10 Hz
+            time.sleep(0.05)
+
+    def run(self, plan):
+        """
+        Fly the plan.
+
+        :param plan: List of steps, or the path of a JSON or YAML plan
+        :return: Timeline, one dict per step with the planned and achieved times in seconds from the start
+        :rtype: list
+        """
+        steps = load_plan(plan)
+        timeline = []
+        pending_queries = []
+        queries = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mission-query")
+        start = time.time()
+        planned_time = 0.0
+
+        for index, step in enumerate(steps):
+            command, args = step['command'], step['args']
+            planned = planned_duration(step)
+            entry = {'step': index + 1, 'command': " ".join([command] + [str(a) for a in args]),
+                     'planned_start': round(planned_time, 3), 'planned_end': round(planned_time + planned, 3)}
+            planned_time += planned
+            step_start = time.time()
+            entry['start'] = round(step_start - start, 3)
+
+            if command.startswith('query_'):
+                # asks the drone, the answer comes in while the next steps fly
+                pending_queries.append((entry, queries.submit(self._call, command, args)))
+                entry['ack'] = entry['end'] = entry['start']
+                timeline.append(entry)
+                continue
+
+            try:
+                if command.startswith('get_'):
+                    entry['result'] = self._answer(command, args)
+                else:
+                    entry['result'] = self._call(command, args)
+            except Exception as exc:
+                entry['error'] = str(exc)
+                LOGGER.error(f"Mission step {entry['step']} {entry['command']} failed: {exc}")
+                timeline.append(entry)
+                break
+            entry['ack'] = round(time.time() - start, 3)
+
+            if step.get('settle', True) and not command.startswith('get_') and command not in NO_SETTLE_COMMANDS:
+                entry['settled'] = self.wait_settled()
+            entry['end'] = round(time.time() - start, 3)
+            timeline.append(entry)
+            LOGGER.info(f"Mission step {entry['step']} {entry['command']}: {entry.get('result')} "
+                        f"planned {planned:.2f}s, took {entry['end'] - entry['start']:.2f}s")
+
+        for entry, future in pending_queries:
+            try:
+                entry['result'] = future.result()
+            except Exception as exc:
+                entry['error'] = str(exc)
+        queries.shutdown(wait=False)
+        return timeline
+
+
+def _yaw_span(yaw):
+    """
+    Degrees the heading moved over, allowing for the wrap from 180 to -180.
+    """
+    span = int(yaw.max()) - int(yaw.min())
+    return 360 - span if span > 180 else span
+
+
+def format_timeline(timeline):
+    lines = [f"{'step':>4}  {'command':28s} {'planned':>15s} {'achieved':>15s} {'ack':>8s}  result"]
+    for e in timeline:
+        planned = f"{e['planned_start']:6.2f}-{e['planned_end']:6.2f}"
+        achieved = f"{e['start']:6.2f}-{e.get('end', e['start']):6.2f}"
+        ack = f"{e['ack']:8.2f}" if 'ack' in e else f"{'':8s}"
+        result = e.get('error', e.get('result', ''))
+        if e.get('settled') is False:
+            result = f"{result} (not settled)"
+        lines.append(f"{e['step']:4d}  {e['command']:28s} {planned:>15s} {achieved:>15s} {ack}  {result}")
+    if timeline:
+        last = timeline[-1]
+        lines.append(f"planned {last['planned_end']:.2f}s, achieved {last.get('end', last['start']):.2f}s")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    ap = argparse.ArgumentParser(description="Fly a JSON or YAML flight plan")
+    ap.add_argument("plan", help="JSON or YAML flight plan")
+    ap.add_argument("--tello-host", type=str, default=None,
+                    help="IP address of the Tello or of a tello_sim.py simulator.  Default: 192.168.10.1")
+    ap.add_argument("--settle-timeout", type=float, default=SETTLE_TIMEOUT,
+                    help=f"Seconds to wait for the drone to settle after a command.  Default: {SETTLE_TIMEOUT}")
+    ap.add_argument("--dry-run", action='store_true', help="Print the planned timeline without connecting")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.INFO if args['verbose'] else logging.ERROR)
+
+    if args['dry_run']:
+        planned_time = 0.0
+        for i, step in enumerate(load_plan(args['plan'])):
+            duration = planned_duration(step)
+            print(f"{i + 1:4d}  {' '.join([step['command']] + [str(a) for a in step['args']]):28s} "
+                  f"{planned_time:6.2f}-{planned_time + duration:6.2f}")
+            planned_time += duration
+        sys.exit(0)
+
+    from djitellopy import Tello
+
+    from tello_telemetry import TelemetryService
+
+    tello = Tello(host=args['tello_host']) if args['tello_host'] else Tello()
+    tello.connect()
+    telemetry = TelemetryService().follow(tello)
+    executor = MissionExecutor(tello, telemetry, settle_timeout=args['settle_timeout'])
+    try:
+        timeline = executor.run(args['plan'])
+    except KeyboardInterrupt:
+        tello.send_rc_control(0, 0, 0, 0)
+        tello.land()
+        sys.exit(-1)
+    finally:
+        telemetry.stop()
+    print(format_timeline(timeline))
+    tello.end()
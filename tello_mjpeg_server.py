@@ -0,0 +1,206 @@
+"""
+Stream the runner video to any number of local viewers over HTTP.
+
+MjpegServer JPEG encodes every new frame of a FrameMailbox once, and publishes
+the encoded frame through a second FrameMailbox that all clients read from.
+Encoding costs the same with one viewer or with ten.  Every client takes the
+newest encoded frame when it is done sending the previous one, so a slow
+client skips frames instead of building up a backlog, and it never holds up the
+other clients or the runner.  Nothing is encoded while nobody is watching.
+
+    /              page showing the stream
+    /stream.mjpg   multipart/x-mixed-replace MJPEG stream, works in browsers, VLC and cv2.VideoCapture
+    /snapshot.jpg  the latest frame as one JPEG image
+
+    python tello_script_runner.py --handler sample_user_script --display-video --mjpeg-port 8080
+
+"""
+import logging
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from tello_frame_source import Frame, FrameMailbox
+from tello_metrics import METRICS
+
+LOGGER = logging.getLogger()
+
+MJPEG_HOST = '127.0.0.1'
+MJPEG_PORT = 8080
+JPEG_QUALITY = 80
+
+# a small socket send buffer, so a slow client waits for the network instead of the kernel queueing old frames
+SEND_BUFFER_BYTES = 128 * 1024
+
+BOUNDARY = b'telloframe'
+
+_INDEX_PAGE = b"""<!DOCTYPE html>
+<html><head><title>Tello Video</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="width:100%"></body></html>
+"""
+
+
+class _MjpegRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        mjpeg = self.server.mjpeg
+        path = self.path.split('?')[0]
+        if path == '/':
+            self._send_body('text/html', _INDEX_PAGE)
+        elif path == '/snapshot.jpg':
+            jpeg = mjpeg.snapshot()
+            if jpeg is None:
+                self.send_error(503, "No video frame yet")
+            else:
+                self._send_body('image/jpeg', jpeg.image)
+        elif path == '/stream.mjpg':
+            self._stream(mjpeg)
+        else:
+            self.send_error(404)
+
+    def _send_body(self, content_type, body):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache, no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, mjpeg):
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY.decode('ascii'))
+        self.send_header('Cache-Control', 'no-cache, no-store')
+        self.end_headers()
+
+        mjpeg.client_connected()
+        last_seq = 0
+        try:
+            while not mjpeg.stopped:
+                jpeg = mjpeg.jpegs.get(last_seq, timeout=1.0)
+                if jpeg is None:
+                    continue
+                if jpeg.seq - last_seq > 1 and last_seq > 0:
+                    mjpeg.client_skipped(jpeg.seq - last_seq - 1)
+                last_seq = jpeg.seq
+                self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                                 str(len(jpeg.image)).encode('ascii') + b'\r\n\r\n')
+                self.wfile.write(jpeg.image)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            mjpeg.client_disconnected()
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"MJPEG {self.address_string()} {format % args}")
+
+
+class MjpegServer:
+    """
+    HTTP server streaming the frames of a FrameMailbox as MJPEG.
+
+    :param mailbox: Mailbox with the frames to stream.  The images are not modified
+    :type mailbox: FrameMailbox
+    :param port: TCP port to listen on
+    :type port: int
+    :param host: Address to listen on.  The default only accepts viewers on this computer
+    :type host: str
+    :param quality: JPEG quality, 0 - 100
+    :type quality: int
+    """
+
+    def __init__(self, mailbox, port=MJPEG_PORT, host=MJPEG_HOST, quality=JPEG_QUALITY):
+        self.mailbox = mailbox
+        self.port = port
+        self.host = host
+        self.quality = quality
+        # encoded frames, Frame.image holds the JPEG bytes
+        self.jpegs = FrameMailbox()
+        self.stopped = False
+        self.clients = 0
+        self.frames_encoded = 0
+        # frames a client was too slow for, over all clients
+        self.frames_skipped = 0
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self._stop_event = threading.Event()
+        self._http = None
+        self._threads = []
+
+    def start(self):
+        self._http = ThreadingHTTPServer((self.host, self.port), _MjpegRequestHandler)
+        self._http.daemon_threads = True
+        self._http.mjpeg = self
+        for target, name in ((self._http.serve_forever, "mjpeg-http"), (self._encode_loop, "mjpeg-encode")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        LOGGER.info(f"MJPEG stream on http://{self.host}:{self.port}/stream.mjpg")
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self._stop_event.set()
+        self.jpegs.close()
+        if self._http:
+            self._http.shutdown()
+            self._http.server_close()
+        for t in self._threads:
+            t.join(timeout=1)
+        LOGGER.info(f"MJPEG frames encoded: {self.frames_encoded}, skipped by slow clients: {self.frames_skipped}")
+
+    def client_connected(self):
+        with self._lock:
+            self.clients += 1
+
+    def client_disconnected(self):
+        with self._lock:
+            self.clients -= 1
+
+    def client_skipped(self, frames):
+        with self._lock:
+            self.frames_skipped += frames
+
+    def _encode(self, frame):
+        """
+        Encode frame and publish it to the clients, unless it already was.
+        """
+        with self._encode_lock:
+            latest = self.jpegs.latest
+            if latest is not None and latest.seq >= frame.seq:
+                return latest
+            start = time.time()
+            ok, buffer = cv2.imencode('.jpg', frame.image, self._encode_params)
+            if not ok:
+                return None
+            jpeg = Frame(frame.seq, frame.timestamp, buffer.tobytes())
+            self.jpegs.put(jpeg)
+            self.frames_encoded += 1
+            METRICS.span('mjpeg_encode', start, time.time(), frame.seq)
+            return jpeg
+
+    def _encode_loop(self):
+        last_seq = 0
+        while not self._stop_event.is_set():
+            frame = self.mailbox.get(last_seq, timeout=0.5)
+            if frame is None:
+                # timed out, or the mailbox was closed
+                self._stop_event.wait(0.01)
+                continue
+            last_seq = frame.seq
+            if self.clients:
+                self._encode(frame)
+
+    def snapshot(self):
+        """
+        Latest frame as a JPEG encoded Frame, or None when there is no frame yet.
+        """
+        frame = self.mailbox.latest
+        if frame is None:
+            return self.jpegs.latest
+        return self._encode(frame)
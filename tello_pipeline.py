@@ -0,0 +1,184 @@
+"""
+Run a chain of handler stages concurrently.
+
+Instead of one handler that detects, tracks and controls in sequence, the
+runner can load a chain of stage modules:
+
+    python tello_script_runner.py --pipeline detector_stage,tracker_stage,controller_stage --fly
+
+Every stage runs on its own worker thread.  Stages pass a PipelineItem down the
+chain through bounded queues, so while the tracker works on frame k the
+detector already works on frame k+1, and the frames per second are those of
+the slowest stage instead of the sum of all stages.  OpenCV releases the GIL
+while it works, so the stages really do run at the same time.
+
+A full queue between two stages makes the upstream stage wait, so no work is
+thrown away halfway down the chain.  Only the entry of the pipeline drops
+frames: when the first stage is still busy, a newer frame replaces the waiting
+one, so the pipeline always starts on the freshest frame and never holds up
+the video loop.
+
+A stage module has the same init as a handler and a process method instead of
+handler, see template_pipeline_stage.py:
+
+    def process(tello, frame, results, fly_flag=False):
+        return ...
+
+results holds the return value of every upstream stage for this frame, by
+module name.  The return value of process is added to it for the stages
+downstream.
+
+"""
+import importlib
+import logging
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from tello_metrics import METRICS
+
+LOGGER = logging.getLogger()
+
+# items waiting in front of every stage
+STAGE_QUEUE_SIZE = 2
+
+# seq, timestamp - of the frame
+# frame - the TelloFrame, shared by all stages, treat it as read only
+# results - stage module name: return value of its process method, for the stages done so far
+PipelineItem = namedtuple('PipelineItem', ['seq', 'timestamp', 'frame', 'results'])
+
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    One stage module and its statistics.
+    """
+
+    def __init__(self, module_name):
+        self.name = module_name.replace(".py", "")
+        self.module = None
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    def stats(self):
+        return {'processed': self.processed, 'errors': self.errors,
+                'mean_ms': round(self.busy_seconds / self.processed * 1000.0, 2) if self.processed else None}
+
+
+class Pipeline:
+    """
+    Chain of stage modules, each on its own worker thread.
+
+    Use it as the handler method: calling it hands the frame to the first stage and returns right away.
+
+    :param stage_names: Module names of the stages, in order
+    :type stage_names: list
+    :param tello: Tello, or command dispatcher, given to every stage
+    :param fly: Flag passed to init and process
+    :type fly: bool
+    :param queue_size: Items waiting in front of every stage
+    :type queue_size: int
+    """
+
+    def __init__(self, stage_names, tello, fly=False, queue_size=STAGE_QUEUE_SIZE):
+        if not stage_names:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = [PipelineStage(name) for name in stage_names]
+        self.tello = tello
+        self.fly = fly
+        self.queue_size = queue_size
+        self.frames_submitted = 0
+        # frames replaced at the entry because the first stage was busy
+        self.frames_replaced = 0
+        self._queues = []
+        self._threads = []
+        self._entry_lock = threading.Lock()
+
+    def start(self):
+        """
+        Import every stage, call its init and start the workers.
+        """
+        for stage in self.stages:
+            stage.module = importlib.import_module(stage.name)
+            init_method = getattr(stage.module, 'init', None)
+            if init_method:
+                init_method(self.tello, fly_flag=self.fly)
+
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for index, stage in enumerate(self.stages):
+            t = threading.Thread(target=self._stage_loop, args=(index,), name=f"stage-{stage.name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        LOGGER.info(f"Pipeline started: {' -> '.join(s.name for s in self.stages)}")
+        return self
+
+    def _put_entry(self, item):
+        entry = self._queues[0]
+        with self._entry_lock:
+            while True:
+                try:
+                    entry.put_nowait(item)
+                    return
+                except queue.Full:
+                    pass
+                try:
+                    replaced = entry.get_nowait()
+                    if replaced is not _STOP:
+                        self.frames_replaced += 1
+                except queue.Empty:
+                    pass
+
+    def submit(self, frame):
+        if frame is None:
+            # stages only run on video frames
+            return
+        self.frames_submitted += 1
+        self._put_entry(PipelineItem(frame.seq, frame.timestamp, frame, {}))
+
+    def __call__(self, tello, frame, fly=False):
+        self.submit(frame)
+
+    def _stage_loop(self, index):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                if outbox is not None:
+                    outbox.put(_STOP)
+                break
+
+            start = time.time()
+            try:
+                item.results[stage.name] = stage.module.process(self.tello, item.frame, item.results, self.fly)
+            except Exception as exc:
+                stage.errors += 1
+                LOGGER.error(f"Pipeline stage {stage.name} failed on frame {item.seq}: {exc}")
+                traceback.print_exc()
+                continue
+            end = time.time()
+            stage.processed += 1
+            stage.busy_seconds += end - start
+            METRICS.span(f"stage_{stage.name}", start, end, item.seq)
+
+            if outbox is not None:
+                # waits while the next stage is behind
+                outbox.put(item)
+
+    def stop(self, timeout=2):
+        if self._queues:
+            self._put_entry(_STOP)
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+        LOGGER.info(f"Pipeline frames submitted: {self.frames_submitted}, replaced while busy: {self.frames_replaced}, "
+                    f"stages: {self.stats()}")
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
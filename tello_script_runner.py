@@ -1,32 +1,30 @@
-import cv2
-from djitellopy import Tello
 import signal
 import sys
 import time
-from datetime import datetime
 import argparse
 import importlib
 import logging
-from imutils.video import VideoStream
-import imutils
 import threading
-import queue
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+# cv2, numpy and djitellopy are imported where they are first needed, so the
+# drone is already answering while they load
+from tello_metrics import METRICS, STARTUP
+from tello_frame_source import Frame, FrameMailbox, tello_frame_source, webcam_frame_source
 
 FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
 logging.basicConfig(format=FORMAT)
 LOGGER = logging.getLogger()
 
 tello = None
-video_writer = None
-local_video_stream = None
+telemetry = None
+dispatcher = None
+video_recorder = None
+frame_source = None
 
-# maximum number of
-MAX_VIDEO_Q_DEPTH = 10
-
-# add a little delay to throttle the number of video frames
-# put into the video queue
-show_video_per_second = 0.3
+# maximum time, in seconds, the display loop waits for a new video
+# frame before it goes back to checking the keyboard
+DISPLAY_FRAME_WAIT = 0.03
 
 
 # This is hard coded because if the image gets too big then
@@ -35,57 +33,42 @@ show_video_per_second = 0.3
 # not be allowed change it at run time
 IMAGE_WIDTH = 500
 
+# when no video frame arrives within this many seconds the handler
+# is called with a None frame, so handlers can still act on time
+NO_VIDEO_HANDLER_PERIOD = 0.1
+
 # function to handle keyboard interrupt
 def signal_handler(sig, frame):
-    global video_writer
-
     shutdown_gracefully()
 
     sys.exit(-1)
 
 
 def shutdown_gracefully():
-    global video_writer
+    global video_recorder
     if tello:
         try:
             tello.end()
         except:
             pass
 
-    if video_writer:
+    if video_recorder:
         try:
-            LOGGER.debug("**** RELEASE VIDEO WRITER")
-            video_writer.release()
-            video_writer = None
+            video_recorder.stop()
+            video_recorder = None
         except:
             pass
 
-    if local_video_stream:
+    if frame_source:
         try:
-            local_video_stream.stop()
+            frame_source.stop()
         except:
             pass
 
 
-tello_image = None
-
-
-def _display_text(image, text, bat_left):
-    cv2.putText(image, text, (50, int(image.shape[0]*0.90)), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                (255, 0, 0), 2, cv2.LINE_AA)  #
-
-    cv2.putText(image, f"Battery: {bat_left}%", (int(image.shape[1]*0.55), 40), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                (255, 0, 0), 2, cv2.LINE_AA)
-
-    cv2.imshow("Keyboard Cmds", image)
-    key = cv2.waitKey(150) & 0xff
-
-    return key
-
+keyboard_window = None
 battery_update_timestamp = 0
 battery_left = "??"
-last_command_timestamp = 0
-last_command = ""
 
 def _exception_safe_process_keyboard_commands(tello, fly):
     try:
@@ -105,132 +88,50 @@ def _process_keyboard_commands(tello, fly):
     :return: 0 - Exit, 1 - continue processing, 2 - suspend processing handler
     :rtype:
     """
-    global tello_image, battery_update_timestamp, battery_left, last_command, last_command_timestamp
+    global keyboard_window, battery_update_timestamp, battery_left
 
-    if tello_image is None:
-        tello_image = cv2.imread("./media/tello_drone_image2.png")
-        tello_image = imutils.resize(tello_image, width=IMAGE_WIDTH)
+    if keyboard_window is None:
+        from tello_keyboard import KeyboardControlWindow
+        keyboard_window = KeyboardControlWindow(width=IMAGE_WIDTH)
+        STARTUP.mark('window_ready')
 
-    if tello and time.time() - battery_update_timestamp > 10:
+    if telemetry and telemetry.count:
+        # the state stream already has it, no need to ask the drone
+        battery_left = telemetry.latest('bat')
+    elif tello and time.time() - battery_update_timestamp > 10:
         battery_update_timestamp = time.time()
         battery_left = tello.get_battery()
 
-    if time.time() - last_command_timestamp > 2:
-        last_command_timestamp = time.time()
-        last_command = ""
-
-    exit_flag = 1
-    cmd_tello_image = tello_image.copy()
-    key = _display_text(cmd_tello_image, last_command, battery_left)
-
-    # because getting keyboard input is a polling process, someone might
-    # hold down a key to get the command to register. To avoid getting
-    # multiple keyboard commands only look for new commands once the
-    # last_command string is empty
-
-    if last_command != "":
-        return exit_flag
-
-    if key != 255:
-        LOGGER.debug(f"key: {key}")
-
-    if key == 27:  # ESC
-        exit_flag = 0
-
-    elif key == ord('w'):
-        last_command = "Forward"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_forward(30)
-
-    elif key == ord('s'):
-        last_command = "Backward"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_back(30)
-
-    elif key == ord('a'):
-        last_command = "Left"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_left(30)
-
-    elif key == ord('d'):
-        last_command = "Right"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_right(30)
-
-    elif key == ord('e'):
-        last_command = "Clockwise"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.rotate_clockwise(30)
-
-    elif key == ord('q'):
-        last_command = "Counter Clockwise"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.rotate_counter_clockwise(30)
-
-    elif key == ord('r'):
-        last_command = "Up"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_up(30)
-
-    elif key == ord('f'):
-        last_command = "Down"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.move_down(30)
-
-    elif key == ord('l'):
-        last_command = "Land"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        exit_flag = 0
-
-    elif key == ord('h'):
-        last_command = "Hover"
-        _display_text(cmd_tello_image, last_command, battery_left)
-        if fly:
-            tello.send_rc_control(0, 0, 0, 0)
-
-    elif key == ord('x'):
-        tello.emergency()
-        exit_flag = 0  # stop processing the handler function but continue to fly and see video
-
-    # LOGGER.debug(f"Exit Flag: {exit_flag}")
-    return exit_flag
-
-
-
-
-def _get_video_frame(frame_read, vid_sim):
-    f = None
-    try:
-        if frame_read:
-            f = frame_read.frame
-        elif vid_sim and local_video_stream:
-            f = local_video_stream.read()
+    # keyboard commands go through the dispatcher, when there is one, so the
+    # window keeps updating while the drone carries out a command
+    return keyboard_window.poll(dispatcher or tello, fly, battery_left)
 
-        if f is not None:
-            f = imutils.resize(f, width=IMAGE_WIDTH)
 
-    except Exception as exc:
-        LOGGER.error("Exception getting video frame")
-        LOGGER.error(f"{exc}")
+def _open_tello_video(tello, save_video_raw=False):
+    """
+    Start decoding the Tello video.  Opening the decoder waits for the stream, so
+    it runs on the startup pool while the handler initializes.
 
-    return f
+    :return: The started FrameSource, and the H264Passthrough when save_video_raw is set
+    :rtype: tuple
+    """
+    passthrough = None
+    address = None
+    if save_video_raw:
+        from tello_video_recorder import H264Passthrough
+        # the passthrough owns the video port and forwards the packets to the decoder
+        passthrough = H264Passthrough().start()
+        address = passthrough.decoder_address
+    return tello_frame_source(tello, address).start(), passthrough
 
 
-def process_tello_video_feed(handler_file, video_queue, stop_event, video_event, fly=False, tello_video_sim=False, display_tello_video=False):
+def process_tello_video_feed(handler_file, video_mailbox, stop_event, video_event, fly=False, tello_video_sim=False, display_tello_video=False, tello_host=None, handler_process=False, sync_commands=False, save_video=False, save_video_raw=False, video_source=None, record_session=None, session_format='jpeg', hot_reload=False, frame_scheduler=None, frame_gate=None, pipeline=None, inference=None, undistorter=None):
     """
 
     :param exit_event: Multiprocessing Event.  When set, this event indicates that the process should stop.
     :type exit_event:
-    :param video_queue: Thread Queue to send the video frame to
-    :type video_queue: threading.Queue
+    :param video_mailbox: Latest frame mailbox the resized video frames are published to
+    :type video_mailbox: FrameMailbox
     :param stop_event: Thread Event to indicate if this thread function should stop
     :type stop_event: threading.Event
     :param video_event: threading.Event to indicate when the main loop is ready for video
@@ -239,78 +140,274 @@ def process_tello_video_feed(handler_file, video_queue, stop_event, video_event,
     :type fly: bool
     :param max_speed_limit: Maximum speed that the drone will send as a command.
     :type max_speed_limit: int
+    :param tello_host: IP address of the Tello, or of a tello_sim.py simulator.  None - use the djitellopy default
+    :type tello_host: str
+    :param handler_process: Run the handler init and handler methods in a separate worker process
+    :type handler_process: bool
+    :param sync_commands: Give the handler the Tello object itself instead of the non-blocking command dispatcher
+    :type sync_commands: bool
+    :param save_video: Record the decoded video to an MP4 file on a background thread
+    :type save_video: bool
+    :param save_video_raw: Record the drone's H.264 stream as it is, without decoding or encoding it
+    :type save_video_raw: bool
+    :param video_source: FrameSource to use instead of the Tello or webcam video, for example one of the
+                            tello_benchmark.py sources.  The runner starts it.
+    :type video_source: FrameSource
+    :param record_session: Directory to record the frames, state packets and commands of this flight to, for
+                            replay with tello_session.py.  None - do not record
+    :type record_session: str
+    :param session_format: 'jpeg' or 'raw' frames in the recorded session
+    :type session_format: str
+    :param hot_reload: Reload the handler module when its file changes, without landing
+    :type hot_reload: bool
+    :param frame_scheduler: Chooses the frames the handler runs on.  None - every new frame
+    :type frame_scheduler: FrameScheduler
+    :param frame_gate: Drops duplicate frames and, with a motion threshold, finds frames without motion.
+                        None - only drop duplicates
+    :type frame_gate: FrameGate
+    :param pipeline: Module names of pipeline stages to run, each on its own worker thread, instead of a handler
+    :type pipeline: list
+    :param inference: DNN stage that runs on every new frame next to the handler.  The runner starts it before
+                        takeoff, the handler finds the newest result in frame.inference
+    :type inference: InferenceStage
+    :param undistorter: Removes the lens distortion from every frame before the handler sees it
+    :type undistorter: Undistorter
     :return: None
     :rtype:
     """
-    global tello, local_video_stream
-    last_show_video_queue_put_time = 0
+    global tello, telemetry, dispatcher, frame_source, video_recorder
     handler_method = None
+    worker = None
+    session = None
+    # independent startup steps, like connecting and opening the decoder, overlap on this pool
+    startup_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
 
     try:
+        if record_session:
+            from tello_session import SessionWriter
+            session = SessionWriter(record_session, frame_format=session_format)
+
+        connect_future = None
         if fly or ( not tello_video_sim and display_tello_video):
-            tello = Tello()
-            rtn = tello.connect()
-            LOGGER.debug(f"Connect Return: {rtn}")
+            from djitellopy import Tello
+            tello = Tello(host=tello_host) if tello_host else Tello()
+            # the drone answers while the handler module loads
+            connect_future = startup_pool.submit(tello.connect)
 
-        if handler_file:
+        # the model loads and warms up while the drone connects
+        inference_future = startup_pool.submit(inference.start) if inference else None
+
+        if handler_file and not handler_process:
             handler_file = handler_file.replace(".py", "")
+            importlib.import_module(handler_file)
+            STARTUP.mark('handler_imported')
+
+        if connect_future:
+            rtn = connect_future.result()
+            LOGGER.debug(f"Connect Return: {rtn}")
+            STARTUP.mark('connected')
+
+            # handlers read the state stream with tello.telemetry
+            from tello_telemetry import TelemetryService
+            telemetry = TelemetryService()
+            if session:
+                telemetry.listeners.append(session.record_state)
+            telemetry.follow(tello)
+            tello.telemetry = telemetry
+
+        # handlers get the command dispatcher so a command that waits for the
+        # drone to reply does not stop the video loop
+        handler_tello = tello
+        if tello and not sync_commands:
+            from tello_command_dispatcher import CommandDispatcher
+            dispatcher = CommandDispatcher(tello, metrics=METRICS).start()
+            if session:
+                dispatcher.listeners.append(session.record_command)
+            handler_tello = dispatcher
+
+        # opening the decoder waits for the stream, the handler initializes meanwhile
+        video_future = None
+        if video_source is not None:
+            frame_source = video_source.start()
+        elif tello and video_mailbox:
+            tello.streamon()
+            STARTUP.mark('stream_on')
+            video_future = startup_pool.submit(_open_tello_video, tello, save_video_raw)
+        elif tello_video_sim:
+            video_future = startup_pool.submit(lambda: (webcam_frame_source(0).start(), None))
+
+        if pipeline:
+            from tello_pipeline import Pipeline
+            # calling the pipeline hands the frame to the first stage and returns right away
+            worker = Pipeline(pipeline, handler_tello, fly=fly).start()
+            handler_method = worker
+        elif handler_file and handler_process:
+            from tello_handler_process import HandlerProcess
+            # init runs in the worker, handler_method hands frames to the worker
+            worker = HandlerProcess(handler_file, handler_tello, fly=fly).start()
+            handler_method = worker
+        elif handler_file and hot_reload:
+            from tello_hot_reload import HotReloadHandler
+            # imports the module and calls init, then reloads it between frames
+            handler_method = HotReloadHandler(handler_file, handler_tello, fly=fly).start()
+        elif handler_file:
             handler_module = importlib.import_module(handler_file)
             init_method = getattr(handler_module, 'init')
             handler_method = getattr(handler_module, 'handler')
 
-            init_method(tello, fly_flag=fly)
-
-        frame_read = None
-        if tello and video_queue:
-            tello.streamon()
-            frame_read = tello.get_frame_read()
+            init_method(handler_tello, fly_flag=fly)
+        if handler_file or pipeline:
+            STARTUP.mark('handler_ready')
+        if inference_future:
+            # a model that fails to load stops the flight before takeoff
+            inference_future.result()
+            STARTUP.mark('inference_ready')
 
         if fly:
+            # the decoder keeps warming up while the drone takes off
             tello.takeoff()
             # send command to go no where
             tello.send_rc_control(0, 0, 0, 0)
-
-        if tello_video_sim and local_video_stream is None:
-            local_video_stream = VideoStream(src=0).start()
-            time.sleep(2)
-
+            STARTUP.mark('airborne')
+
+        if video_future:
+            frame_source, passthrough = video_future.result()
+            if passthrough:
+                video_recorder = passthrough
+            STARTUP.mark('video_open')
+        startup_pool.shutdown(wait=False)
+
+        if save_video and frame_source and video_recorder is None:
+            from tello_video_recorder import VideoRecorder
+            # record the full resolution frames straight from the decoder
+            video_recorder = VideoRecorder(frame_source.mailbox).start()
+
+        from tello_frame import TelloFrame
+        from tello_frame_scheduler import FrameScheduler
+        scheduler = frame_scheduler or FrameScheduler()
+        from tello_frame_gate import DUPLICATE, STILL, FrameGate
+        gate = frame_gate or FrameGate()
+
+        last_seq = 0
+        # time of the last handler call, with or without a frame
+        last_handler_call = 0
         while not stop_event.isSet():
-            frame = _get_video_frame(frame_read, tello_video_sim)
+            if frame_source is None:
+                # no video at all, the handler is still called so it can
+                # issue timed commands
+                if handler_method:
+                    handler_method(handler_tello, None, fly)
+                stop_event.wait(NO_VIDEO_HANDLER_PERIOD)
+                continue
 
-            if frame is None:
+            # block until the decoder publishes a frame we have not seen yet
+            tello_frame = frame_source.next_frame(last_seq, timeout=NO_VIDEO_HANDLER_PERIOD)
+
+            if tello_frame is None:
+                if frame_source.finished:
+                    LOGGER.info("End of video source")
+                    break
                 # LOGGER.debug("Failed to read video frame")
                 if handler_method:
-                    handler_method(tello, frame, fly)
-                # else:
-                #     # stop let keyboard commands take over
-                #     if fly:
-                #         tello.send_rc_control(0, 0, 0, 0)
+                    handler_method(handler_tello, None, fly)
+                continue
+
+            seq = tello_frame.seq
+            METRICS.stamp(seq, 'decode', tello_frame.timestamp)
+            STARTUP.mark('first_frame', tello_frame.timestamp)
+            if seq - last_seq > 1 and last_seq > 0:
+                LOGGER.debug(f"Skipped {seq - last_seq - 1} video frames")
+                METRICS.count('video_frame_drops', seq - last_seq - 1)
+            last_seq = seq
+
+            # the decoder handed out the same picture again, there is nothing new to do
+            verdict = gate.check(tello_frame.image)
+            if verdict == DUPLICATE:
+                METRICS.count('duplicate_frames')
+                # a static scene or a stalled decoder must not starve a handler that times
+                # its own commands, it gets the same None heartbeat as without video
+                if handler_method and time.time() - last_handler_call >= NO_VIDEO_HANDLER_PERIOD:
+                    last_handler_call = time.time()
+                    handler_method(handler_tello, None, fly)
                 continue
 
-            if handler_method:
-                handler_method(tello, frame, fly)
+            image = tello_frame.image
+            if undistorter:
+                # the maps are made once per resolution, this is a single remap
+                with METRICS.timed('undistort', seq):
+                    image = undistorter(image)
+
+            # the handler and the display share the frame and its cached gray, hsv, ... views
+            with METRICS.timed('resize', seq):
+                frame = TelloFrame.from_image(image, IMAGE_WIDTH, seq, tello_frame.timestamp)
+            METRICS.stamp(seq, 'resize')
+            frame.unchanged = verdict == STILL
+
+            if session:
+                # recorded before the handler can draw on it
+                session.record_frame(frame, seq, tello_frame.timestamp)
+
+            if inference:
+                # the result for this frame arrives later, the handler gets the newest one there is
+                if not (frame.unchanged and gate.skip_still):
+                    inference.submit(frame)
+                frame.inference = inference.latest
+
+            if handler_method and frame.unchanged and gate.skip_still:
+                METRICS.count('handler_frames_still')
+                # the same heartbeat as for duplicates, the scene may stay still for a long time
+                if time.time() - last_handler_call >= NO_VIDEO_HANDLER_PERIOD:
+                    last_handler_call = time.time()
+                    handler_method(handler_tello, None, fly)
+            elif handler_method and scheduler.select(seq):
+                METRICS.stamp(seq, 'handler_start')
+                handler_start = last_handler_call = time.time()
+                handler_method(handler_tello, frame, fly)
+                handler_end = time.time()
+                METRICS.span('handler', handler_start, handler_end, seq)
+                METRICS.stamp(seq, 'handler_end', handler_end)
+                scheduler.handled(seq, handler_start, handler_end)
+            elif handler_method:
+                METRICS.count('handler_frames_skipped')
             # else:
             #     # stop let keyboard commands take over
             #     if fly:
             #         tello.send_rc_control(0, 0, 0, 0)
 
-            # send frame to other processes
-            if video_queue and video_event.is_set():
-                try:
-                    if time.time() - last_show_video_queue_put_time > show_video_per_second:
-                        last_show_video_queue_put_time = time.time()
-                        LOGGER.debug("Put video frame")
-                        video_queue.put_nowait(frame)
-                except:
-                    pass
+            # hand the frame to the display and recording loop.  The mailbox
+            # only holds the latest frame so this never blocks or queues up lag
+            if video_mailbox and video_event.is_set():
+                video_mailbox.put(Frame(tello_frame.seq, tello_frame.timestamp, frame))
 
 
     except Exception as exc:
         LOGGER.error(f"Exiting Tello Process with exception: {exc}")
         traceback.print_exc()
     finally:
+        startup_pool.shutdown(wait=False)
+        if frame_scheduler:
+            LOGGER.info(f"Frame scheduler: {frame_scheduler.stats()}")
+        if frame_gate:
+            LOGGER.info(f"Frame gate: {frame_gate.stats()}")
+
         # then the user has requested that we land and we should not process this thread
         # any longer.
+        if worker:
+            worker.stop()
+
+        if inference:
+            inference.stop()
+
+        if dispatcher:
+            dispatcher.stop()
+            dispatcher = None
+
+        if telemetry:
+            telemetry.stop()
+
+        if session:
+            session.close()
+
         # to be safe... stop all movement
         if fly:
             tello.send_rc_control(0, 0, 0, 0)
@@ -326,8 +423,66 @@ if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument("--display-video", action='store_true', help="Display Drone video using OpenCV.  Default: 1")
     ap.add_argument("--save-video", action='store_true', help="Save video as MP4 file.  Default: False")
+    ap.add_argument("--save-video-raw", action='store_true',
+                    help="Save the drone's H.264 video stream without re-encoding it, it is remuxed to an MP4 file when "
+                         "the flight ends.  Not with --save-video.  Default: False")
     ap.add_argument("--handler", type=str, required=False, default="",
                     help="Name of the python file with an init and handler method.  Do not include the .py extension and it has to be in the same folder as this main driver")
+    ap.add_argument("--tello-host", type=str, required=False, default=None,
+                    help="IP address of the Tello drone or of a tello_sim.py simulator.  Default: 192.168.10.1")
+    ap.add_argument("--handler-process", action='store_true',
+                    help="Run the handler in a separate process so a CPU heavy handler cannot freeze the keyboard window.  Default: False")
+    ap.add_argument("--sync-commands", action='store_true',
+                    help="Give the handler the Tello object so commands block until the drone replies.  Default: False")
+    ap.add_argument("--metrics-dir", type=str, required=False, default=None,
+                    help="Directory to write metrics.prom (Prometheus text) and trace.json (Chrome trace) to.  Default: None")
+    ap.add_argument("--metrics-interval", type=float, required=False, default=10,
+                    help="Seconds between metrics log lines and exports.  Default: 10")
+    ap.add_argument("--record-session", type=str, required=False, default=None,
+                    help="Directory to record frames, state and commands to for replay with tello_session.py.  Default: None")
+    ap.add_argument("--pipeline", type=str, required=False, default=None,
+                    help="Comma separated stage modules, e.g. detector,tracker,controller, that run concurrently instead of a handler.  See tello_pipeline.py")
+    ap.add_argument("--hot-reload", action='store_true',
+                    help="Reload the handler when its file changes, without landing.  Not with --handler-process.  Default: False")
+    ap.add_argument("--profile-startup", action='store_true',
+                    help="Print the time of every startup step, time to first frame and time to airborne.  Default: False")
+    ap.add_argument("--asyncio", action='store_true',
+                    help="Run on the asyncio runtime in tello_async_runner.py.  Handlers can be async def.  Default: False")
+    ap.add_argument("--headless", action='store_true',
+                    help="Open no windows.  Keyboard commands come from --control-tcp, --control-udp or stdin.  Default: False")
+    ap.add_argument("--control-tcp", type=int, required=False, default=None,
+                    help="Local TCP port for keyboard commands in headless mode, one key or command name per line")
+    ap.add_argument("--control-udp", type=int, required=False, default=None,
+                    help="Local UDP port for keyboard commands in headless mode, one key or command name per datagram")
+    ap.add_argument("--control-stdin", action='store_true',
+                    help="Read keyboard commands from stdin in headless mode.  Default: on when no control port is given")
+    ap.add_argument("--mjpeg-port", type=int, required=False, default=None,
+                    help="Stream the video as MJPEG on this local HTTP port, e.g. http://127.0.0.1:8080/.  Default: None")
+    ap.add_argument("--mjpeg-host", type=str, required=False, default="127.0.0.1",
+                    help="Address the MJPEG server listens on, 0.0.0.0 for viewers on other computers.  Default: 127.0.0.1")
+    ap.add_argument("--frame-policy", choices=['latest', 'every-nth', 'target-fps', 'adaptive'], default='latest',
+                    help="Which frames the handler runs on, see tello_frame_scheduler.py.  Default: latest")
+    ap.add_argument("--frame-every", type=int, default=2, help="every-nth: run the handler on every nth frame.  Default: 2")
+    ap.add_argument("--frame-fps", type=float, default=10, help="target-fps: maximum handler runs per second.  Default: 10")
+    ap.add_argument("--frame-budget", type=float, default=0.5,
+                    help="adaptive: fraction of the time the handler may use.  Default: 0.5")
+    ap.add_argument("--motion-gate", type=float, required=False, default=None,
+                    help="Mean gray level difference, 0-255, below which a frame counts as unchanged, e.g. 2.  Default: None")
+    ap.add_argument("--motion-gate-mode", choices=['skip', 'flag'], default='skip',
+                    help="skip - do not call the handler for unchanged frames, flag - call it with frame.unchanged set.  Default: skip")
+    ap.add_argument("--dnn-model", type=str, required=False, default=None,
+                    help="OpenCV DNN model to run on every frame next to the handler, results in frame.inference.  See tello_dnn.py")
+    ap.add_argument("--dnn-config", type=str, required=False, default="",
+                    help="Config file the DNN model needs, e.g. a .prototxt.  Default: None")
+    ap.add_argument("--dnn-size", type=str, required=False, default="300x300",
+                    help="Width x height of the DNN model input.  Default: 300x300")
+    ap.add_argument("--dnn-threads", type=int, required=False, default=1,
+                    help="Threads running the DNN model, each with its own copy of the network.  Default: 1")
+    ap.add_argument("--calibration", type=str, required=False, default=None,
+                    help="Camera calibration file from tello_calibration.py, every frame is undistorted with it.  The frames are "
+                         "cropped to the valid pixels, so the field of view gets narrower.  Default: None")
+    ap.add_argument("--session-format", choices=['jpeg', 'raw'], default='jpeg',
+                    help="How frames are stored in the recorded session.  Default: jpeg")
     output_group = ap.add_mutually_exclusive_group()
     output_group.add_argument('-v', '--verbose', action='store_true', help='Be loud')
     output_group.add_argument('-i', '--info', action='store_true', help='Show only important information')
@@ -338,6 +493,27 @@ if __name__ == '__main__':
                                help="Flag to control whether to use the computer webcam as a simulated Tello video feed. Default: False")
 
     args = vars(ap.parse_args())
+    if args['pipeline'] and args['handler']:
+        ap.error("use either --handler or --pipeline")
+    if args['save_video'] and args['save_video_raw']:
+        # both write video_<time>.mp4, the raw recording is remuxed to an MP4 when it stops
+        ap.error("use either --save-video or --save-video-raw")
+    if args['hot_reload'] and args['handler_process']:
+        # the handler module is imported in the worker process, the runner cannot reload it
+        ap.error("--hot-reload does not work with --handler-process")
+    if args['asyncio']:
+        # the asyncio runtime only has the handler, fly, display, webcam and save video options
+        unsupported = [flag for flag, dest in (('--headless', 'headless'), ('--handler-process', 'handler_process'),
+                                               ('--sync-commands', 'sync_commands'), ('--pipeline', 'pipeline'),
+                                               ('--hot-reload', 'hot_reload'), ('--record-session', 'record_session'),
+                                               ('--save-video-raw', 'save_video_raw'), ('--motion-gate', 'motion_gate'),
+                                               ('--dnn-model', 'dnn_model'), ('--calibration', 'calibration'),
+                                               ('--mjpeg-port', 'mjpeg_port'), ('--profile-startup', 'profile_startup'))
+                       if args[dest] is not None and args[dest] is not False]
+        if args['frame_policy'] != 'latest':
+            unsupported.append('--frame-policy')
+        if unsupported:
+            ap.error(f"--asyncio does not work with {', '.join(unsupported)}")
 
     LOGGER.setLevel(logging.ERROR)
     if args["verbose"]:
@@ -348,83 +524,165 @@ if __name__ == '__main__':
     LOGGER.debug(args.items())
 
     save_video = args['save_video']
+    save_video_raw = args['save_video_raw']
     fly = args['fly']
     LOGGER.debug(f"Fly: {fly}")
     display_video = args['display_video']
     handler_file = args['handler']
     tello_video_sim = args['tello_video_sim']
+    tello_host = args['tello_host']
+    handler_process = args['handler_process']
+    sync_commands = args['sync_commands']
+    metrics_dir = args['metrics_dir']
+    record_session = args['record_session']
+    session_format = args['session_format']
+    metrics_interval = args['metrics_interval']
+    hot_reload = args['hot_reload']
+    profile_startup = args['profile_startup']
+    headless = args['headless']
+
+    from tello_frame_scheduler import FrameScheduler
+    try:
+        frame_scheduler = FrameScheduler(args['frame_policy'], every=args['frame_every'], fps=args['frame_fps'],
+                                         budget=args['frame_budget'])
+    except ValueError as exc:
+        ap.error(str(exc))
+
+    inference = None
+    if args['dnn_model']:
+        from tello_dnn import InferenceStage
+        try:
+            dnn_size = tuple(int(v) for v in args['dnn_size'].lower().split('x'))
+            if len(dnn_size) != 2:
+                raise ValueError(f"expected width x height, got {args['dnn_size']}")
+            inference = InferenceStage(args['dnn_model'], args['dnn_config'], input_size=dnn_size,
+                                       threads=args['dnn_threads'])
+        except ValueError as exc:
+            ap.error(f"--dnn-size or --dnn-threads: {exc}")
+
+    undistorter = None
+    if args['calibration']:
+        from tello_calibration import Undistorter
+        try:
+            undistorter = Undistorter(args['calibration'])
+        except (OSError, ValueError, KeyError) as exc:
+            ap.error(f"--calibration {args['calibration']}: {exc}")
+
+    from tello_frame_gate import FrameGate
+    frame_gate = FrameGate(args['motion_gate'], skip_still=args['motion_gate_mode'] == 'skip')
 
     # if the user selected tello_video_sim, force the display video flag
     if tello_video_sim:
         display_video = True
 
-    # video queue to hold the frames from the Tello
-    video_queue = queue.Queue(maxsize=MAX_VIDEO_Q_DEPTH)
+    # latest frame mailbox shared by the video thread and the display loop
+    video_mailbox = FrameMailbox()
+
 
+    METRICS.start_exporter(metrics_dir, metrics_interval)
+
+    control_server = None
+    if headless:
+        from tello_control_server import ControlServer
+        control_stdin = args['control_stdin'] or (args['control_tcp'] is None and args['control_udp'] is None)
+        # commands go to the dispatcher, or the Tello, as soon as the video thread has connected
+        control_server = ControlServer(lambda: dispatcher or tello, fly=fly, tcp_port=args['control_tcp'],
+                                       udp_port=args['control_udp'], stdin=control_stdin).start()
+
+    mjpeg_server = None
+    if args['mjpeg_port']:
+        from tello_mjpeg_server import MjpegServer
+        # viewers see the same frames as the display, with whatever the handler drew on them
+        mjpeg_server = MjpegServer(video_mailbox, port=args['mjpeg_port'], host=args['mjpeg_host']).start()
+
+    if args['asyncio']:
+        import asyncio
+        from tello_async_runner import AsyncRunner
+
+        async_runner = AsyncRunner(handler_file, fly=fly, display_video=display_video, tello_video_sim=tello_video_sim,
+                                   tello_host=tello_host, save_video=save_video)
+        try:
+            # the shutdown ends the Tello connection within its deadline
+            asyncio.run(async_runner.run())
+        finally:
+            METRICS.stop_exporter()
+        sys.exit(0)
 
     try:
         # TELLO_LOGGER = logging.getLogger('djitellopy')
         # TELLO_LOGGER.setLevel(logging.ERROR)
 
-        cv2.namedWindow("Tello Video")
-
         stop_event = threading.Event()
         ready_to_show_video_event = threading.Event()
         p1 = threading.Thread(target=process_tello_video_feed,
-                     args=(handler_file, video_queue, stop_event, ready_to_show_video_event, fly, tello_video_sim, display_video,))
+                     args=(handler_file, video_mailbox, stop_event, ready_to_show_video_event, fly, tello_video_sim, display_video, tello_host, handler_process, sync_commands, save_video, save_video_raw,),
+                     kwargs={'record_session': record_session, 'session_format': session_format,
+                             'hot_reload': hot_reload, 'frame_scheduler': frame_scheduler,
+                             'frame_gate': frame_gate, 'inference': inference,
+                             'undistorter': undistorter,
+                             'pipeline': args['pipeline'].split(',') if args['pipeline'] else None})
         p1.setDaemon(True)
         p1.start()
 
+        if not headless:
+            # OpenCV loads and the windows open while the video thread connects
+            import cv2
+            cv2.namedWindow("Tello Video")
+
+        last_display_seq = 0
         while True:
-            key_status = _exception_safe_process_keyboard_commands(tello, fly)
+            if headless:
+                # commands are sent by the control server threads, here we only see if one asked to exit
+                key_status = 0 if control_server.exit_event.is_set() or not p1.is_alive() else 1
+            else:
+                key_status = _exception_safe_process_keyboard_commands(tello, fly)
             if key_status == 0:
                 stop_event.set()
                 ready_to_show_video_event.clear()
                 # wait up to 5 seconds for the handler thread to exit
-                # the handler thread will clear the stop_event when it
-                # exits
-                for _ in range(5):
-                    if stop_event.isSet():
-                        time.sleep(1)
-                    else:
-                        break
-                if video_writer:
-                    video_writer.release()
-                    video_writer = None
+                p1.join(5)
                 break
 
             ready_to_show_video_event.set()
-            try:
-                # LOGGER.debug(f"Q size: {video_queue.qsize()}")
-                frame = video_queue.get(block=False)
-            except:
-                frame = None
+            video_frame = video_mailbox.get(last_display_seq, timeout=DISPLAY_FRAME_WAIT, reader='display')
+            frame = None
+            if video_frame is not None:
+                last_display_seq = video_frame.seq
+                frame = video_frame.image
 
 
             # check for video feed
-            if display_video and frame is not None:
+            if display_video and not headless and frame is not None:
                 try:
                     # display the frame to the screen
                     cv2.imshow("Tello Video", frame)
                     cv2.waitKey(1)
+                    METRICS.stamp(video_frame.seq, 'display')
                 except Exception as exc:
                     LOGGER.error(f"Display Queue Error: {exc}")
 
-            # check for save video
-            if save_video and frame is not None:
-                if video_writer is None:
-                    (h, w) = frame.shape[:2]
-                    video_file = f"video_{datetime.now().strftime('%d-%m-%Y_%I-%M-%S_%p')}.mp4"
-                    video_writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'mp4v'), 10, (w, h), True)
+            if video_frame is not None and 'first_frame_shown' not in STARTUP.marks:
+                STARTUP.mark('first_frame_shown')
+                if profile_startup:
+                    print(STARTUP.report())
 
-                try:
-                    video_writer.write(frame)
-                except Exception as exc:
-                    LOGGER.error(f"Writing video error: {exc}")
     finally:
         LOGGER.debug("Complete...")
-
-        cv2.destroyWindow("Tello Video")
-        cv2.destroyWindow("Keyboard Cmds")
-        cv2.destroyAllWindows()
+        LOGGER.info(f"Video mailbox: {video_mailbox.stats()}")
+        METRICS.count('display_mailbox_drops', video_mailbox.reader_drops.get('display', 0))
+        METRICS.stop_exporter()
+        if profile_startup and 'first_frame_shown' not in STARTUP.marks:
+            # no frame ever made it, still show how far startup got
+            print(STARTUP.report())
+        if keyboard_window:
+            LOGGER.info(f"Keyboard command latency: {keyboard_window.latency_stats()}")
+
+        if mjpeg_server:
+            mjpeg_server.stop()
+        if control_server:
+            control_server.stop()
+        else:
+            cv2.destroyWindow("Tello Video")
+            cv2.destroyWindow("Keyboard Cmds")
+            cv2.destroyAllWindows()
         shutdown_gracefully()
@@ -0,0 +1,389 @@
+"""
+Flight session recording and deterministic replay.
+
+A session is a directory with three files:
+
+    session.json   metadata
+    data.bin       append-only records: video frames, state packets and commands
+    index.bin      one fixed size entry per record: type, seq, timestamp, offset and length
+
+Both binary files are only ever appended to, so a session that was cut short
+by a crash is still readable up to the last complete record.  The reader
+memory-maps both files: the index is a numpy structured array and raw frames
+are numpy views into the mapped data file.
+
+Replay feeds the recorded frames and state packets to a handler's init and
+handler methods as fast as the CPU allows, or at a multiple of real time.  The
+handler gets a ReplayTello that answers get_* calls and tello.telemetry from the
+recorded state, on the recorded clock, and collects the commands the handler
+issues so they can be compared with the ones recorded in flight.  Replay can
+start and stop at any time offset, found with a binary search of the index.
+
+    python tello_script_runner.py --handler my_handler --fly --record-session sessions/flight1
+    python tello_session.py info sessions/flight1
+    python tello_session.py replay sessions/flight1 --handler my_handler --start 30 --end 90
+
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from tello_frame import TelloFrame
+from tello_telemetry import TelemetryService
+
+FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+logging.basicConfig(format=FORMAT)
+LOGGER = logging.getLogger()
+
+SESSION_VERSION = 1
+
+RECORD_FRAME = 1
+RECORD_STATE = 2
+RECORD_COMMAND = 3
+
+RECORD_NAMES = {RECORD_FRAME: 'frame', RECORD_STATE: 'state', RECORD_COMMAND: 'command'}
+
+# type, seq, timestamp, offset in data.bin, payload length
+_INDEX_STRUCT = struct.Struct('<BqdQI')
+INDEX_DTYPE = np.dtype([('type', 'u1'), ('seq', '<i8'), ('timestamp', '<f8'), ('offset', '<u8'), ('length', '<u4')])
+
+# frame payload header: height, width, channels, encoding
+_FRAME_STRUCT = struct.Struct('<HHBB')
+FRAME_RAW = 0
+FRAME_JPEG = 1
+
+JPEG_QUALITY = 95
+
+
+class SessionWriter:
+    """
+    Append frames, state packets and commands to a session directory.  Safe to
+    call from the video, telemetry and command threads at the same time.
+
+    :param path: Session directory.  Created if it does not exist
+    :type path: str
+    :param frame_format: 'raw' - frames are stored as they are, 'jpeg' - frames are JPEG encoded
+    :type frame_format: str
+    """
+
+    def __init__(self, path, frame_format='jpeg', jpeg_quality=JPEG_QUALITY):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.frame_format = frame_format
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self._data = open(os.path.join(path, 'data.bin'), 'ab')
+        self._index = open(os.path.join(path, 'index.bin'), 'ab')
+        self._offset = self._data.tell()
+        self._command_seq = 0
+        self.records = 0
+
+        with open(os.path.join(path, 'session.json'), 'w') as f:
+            json.dump({'version': SESSION_VERSION, 'created': time.time(), 'frame_format': frame_format}, f)
+
+    def _append(self, record_type, seq, timestamp, payload_parts):
+        length = sum(len(p) for p in payload_parts)
+        with self._lock:
+            if self._data is None:
+                return
+            if record_type == RECORD_COMMAND:
+                # commands come from the dispatcher and the handler thread at once, their
+                # seq and time are taken here so both follow the order in the file
+                self._command_seq += 1
+                seq = self._command_seq
+                timestamp = time.time()
+            for part in payload_parts:
+                self._data.write(part)
+            # the data reaches the file before its index entry can, so after a crash
+            # no index entry points past the end of the data file
+            self._data.flush()
+            self._index.write(_INDEX_STRUCT.pack(record_type, seq, timestamp, self._offset, length))
+            self._offset += length
+            self.records += 1
+
+    def record_frame(self, image, seq, timestamp):
+        h, w = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        if self.frame_format == 'jpeg':
+            import cv2
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                return
+            payload = encoded.tobytes()
+            encoding = FRAME_JPEG
+        else:
+            payload = np.ascontiguousarray(image).view(np.uint8).reshape(-1).data
+            encoding = FRAME_RAW
+        self._append(RECORD_FRAME, seq, timestamp, [_FRAME_STRUCT.pack(h, w, channels, encoding), payload])
+
+    def record_state(self, values, timestamp):
+        self._append(RECORD_STATE, 0, timestamp, [json.dumps(values).encode('utf-8')])
+
+    def record_command(self, name, args, kwargs):
+        payload = json.dumps({'name': name, 'args': list(args), 'kwargs': kwargs}, default=str).encode('utf-8')
+        # the seq and the timestamp are assigned under the lock
+        self._append(RECORD_COMMAND, None, None, [payload])
+
+    def close(self):
+        with self._lock:
+            if self._data is None:
+                return
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+        LOGGER.info(f"Session {self.path}: {self.records} records")
+
+
+class SessionReader:
+    """
+    Memory mapped, read only view of a session directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'session.json')) as f:
+            self.metadata = json.load(f)
+
+        index_path = os.path.join(path, 'index.bin')
+        entries = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(entries,)) if entries else \
+            np.zeros(0, dtype=INDEX_DTYPE)
+        data_path = os.path.join(path, 'data.bin')
+        data_size = os.path.getsize(data_path)
+        # copy on write: a handler may draw on a raw frame without changing the file
+        self.data = np.memmap(data_path, dtype=np.uint8, mode='c') if data_size else np.zeros(0, dtype=np.uint8)
+
+        # a session written before the data was flushed first can have index entries
+        # past the end of the data, records are in file order so they are at the end
+        complete = self.index['offset'] + self.index['length'] <= data_size
+        if not complete.all():
+            self.index = self.index[:int(np.argmin(complete))]
+
+        # records are in write order.  Frames are stamped with their capture time
+        # which can be a little older than the write time, so seek with the
+        # running maximum, which is sorted
+        self._seek_times = np.maximum.accumulate(self.index['timestamp']) if len(self.index) else self.index['timestamp']
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def start_time(self):
+        return float(self.index['timestamp'][0]) if len(self.index) else None
+
+    @property
+    def end_time(self):
+        return float(self._seek_times[-1]) if len(self.index) else None
+
+    def seek(self, seconds):
+        """
+        Position of the first record at, or after, seconds from the start of the session.
+        """
+        if not len(self.index):
+            return 0
+        return int(np.searchsorted(self._seek_times, self.start_time + seconds, side='left'))
+
+    def payload(self, position):
+        entry = self.index[position]
+        offset = int(entry['offset'])
+        return self.data[offset:offset + int(entry['length'])]
+
+    def frame(self, position):
+        payload = self.payload(position)
+        h, w, channels, encoding = _FRAME_STRUCT.unpack(payload[:_FRAME_STRUCT.size].tobytes())
+        pixels = payload[_FRAME_STRUCT.size:]
+        if encoding == FRAME_JPEG:
+            import cv2
+            return cv2.imdecode(pixels, cv2.IMREAD_COLOR if channels == 3 else cv2.IMREAD_GRAYSCALE)
+        shape = (h, w, channels) if channels > 1 else (h, w)
+        return pixels.reshape(shape)
+
+    def state(self, position):
+        return json.loads(self.payload(position).tobytes().decode('utf-8'))
+
+    def command(self, position):
+        return json.loads(self.payload(position).tobytes().decode('utf-8'))
+
+    def records(self, start=None, end=None):
+        """
+        Yield (position, type, seq, timestamp) between the start and end second offsets.
+        """
+        first = self.seek(start) if start else 0
+        last = self.seek(end) if end is not None else len(self.index)
+        types = self.index['type']
+        seqs = self.index['seq']
+        timestamps = self.index['timestamp']
+        for position in range(first, last):
+            yield position, int(types[position]), int(seqs[position]), float(timestamps[position])
+
+    def summary(self):
+        counts = {name: int(np.count_nonzero(self.index['type'] == t)) for t, name in RECORD_NAMES.items()}
+        duration = self.end_time - self.start_time if len(self.index) else 0
+        return {'records': len(self.index), 'duration_s': round(duration, 3), **counts}
+
+
+class ReplayTello:
+    """
+    Tello stand-in for replay.  Commands are collected instead of sent, queries are
+    answered from the recorded state.
+    """
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.commands = []
+
+    def _record(self, name, args, kwargs):
+        self.commands.append({'timestamp': self.telemetry.clock(), 'name': name, 'args': list(args),
+                              'kwargs': kwargs})
+        # the same return value as the command dispatcher
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def _state(self, field, default=0):
+        value = self.telemetry.latest(field)
+        return default if value is None else value
+
+    def get_battery(self):
+        return self._state('bat')
+
+    def get_height(self):
+        return self._state('h')
+
+    def get_distance_tof(self):
+        return self._state('tof')
+
+    def get_flight_time(self):
+        return self._state('time')
+
+    def get_temperature(self):
+        return (self._state('templ') + self._state('temph')) / 2
+
+    def get_yaw(self):
+        return self._state('yaw')
+
+    def get_pitch(self):
+        return self._state('pitch')
+
+    def get_roll(self):
+        return self._state('roll')
+
+    def get_current_state(self):
+        row = self.telemetry.latest()
+        return {} if row is None else {name: row[name].item() for name in row.dtype.names}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._record(name, args, kwargs)
+
+
+def replay(path, handler_name, fly=True, start=None, end=None, speed=None):
+    """
+    Replay a session through a handler.
+
+    :param path: Session directory
+    :type path: str
+    :param handler_name: Module name of the handler
+    :type handler_name: str
+    :param start: Offset in seconds to start at.  None - the beginning
+    :type start: float
+    :param end: Offset in seconds to stop at.  None - the end
+    :type end: float
+    :param speed: Replay speed as a multiple of real time.  None - as fast as possible
+    :type speed: float
+    :return: Replay results with the commands the handler issued
+    :rtype: dict
+    """
+    reader = SessionReader(path)
+    replay_clock = [reader.start_time or 0.0]
+    telemetry = TelemetryService(clock=lambda: replay_clock[0])
+    replay_tello = ReplayTello(telemetry)
+
+    handler_module = importlib.import_module(handler_name.replace(".py", ""))
+    handler_module.init(replay_tello, fly_flag=fly)
+
+    frames = 0
+    recorded_commands = 0
+    handler_time = 0.0
+    wall_start = time.time()
+    first_timestamp = None
+
+    for position, record_type, seq, timestamp in reader.records(start, end):
+        replay_clock[0] = max(replay_clock[0], timestamp)
+        if first_timestamp is None:
+            first_timestamp = timestamp
+
+        if speed:
+            delay = (timestamp - first_timestamp) / speed - (time.time() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if record_type == RECORD_STATE:
+            telemetry.append(reader.state(position), timestamp)
+        elif record_type == RECORD_COMMAND:
+            recorded_commands += 1
+        elif record_type == RECORD_FRAME:
+            image = reader.frame(position)
+            frame = TelloFrame.from_image(image, image.shape[1], seq, timestamp)
+            handler_start = time.time()
+            handler_module.handler(replay_tello, frame, fly)
+            handler_time += time.time() - handler_start
+            frames += 1
+
+    elapsed = time.time() - wall_start
+    replayed = replay_clock[0] - (first_timestamp or replay_clock[0])
+    return {
+        'frames': frames,
+        'session_seconds': round(replayed, 3),
+        'wall_seconds': round(elapsed, 3),
+        'speedup': round(replayed / elapsed, 1) if elapsed else None,
+        'handler_ms_per_frame': round(handler_time / frames * 1000.0, 3) if frames else None,
+        'recorded_commands': recorded_commands,
+        'replayed_commands': len(replay_tello.commands),
+        'commands': replay_tello.commands,
+    }
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Inspect and replay recorded Tello flight sessions")
+    sub = ap.add_subparsers(dest='action', required=True)
+
+    info_ap = sub.add_parser('info', help="Show what a session contains")
+    info_ap.add_argument("session", type=str)
+
+    replay_ap = sub.add_parser('replay', help="Replay a session through a handler")
+    replay_ap.add_argument("session", type=str)
+    replay_ap.add_argument("--handler", type=str, required=True, help="Name of the handler python file")
+    replay_ap.add_argument("--start", type=float, default=None, help="Seconds into the session to start at")
+    replay_ap.add_argument("--end", type=float, default=None, help="Seconds into the session to stop at")
+    replay_ap.add_argument("--speed", type=float, default=None,
+                           help="Multiple of real time to replay at.  Default: as fast as possible")
+    replay_ap.add_argument("--no-fly", action='store_true', help="Pass fly_flag=False to the handler")
+    replay_ap.add_argument("--commands", action='store_true', help="Print every command the handler issued")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.INFO if args['verbose'] else logging.ERROR)
+
+    if args['action'] == 'info':
+        session = SessionReader(args['session'])
+        print(json.dumps({**session.metadata, **session.summary()}, indent=2))
+        sys.exit(0)
+
+    result = replay(args['session'], args['handler'], fly=not args['no_fly'], start=args['start'],
+                    end=args['end'], speed=args['speed'])
+    if not args['commands']:
+        result.pop('commands')
+    print(json.dumps(result, indent=2, default=str))
@@ -0,0 +1,407 @@
+"""
+Local stand-in for a Tello drone.
+
+The simulator speaks the Tello SDK on the command port (8889), streams the
+state packet to the client on the state port (8890) at 10 Hz and pushes an
+H.264 elementary stream to the video port (11111).  The video comes either from
+a raw H.264 (Annex-B) file, or from a synthetic test pattern produced by ffmpeg.
+
+djitellopy binds the command and state ports on all addresses of the local
+machine, so the simulator cannot bind them there as well, not even on a second
+loopback address like 127.0.0.2.  Run it on another machine, in a container,
+or in its own network namespace, and point the runner at it with
+`--tello-host`:
+
+    python tello_sim.py --host 192.168.10.1 --latency 0.05 --jitter 0.02
+    python tello_script_runner.py --tello-host 192.168.10.1 --display-video
+
+A network namespace on Linux, with the simulator at 10.200.0.2:
+
+    sudo ip netns add tello
+    sudo ip link add tello-host type veth peer name tello-sim
+    sudo ip link set tello-sim netns tello
+    sudo ip addr add 10.200.0.1/24 dev tello-host && sudo ip link set tello-host up
+    sudo ip netns exec tello ip addr add 10.200.0.2/24 dev tello-sim
+    sudo ip netns exec tello ip link set tello-sim up
+    sudo ip netns exec tello python tello_sim.py --host 10.200.0.2
+    python tello_script_runner.py --tello-host 10.200.0.2 --display-video
+
+"""
+import argparse
+import logging
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+logging.basicConfig(format=FORMAT)
+LOGGER = logging.getLogger()
+
+COMMAND_PORT = 8889
+STATE_PORT = 8890
+VIDEO_PORT = 11111
+
+# Tello sends the state packet 10 times a second
+STATE_RATE_HZ = 10
+
+# keep the UDP datagrams below the typical WiFi MTU, like the drone does
+MAX_VIDEO_DATAGRAM = 1460
+
+# H.264 NAL unit types that carry a picture.  One of these marks the
+# end of a frame when pacing the video stream
+_PICTURE_NAL_TYPES = (1, 5)
+
+
+class FlightState:
+    """
+    Very small model of the drone so the state packet and the query
+    commands return values that follow the commands that were sent.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flying = False
+        self.height = 0
+        self.yaw = 0
+        self.x = 0
+        self.y = 0
+        self.battery = 100.0
+        self.speed = 10
+        self.flight_time = 0.0
+        self.rc = (0, 0, 0, 0)
+        self.start = time.time()
+
+    def tick(self, dt):
+        with self.lock:
+            if self.flying:
+                self.flight_time += dt
+                self.battery = max(0.0, self.battery - dt * 0.05)
+                lr, fb, ud, yaw = self.rc
+                self.x += lr * dt
+                self.y += fb * dt
+                self.height = max(0, self.height + ud * dt)
+                self.yaw = int((self.yaw + yaw * dt + 180) % 360 - 180)
+
+    def state_packet(self):
+        with self.lock:
+            lr, fb, ud, _ = self.rc if self.flying else (0, 0, 0, 0)
+            return (f"mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:0;roll:0;yaw:{self.yaw};"
+                    f"vgx:{int(fb)};vgy:{int(lr)};vgz:{int(-ud)};templ:60;temph:63;"
+                    f"tof:{int(self.height) + 10};h:{int(self.height)};bat:{int(self.battery)};"
+                    f"baro:{self.height / 100.0:.2f};time:{int(self.flight_time)};"
+                    f"agx:0.00;agy:0.00;agz:-1000.00;\r\n")
+
+
+class TelloSimulator:
+    """
+    UDP Tello simulator.
+
+    :param host: Address to bind the command port to
+    :type host: str
+    :param latency: Base delay, in seconds, before a command is acknowledged
+    :type latency: float
+    :param jitter: Maximum random delay, in seconds, added to latency
+    :type jitter: float
+    :param motion_speed: cm/s used to delay the acknowledgement of move commands.  0 - acknowledge after latency only
+    :type motion_speed: float
+    :param video_file: Raw H.264 file to stream.  None - use a synthetic test pattern
+    :type video_file: str
+    :param fps: Frame rate used to pace the video stream
+    :type fps: int
+    """
+
+    def __init__(self, host="0.0.0.0", latency=0.02, jitter=0.0, motion_speed=0.0, video_file=None, fps=30):
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.motion_speed = motion_speed
+        self.video_file = video_file
+        self.fps = fps
+
+        self.state = FlightState()
+        self.client_ip = None
+        self.state_port = STATE_PORT
+        self.video_port = VIDEO_PORT
+        self.stream_on = threading.Event()
+        self.stop_event = threading.Event()
+
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind((host, COMMAND_PORT))
+        self.command_socket.settimeout(0.5)
+        self.out_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.threads = []
+
+    def start(self):
+        for target in (self._command_loop, self._state_loop, self._video_loop):
+            t = threading.Thread(target=target, name=target.__name__, daemon=True)
+            t.start()
+            self.threads.append(t)
+        LOGGER.info(f"Tello simulator listening on {self.host}:{COMMAND_PORT}")
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.stream_on.set()  # wake up the video thread
+        for t in self.threads:
+            t.join(timeout=2)
+        self.command_socket.close()
+        self.out_socket.close()
+
+    def _ack_delay(self, cmd, arg):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.motion_speed > 0 and arg is not None and cmd in ('up', 'down', 'left', 'right', 'forward', 'back'):
+            delay += arg / self.motion_speed
+        return delay
+
+    def _handle_command(self, text):
+        """
+        Apply a command to the flight state and return the response, or None
+        for commands the drone does not answer.
+        """
+        parts = text.strip().split()
+        if not parts:
+            return 'error'
+        cmd = parts[0]
+        args = parts[1:]
+        arg = None
+        if len(args) == 1:
+            try:
+                arg = int(args[0])
+            except ValueError:
+                arg = None
+
+        s = self.state
+        with s.lock:
+            if cmd == 'rc':
+                # a valid rc command is not answered, like on the drone
+                try:
+                    rc = tuple(int(a) for a in args)
+                except ValueError:
+                    return 'error'
+                if len(rc) != 4:
+                    return 'error'
+                s.rc = rc
+                return None
+            if cmd in ('command', 'speed', 'wifi', 'mon', 'moff', 'mdirection'):
+                if cmd == 'speed' and arg is not None:
+                    s.speed = arg
+                return 'ok'
+            if cmd == 'port' and len(args) == 2:
+                try:
+                    self.state_port, self.video_port = int(args[0]), int(args[1])
+                except ValueError:
+                    return 'error'
+                return 'ok'
+            if cmd == 'streamon':
+                self.stream_on.set()
+                return 'ok'
+            if cmd == 'streamoff':
+                self.stream_on.clear()
+                return 'ok'
+            if cmd == 'takeoff':
+                s.flying = True
+                s.height = 80
+                return 'ok'
+            if cmd in ('land', 'emergency'):
+                s.flying = False
+                s.height = 0
+                s.rc = (0, 0, 0, 0)
+                return 'ok'
+            if cmd in ('up', 'down', 'left', 'right', 'forward', 'back', 'cw', 'ccw'):
+                if not s.flying or arg is None:
+                    return 'error'
+                if cmd == 'up':
+                    s.height += arg
+                elif cmd == 'down':
+                    s.height = max(0, s.height - arg)
+                elif cmd == 'left':
+                    s.x -= arg
+                elif cmd == 'right':
+                    s.x += arg
+                elif cmd == 'forward':
+                    s.y += arg
+                elif cmd == 'back':
+                    s.y -= arg
+                elif cmd == 'cw':
+                    s.yaw = (s.yaw + arg + 180) % 360 - 180
+                else:
+                    s.yaw = (s.yaw - arg + 180) % 360 - 180
+                return 'ok'
+            if cmd == 'battery?':
+                return str(int(s.battery))
+            if cmd == 'height?':
+                return f"{int(s.height / 10)}dm"
+            if cmd == 'time?':
+                return f"{int(s.flight_time)}s"
+            if cmd == 'temp?':
+                return '60~63C'
+            if cmd == 'speed?':
+                return str(s.speed)
+            if cmd == 'wifi?':
+                return '90'
+            if cmd == 'sdk?':
+                return '20'
+            if cmd == 'sn?':
+                return 'SIMTELLO0000'
+        return 'error'
+
+    def _command_loop(self):
+        # commands are handled one at a time, in order, like the drone does
+        while not self.stop_event.is_set():
+            try:
+                data, address = self.command_socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            text = data.decode('utf-8', errors='ignore')
+            self.client_ip = address[0]
+            LOGGER.debug(f"Command from {address}: {text}")
+
+            parts = text.strip().split()
+            arg = None
+            if len(parts) == 2 and parts[1].lstrip('-').isdigit():
+                arg = int(parts[1])
+
+            try:
+                response = self._handle_command(text)
+            except Exception as exc:
+                # a malformed command must not stop the simulator
+                LOGGER.error(f"Command {text!r} failed: {exc}")
+                response = 'error'
+            if response is None:
+                continue
+
+            time.sleep(self._ack_delay(parts[0] if parts else '', arg))
+            try:
+                self.command_socket.sendto(response.encode('utf-8'), address)
+            except OSError as exc:
+                LOGGER.error(f"Failed to send response: {exc}")
+
+    def _state_loop(self):
+        period = 1.0 / STATE_RATE_HZ
+        next_send = time.time()
+        while not self.stop_event.is_set():
+            self.state.tick(period)
+            if self.client_ip:
+                try:
+                    self.out_socket.sendto(self.state.state_packet().encode('utf-8'),
+                                           (self.client_ip, self.state_port))
+                except OSError as exc:
+                    LOGGER.debug(f"Failed to send state: {exc}")
+            next_send += period
+            time.sleep(max(0.0, next_send - time.time()))
+
+    def _open_video(self):
+        if self.video_file:
+            return open(self.video_file, 'rb'), None
+
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg is required for the synthetic video pattern. Use --video-file instead")
+        proc = subprocess.Popen([ffmpeg, '-loglevel', 'error', '-re', '-f', 'lavfi',
+                                 '-i', f'testsrc=size=960x720:rate={self.fps}',
+                                 '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+                                 '-g', str(self.fps), '-f', 'h264', '-'],
+                                stdout=subprocess.PIPE)
+        return proc.stdout, proc
+
+    def _nal_units(self, stream):
+        """
+        Split an Annex-B byte stream into NAL units, each one including its start code.
+        """
+        buffer = b''
+        while not self.stop_event.is_set():
+            chunk = stream.read(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            start = buffer.find(b'\x00\x00\x01')
+            while start >= 0:
+                end = buffer.find(b'\x00\x00\x01', start + 3)
+                if end < 0:
+                    break
+                # keep the 4 byte start code together with its NAL unit
+                if end > 0 and buffer[end - 1] == 0:
+                    end -= 1
+                yield buffer[start:end]
+                buffer = buffer[end:]
+                start = buffer.find(b'\x00\x00\x01')
+        if buffer:
+            yield buffer
+
+    def _video_loop(self):
+        frame_period = 1.0 / self.fps
+        while not self.stop_event.is_set():
+            self.stream_on.wait()
+            if self.stop_event.is_set():
+                break
+            try:
+                stream, proc = self._open_video()
+            except Exception as exc:
+                LOGGER.error(f"Cannot open video source: {exc}")
+                return
+
+            next_frame = time.time()
+            try:
+                for nal in self._nal_units(stream):
+                    if not self.stream_on.is_set() or self.stop_event.is_set():
+                        break
+                    if self.client_ip:
+                        for i in range(0, len(nal), MAX_VIDEO_DATAGRAM):
+                            self.out_socket.sendto(nal[i:i + MAX_VIDEO_DATAGRAM], (self.client_ip, self.video_port))
+
+                    header = nal[3] if nal[2] == 1 else nal[4]
+                    if proc is None and (header & 0x1f) in _PICTURE_NAL_TYPES:
+                        # a file is read as fast as the disk allows so pace it here.
+                        # ffmpeg paces itself with -re
+                        next_frame += frame_period
+                        time.sleep(max(0.0, next_frame - time.time()))
+            except (OSError, IndexError) as exc:
+                LOGGER.debug(f"Video loop: {exc}")
+            finally:
+                stream.close()
+                if proc:
+                    proc.kill()
+
+
+def signal_handler(sig, frame):
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    ap = argparse.ArgumentParser(description="Local Tello SDK simulator")
+    ap.add_argument("--host", type=str, default="0.0.0.0", help="Address to bind the command port to. Default: 0.0.0.0")
+    ap.add_argument("--latency", type=float, default=0.02, help="Command acknowledgement latency in seconds. Default: 0.02")
+    ap.add_argument("--jitter", type=float, default=0.0, help="Maximum random jitter added to the latency in seconds. Default: 0")
+    ap.add_argument("--motion-speed", type=float, default=0.0,
+                    help="Speed in cm/s used to delay move acknowledgements. 0 disables it.  Default: 0")
+    ap.add_argument("--video-file", type=str, default=None,
+                    help="Raw H.264 (Annex-B) file to stream. Default: synthetic test pattern via ffmpeg")
+    ap.add_argument("--fps", type=int, default=30, help="Video frame rate.  Default: 30")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.INFO)
+    if args["verbose"]:
+        LOGGER.setLevel(logging.NOTSET)
+
+    sim = TelloSimulator(host=args['host'], latency=args['latency'], jitter=args['jitter'],
+                         motion_speed=args['motion_speed'], video_file=args['video_file'], fps=args['fps'])
+    sim.start()
+    try:
+        while True:
+            time.sleep(1)
+    finally:
+        sim.stop()
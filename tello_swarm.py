@@ -0,0 +1,315 @@
+"""
+Drive several Tello drones from one runner.
+
+Every drone gets its own video port, its own worker process that decodes the
+video and runs that drone's handler, and its own command dispatcher and
+telemetry in the main process.  Workers are spread over the CPU cores, so the
+video and handler work of one drone does not slow down the others.
+
+djitellopy shares one command socket and one state socket between all Tello
+objects of a process, and tells the drones apart by address.  That is why the
+Tello objects stay in the main process and the workers send their commands
+back over a pipe, exactly like --handler-process does.
+
+Each worker draws a thumbnail of its video into its own tile of a shared
+memory canvas, and the main process shows the canvas as one composite window.
+
+The drones must be in station mode on the same network as the computer, see
+the Tello SDK 'ap' command, and support the SDK 'port' command to move their
+video to another port, like the Tello EDU:
+
+    python tello_swarm.py --drone 192.168.0.101:sample_user_script --drone 192.168.0.102:sample_user_script --fly
+
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tello_handler_process import TelloProxy, serve_tello_commands
+# handler frames have the same width as in the script runner
+from tello_script_runner import IMAGE_WIDTH
+
+FORMAT = '%(asctime)-15s %(levelname)-10s %(message)s'
+logging.basicConfig(format=FORMAT)
+LOGGER = logging.getLogger()
+
+WINDOW_NAME = "Tello Swarm"
+
+# the first drone streams video to this port, the next one to the port after it
+VIDEO_PORT_BASE = 11111
+STATE_PORT = 8890
+
+TILE_WIDTH = 320
+TILE_HEIGHT = 240
+
+DISPLAY_FPS = 30
+
+# seconds to wait for every worker to import and init its handler before take off
+WORKER_READY_TIMEOUT = 30
+
+
+def _drone_worker(index, name, handler_name, video_address, fly, canvas_name, canvas_shape, tile, command_conn,
+                  stop_event, ready_event, flying_event):
+    """
+    Worker process of one drone: decode its video, run its handler and draw its tile.
+
+    The handler is only called once flying_event is set, so its commands do not go out while the drone takes off.
+    """
+    import importlib
+
+    import cv2
+
+    from tello_frame import TelloFrame
+    from tello_frame_source import capture_frame_source
+
+    if hasattr(os, 'sched_setaffinity'):
+        # one core per drone, wrapping around when there are more drones than cores.  Only
+        # cores this process may run on are used
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cores[index % len(cores)]})
+
+    canvas_shm = shared_memory.SharedMemory(name=canvas_name)
+    canvas = np.ndarray(canvas_shape, dtype=np.uint8, buffer=canvas_shm.buf)
+    top, left, tile_h, tile_w = tile
+    tile_view = canvas[top:top + tile_h, left:left + tile_w]
+
+    tello = TelloProxy(command_conn)
+    handler_method = None
+    if handler_name:
+        handler_module = importlib.import_module(handler_name.replace(".py", ""))
+        handler_module.init(tello, fly_flag=fly)
+        handler_method = handler_module.handler
+
+    capture = cv2.VideoCapture(video_address)
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    source = capture_frame_source(capture, name=f"video-{name}").start()
+    ready_event.set()
+
+    last_seq = 0
+    frames = 0
+    fps = 0.0
+    fps_time = time.time()
+    try:
+        # the video decodes while the drone takes off, the handler waits
+        while not flying_event.wait(0.1):
+            if stop_event.is_set():
+                return
+
+        while not stop_event.is_set():
+            video_frame = source.next_frame(last_seq, timeout=0.1)
+            if video_frame is None:
+                if source.finished:
+                    break
+                if handler_method:
+                    try:
+                        handler_method(tello, None, fly)
+                    except Exception as exc:
+                        LOGGER.error(f"{name} handler exception: {exc}")
+                continue
+            last_seq = video_frame.seq
+
+            frame = TelloFrame.from_image(video_frame.image, IMAGE_WIDTH, video_frame.seq, video_frame.timestamp)
+            if handler_method:
+                try:
+                    handler_method(tello, frame, fly)
+                except Exception as exc:
+                    LOGGER.error(f"{name} handler exception: {exc}")
+
+            frames += 1
+            now = time.time()
+            if now - fps_time >= 1.0:
+                fps = frames / (now - fps_time)
+                frames = 0
+                fps_time = now
+
+            thumbnail = cv2.resize(frame, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+            cv2.putText(thumbnail, f"{name} {fps:.0f} fps", (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (0, 255, 0), 1, cv2.LINE_AA)
+            tile_view[...] = thumbnail
+    finally:
+        source.stop()
+        del tile_view, canvas
+        canvas_shm.close()
+
+
+class SwarmDrone:
+    """
+    Main process side of one drone.
+    """
+
+    def __init__(self, index, host, handler_name, fly):
+        self.index = index
+        self.host = host
+        self.name = f"tello{index + 1}"
+        self.handler_name = handler_name
+        self.fly = fly
+        self.video_port = VIDEO_PORT_BASE + index
+        self.tello = None
+        self.dispatcher = None
+        self.telemetry = None
+        self.process = None
+        self.command_conn = None
+        self.ready_event = None
+
+    def connect(self):
+        from djitellopy import Tello
+
+        from tello_command_dispatcher import CommandDispatcher
+        from tello_metrics import METRICS
+        from tello_telemetry import TelemetryService
+
+        self.tello = Tello(host=self.host)
+        self.tello.connect()
+        # every drone needs its own video port
+        self.tello.send_control_command(f"port {STATE_PORT} {self.video_port}")
+        self.telemetry = TelemetryService().follow(self.tello)
+        self.tello.telemetry = self.telemetry
+        self.dispatcher = CommandDispatcher(self.tello, metrics=METRICS).start()
+        self.tello.streamon()
+        LOGGER.info(f"{self.name} at {self.host} connected, video on port {self.video_port}")
+
+    def start_worker(self, ctx, canvas_name, canvas_shape, tile, stop_event, flying_event):
+        self.command_conn, worker_conn = ctx.Pipe()
+        self.ready_event = ctx.Event()
+        threading.Thread(target=serve_tello_commands, args=(self.command_conn, self.dispatcher),
+                         name=f"{self.name}-commands", daemon=True).start()
+        self.process = ctx.Process(target=_drone_worker, name=f"{self.name}-worker",
+                                   args=(self.index, self.name, self.handler_name,
+                                         f"udp://@0.0.0.0:{self.video_port}", self.fly,
+                                         canvas_name, canvas_shape, tile, worker_conn, stop_event,
+                                         self.ready_event, flying_event),
+                                   daemon=True)
+        self.process.start()
+
+    def stop(self):
+        if self.process:
+            self.process.join(2)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        if self.tello:
+            try:
+                if self.fly:
+                    self.tello.send_rc_control(0, 0, 0, 0)
+                    self.tello.land()
+                self.tello.streamoff()
+            except Exception as exc:
+                LOGGER.error(f"{self.name} shutdown error: {exc}")
+        if self.telemetry:
+            self.telemetry.stop()
+        if self.command_conn:
+            self.command_conn.close()
+
+
+def tile_layout(count, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT):
+    """
+    Canvas shape and (top, left, height, width) of every tile for count drones.
+    """
+    cols = int(math.ceil(math.sqrt(count)))
+    rows = int(math.ceil(count / float(cols)))
+    tiles = [((i // cols) * tile_height, (i % cols) * tile_width, tile_height, tile_width) for i in range(count)]
+    return (rows * tile_height, cols * tile_width, 3), tiles
+
+
+def run_swarm(drone_specs, fly=False, display=True):
+    """
+    Run a swarm until ESC is pressed in the composite window, or the process is interrupted.
+
+    :param drone_specs: (host, handler module name) of every drone
+    :type drone_specs: list
+    :param fly: Take off and let the handlers fly the drones
+    :type fly: bool
+    :param display: Show the composite video window
+    :type display: bool
+    """
+    import cv2
+
+    drones = [SwarmDrone(i, host, handler, fly) for i, (host, handler) in enumerate(drone_specs)]
+    canvas_shape, tiles = tile_layout(len(drones))
+    canvas_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(canvas_shape)))
+    canvas = np.ndarray(canvas_shape, dtype=np.uint8, buffer=canvas_shm.buf)
+    canvas[...] = 0
+
+    ctx = multiprocessing.get_context('spawn')
+    stop_event = ctx.Event()
+    # set once the drones are in the air, the handlers wait for it
+    flying_event = ctx.Event()
+    pool = ThreadPoolExecutor(max_workers=len(drones))
+
+    try:
+        # connecting waits for every drone to answer, do them all at once
+        list(pool.map(lambda d: d.connect(), drones))
+
+        for drone, tile in zip(drones, tiles):
+            drone.start_worker(ctx, canvas_shm.name, canvas_shape, tile, stop_event, flying_event)
+
+        # init may send commands too, let every handler finish it before the drones take off
+        deadline = time.time() + WORKER_READY_TIMEOUT
+        for drone in drones:
+            while not drone.ready_event.wait(0.1):
+                if not drone.process.is_alive() or time.time() > deadline:
+                    raise RuntimeError(f"{drone.name} worker did not start")
+
+        if fly:
+            # takeoff goes straight to the Tello, nothing else uses its socket until it returns
+            list(pool.map(lambda d: d.tello.takeoff(), drones))
+        flying_event.set()
+
+        period = 1.0 / DISPLAY_FPS
+        while not stop_event.is_set():
+            if display:
+                cv2.imshow(WINDOW_NAME, canvas)
+                if cv2.waitKey(1) & 0xff == 27:
+                    break
+            if not any(d.process.is_alive() for d in drones):
+                break
+            time.sleep(period)
+    finally:
+        stop_event.set()
+        list(pool.map(lambda d: d.stop(), drones))
+        pool.shutdown()
+        if display:
+            cv2.destroyAllWindows()
+        del canvas
+        canvas_shm.close()
+        canvas_shm.unlink()
+
+
+def _parse_drone(spec):
+    host, _, handler = spec.partition(':')
+    return host, handler or None
+
+
+def signal_handler(sig, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    ap = argparse.ArgumentParser(description="Run handlers on several Tello drones")
+    ap.add_argument("--drone", action='append', required=True, type=_parse_drone,
+                    help="host[:handler] of a drone, repeat for every drone, e.g. --drone 192.168.0.101:sample_user_script")
+    ap.add_argument("--fly", action='store_true', help="Take off and let the handlers fly the drones.  Default: False")
+    ap.add_argument("--no-display", action='store_true', help="Do not show the composite video window")
+    ap.add_argument('-v', '--verbose', action='store_true', help='Be loud')
+
+    args = vars(ap.parse_args())
+
+    LOGGER.setLevel(logging.INFO if args['verbose'] else logging.ERROR)
+
+    try:
+        run_swarm(args['drone'], fly=args['fly'], display=not args['no_display'])
+    except KeyboardInterrupt:
+        sys.exit(-1)
@@ -0,0 +1,236 @@
+"""
+Telemetry from the Tello state stream.
+
+The Tello sends a state packet 10 times a second.  TelemetryService parses each
+packet once into a row of a fixed dtype numpy ring buffer.  Reading the latest
+value is a lock free array lookup, and window queries, like the mean height over
+the last 2 seconds, are vectorized numpy operations over the ring.  Nobody has
+to send a query command and wait for the drone to answer it.
+
+There is exactly one writer.  It fills a row completely before it publishes the
+row by incrementing the row counter, so latest() never sees a partially written
+row.  window() copies many rows, including the oldest one the writer overwrites
+next, so it takes the write lock while it copies.
+
+"""
+import logging
+import socket
+import threading
+import time
+
+import numpy as np
+
+LOGGER = logging.getLogger()
+
+TELLO_STATE_PORT = 8890
+
+# 60 seconds of state at 10 Hz
+TELEMETRY_CAPACITY = 600
+
+TELEMETRY_DTYPE = np.dtype([
+    ('timestamp', 'f8'),
+    ('bat', 'i2'),
+    ('h', 'i2'),
+    ('tof', 'i2'),
+    ('baro', 'f4'),
+    ('pitch', 'i2'),
+    ('roll', 'i2'),
+    ('yaw', 'i2'),
+    ('vgx', 'i2'),
+    ('vgy', 'i2'),
+    ('vgz', 'i2'),
+    ('agx', 'f4'),
+    ('agy', 'f4'),
+    ('agz', 'f4'),
+    ('templ', 'i2'),
+    ('temph', 'i2'),
+    ('time', 'i4'),
+])
+
+_FIELDS = frozenset(TELEMETRY_DTYPE.names) - {'timestamp'}
+
+# what a ring row holds for the fields a packet does not have: NaN, or 0 for the integer fields
+_EMPTY_ROW = np.zeros((), dtype=TELEMETRY_DTYPE)
+for _name in TELEMETRY_DTYPE.names:
+    if TELEMETRY_DTYPE[_name].kind == 'f':
+        _EMPTY_ROW[_name] = np.nan
+
+
+def parse_state_packet(packet):
+    """
+    Parse a Tello state packet, 'pitch:0;roll:0;...;\\r\\n', into a dict with the
+    TELEMETRY_DTYPE fields it contains.
+    """
+    if isinstance(packet, bytes):
+        packet = packet.decode('ascii', errors='ignore')
+    values = {}
+    for item in packet.strip().split(';'):
+        key, sep, value = item.partition(':')
+        if sep and key in _FIELDS:
+            try:
+                values[key] = float(value)
+            except ValueError:
+                pass
+    return values
+
+
+class TelemetryService:
+    """
+    Ring buffer of Tello state packets.
+
+    :param capacity: Number of state packets kept
+    :type capacity: int
+    :param clock: Function returning the current time used by window queries.  A replay passes its own clock
+    :type clock: callable
+    """
+
+    def __init__(self, capacity=TELEMETRY_CAPACITY, clock=time.time):
+        self.capacity = capacity
+        self.clock = clock
+        self.ring = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        # number of rows ever written.  Only the writer changes it
+        self.count = 0
+        # held while a row is written, and while window copies rows
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._socket = None
+        # called with (values, timestamp) for every state packet, for example by a session recorder
+        self.listeners = []
+
+    def append(self, values, timestamp=None):
+        """
+        Add a parsed state packet.  Must only be called from one thread.
+
+        :param values: Mapping of field name to value, for example from parse_state_packet.  Fields it does not
+                        have are NaN, or 0 for the integer fields, not the values of the packet the row held before
+        :type values: dict
+        """
+        timestamp = timestamp if timestamp is not None else self.clock()
+        with self._write_lock:
+            index = self.count % self.capacity
+            self.ring[index] = _EMPTY_ROW
+            row = self.ring[index]
+            row['timestamp'] = timestamp
+            for key in _FIELDS:
+                value = values.get(key)
+                if value is not None:
+                    row[key] = value
+            self.count += 1
+        for listener in self.listeners:
+            listener(values, timestamp)
+
+    def feed(self, packet, timestamp=None):
+        self.append(parse_state_packet(packet), timestamp)
+
+    def latest(self, field=None):
+        """
+        Latest state packet, or one field of it.
+
+        :param field: Name of a TELEMETRY_DTYPE field. None - return the whole row
+        :type field: str
+        :return: The value, a copy of the row, or None if no state was received yet
+        """
+        count = self.count
+        if count == 0:
+            return None
+        row = self.ring[(count - 1) % self.capacity]
+        if field is None:
+            return row.copy()
+        return row[field].item()
+
+    def age(self):
+        """
+        Seconds since the last state packet, or None if no state was received yet.
+        """
+        timestamp = self.latest('timestamp')
+        return None if timestamp is None else self.clock() - timestamp
+
+    def window(self, seconds, now=None):
+        """
+        State packets received in the last seconds, oldest first.
+
+        :return: Structured numpy array with TELEMETRY_DTYPE rows
+        :rtype: numpy.ndarray
+        """
+        with self._write_lock:
+            count = self.count
+            n = min(count, self.capacity)
+            if n == 0:
+                return self.ring[:0].copy()
+            indexes = np.arange(count - n, count) % self.capacity
+            # fancy indexing copies the rows
+            rows = self.ring[indexes]
+        now = self.clock() if now is None else now
+        return rows[rows['timestamp'] >= now - seconds]
+
+    def mean(self, field, seconds, now=None):
+        rows = self.window(seconds, now)
+        return float(rows[field].mean()) if len(rows) else None
+
+    def max(self, field, seconds, now=None):
+        rows = self.window(seconds, now)
+        return rows[field].max().item() if len(rows) else None
+
+    def min(self, field, seconds, now=None):
+        rows = self.window(seconds, now)
+        return rows[field].min().item() if len(rows) else None
+
+    def listen(self, port=TELLO_STATE_PORT, host=''):
+        """
+        Receive state packets on our own UDP socket.  Use this when nothing else, like
+        djitellopy, is bound to the state port.
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(0.5)
+        return self._start(self._listen_loop, "telemetry-listen")
+
+    def follow(self, tello, poll_interval=0.02):
+        """
+        Take the state packets djitellopy receives on the state port.  djitellopy
+        stores a new state dict for every packet, so each packet is added once.
+
+        djitellopy keeps no receive time and no packet counter, so the state is
+        polled.  Samples are stamped with the poll time, up to poll_interval after
+        the packet arrived, and when two packets arrive within one poll interval
+        only the second is kept: the sample rate is capped at 1 / poll_interval.
+        At the default 20 ms that is 50 Hz, well above the drone's 10 Hz.  Use
+        listen instead when nothing else is bound to the state port.
+        """
+        return self._start(lambda: self._follow_loop(tello, poll_interval), "telemetry-follow")
+
+    def _start(self, target, name):
+        self._thread = threading.Thread(target=target, name=name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        if self._socket:
+            self._socket.close()
+
+    def _listen_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                packet = self._socket.recv(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.feed(packet)
+
+    def _follow_loop(self, tello, poll_interval):
+        last_state = None
+        while not self._stop_event.is_set():
+            try:
+                state = tello.get_current_state()
+            except Exception as exc:
+                LOGGER.debug(f"Telemetry state read failed: {exc}")
+                state = None
+            if state and state is not last_state:
+                last_state = state
+                self.append(state)
+            self._stop_event.wait(poll_interval)
@@ -0,0 +1,250 @@
+"""
+Run an expensive detector only every few frames and track in between.
+
+DetectTrackScheduler calls the detector every detect_every frames, when there
+is nothing to track, or when a track loses confidence.  On the frames in
+between every object is followed by a cheap OpenCV contrib tracker, KCF, MOSSE
+or CSRT, so a detector that takes 200 ms can still steer the drone at video
+rate.
+
+Detections are matched to the existing tracks by box overlap (IOU), so an
+object keeps its track id over detections and the handler gets a stable track
+list:
+
+    from tello_tracking import DetectTrackScheduler
+
+    def detect(frame):
+        return [((x, y, w, h), 'person', 0.9), ...]
+
+    tracking = DetectTrackScheduler(detect, tracker='kcf', detect_every=10)
+
+    def handler(tello, frame, fly_flag=False):
+        if frame is None:
+            return
+        for track in tracking.update(frame):
+            print(track.track_id, track.box, track.confidence)
+
+A track the tracker lost is not returned until a detection finds its object
+again, so a handler never steers toward a stale box.  Call close() to stop the
+tracker threads.
+
+The trackers need opencv-contrib-python, which setup.py installs.  Newer
+OpenCV versions moved MOSSE, and the others, to cv2.legacy, both places are
+tried.
+
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+LOGGER = logging.getLogger()
+
+TRACKERS = ('kcf', 'mosse', 'csrt')
+
+DETECT_EVERY = 10
+# tracks below this confidence make the next frame a detection frame
+MIN_CONFIDENCE = 0.5
+# confidence a track keeps per tracked frame, so a track is checked by the detector even when it looks fine
+CONFIDENCE_DECAY = 0.97
+# a box whose area changes more than this factor from one frame to the next has probably lost its object
+MAX_AREA_CHANGE = 1.5
+IOU_THRESHOLD = 0.3
+# detections in a row a track may be missing from before it is dropped
+MAX_MISSES = 1
+
+
+def create_tracker(kind):
+    """
+    Create an OpenCV contrib tracker.
+
+    :param kind: 'kcf', 'mosse' or 'csrt'
+    :type kind: str
+    """
+    name = f"Tracker{kind.upper()}_create"
+    for namespace in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(namespace, name, None) if namespace is not None else None
+        if factory is not None:
+            return factory()
+    raise RuntimeError(f"OpenCV has no {kind.upper()} tracker, install opencv-contrib-python")
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    intersection = w * h
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+
+class Track:
+    """
+    One tracked object.
+
+    :ivar track_id: Id that stays the same as long as the object is tracked
+    :ivar box: (x, y, w, h) in frame pixels
+    :ivar label: Label from the detector
+    :ivar score: Score from the last detection
+    :ivar confidence: 1.0 right after a detection, lower the longer it was only tracked, 0.0 when the tracker lost it
+    :ivar age: Frames since the last detection that matched this track
+    """
+
+    def __init__(self, track_id, box, label, score, tracker):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.label = label
+        self.score = score
+        self.confidence = 1.0
+        self.age = 0
+        self.misses = 0
+        self._tracker = tracker
+
+    def __repr__(self):
+        return f"Track({self.track_id}, {self.label}, box={self.box}, confidence={self.confidence:.2f})"
+
+
+class DetectTrackScheduler:
+    """
+    Detect every few frames, track with OpenCV contrib trackers in between.
+
+    :param detector: Called with the frame, returns a list of ((x, y, w, h), label, score)
+    :type detector: callable
+    :param tracker: 'kcf', 'mosse' or 'csrt'.  MOSSE is the fastest, CSRT the most accurate
+    :type tracker: str
+    :param detect_every: Run the detector at least every this many frames
+    :type detect_every: int
+    :param min_confidence: Run the detector when a track falls below this confidence
+    :type min_confidence: float
+    :param confidence_decay: Factor the confidence of a track is multiplied by for every tracked frame
+    :type confidence_decay: float
+    :param max_area_change: A box whose area changes more than this factor in one frame halves the confidence
+    :type max_area_change: float
+    :param workers: Threads updating the trackers.  OpenCV releases the GIL, so several tracks update in parallel
+    :type workers: int
+    """
+
+    def __init__(self, detector, tracker='kcf', detect_every=DETECT_EVERY, min_confidence=MIN_CONFIDENCE,
+                 iou_threshold=IOU_THRESHOLD, max_misses=MAX_MISSES, workers=2, confidence_decay=CONFIDENCE_DECAY,
+                 max_area_change=MAX_AREA_CHANGE):
+        if tracker not in TRACKERS:
+            raise ValueError(f"Unknown tracker {tracker}, use one of {', '.join(TRACKERS)}")
+        # fail now, not on the first frame, when contrib is missing
+        create_tracker(tracker)
+        self.detector = detector
+        self.tracker = tracker
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.confidence_decay = confidence_decay
+        self.max_area_change = max_area_change
+        self.tracks = []
+        self.frames = 0
+        self.detections = 0
+        self._frames_since_detection = 0
+        self._next_id = 1
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tracker") if workers > 1 else None
+
+    def _needs_detection(self):
+        return (not self.tracks or self._frames_since_detection >= self.detect_every or
+                any(t.confidence < self.min_confidence for t in self.tracks))
+
+    def update(self, frame):
+        """
+        Detect or track on the next frame.
+
+        :param frame: Video frame, all frames passed in must have the same size
+        :type frame: numpy.ndarray
+        :return: The current tracks.  Tracks the tracker lost on this frame are left out, their box is stale
+        :rtype: list
+        """
+        self.frames += 1
+        # counts this frame, so detect_every=1 detects on every frame
+        self._frames_since_detection += 1
+        if self._needs_detection():
+            self._detect(frame)
+        else:
+            self._track(frame)
+        # a lost track stays until the next detection confirms or drops it
+        return [t for t in self.tracks if t.confidence > 0.0]
+
+    def _new_tracker(self, frame, box):
+        tracker = create_tracker(self.tracker)
+        tracker.init(frame, tuple(int(v) for v in box))
+        return tracker
+
+    def _detect(self, frame):
+        self.detections += 1
+        self._frames_since_detection = 0
+        detections = self.detector(frame)
+
+        # greedy matching, best overlap first
+        pairs = sorted(((iou(t.box, d[0]), ti, di) for ti, t in enumerate(self.tracks)
+                        for di, d in enumerate(detections)), reverse=True)
+        matched_tracks, matched_detections = set(), set()
+        for overlap, ti, di in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if ti in matched_tracks or di in matched_detections:
+                continue
+            matched_tracks.add(ti)
+            matched_detections.add(di)
+            box, label, score = detections[di]
+            track = self.tracks[ti]
+            track.box = tuple(int(v) for v in box)
+            track.label, track.score = label, score
+            track.confidence, track.age, track.misses = 1.0, 0, 0
+            track._tracker = self._new_tracker(frame, box)
+
+        tracks = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                # the detector did not confirm a track the tracker was unsure of
+                if track.misses > self.max_misses or track.confidence < self.min_confidence:
+                    continue
+            tracks.append(track)
+        for di, (box, label, score) in enumerate(detections):
+            if di not in matched_detections:
+                tracks.append(Track(self._next_id, box, label, score, self._new_tracker(frame, box)))
+                self._next_id += 1
+        self.tracks = tracks
+
+    def _track_one(self, track, frame):
+        ok, box = track._tracker.update(frame)
+        track.age += 1
+        if not ok:
+            track.confidence = 0.0
+            return
+        box = tuple(int(v) for v in box)
+        old_area = max(1, track.box[2] * track.box[3])
+        change = max(1, box[2] * box[3]) / float(old_area)
+        track.confidence *= self.confidence_decay
+        if change > self.max_area_change or change < 1.0 / self.max_area_change:
+            track.confidence *= 0.5
+        track.box = box
+
+    def _track(self, frame):
+        if self._pool and len(self.tracks) > 1:
+            list(self._pool.map(lambda t: self._track_one(t, frame), self.tracks))
+        else:
+            for track in self.tracks:
+                self._track_one(track, frame)
+
+    def close(self):
+        """
+        Stop the tracker threads.
+        """
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self):
+        return {'frames': self.frames, 'detections': self.detections, 'tracks': len(self.tracks),
+                'detect_ratio': round(self.detections / float(self.frames), 3) if self.frames else None}
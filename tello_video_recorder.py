@@ -0,0 +1,271 @@
+"""
+Video recording off the UI thread.
+
+VideoRecorder runs on its own thread, reads decoded frames from a FrameMailbox
+and writes them with OpenCV.  The container has a constant frame rate, so frames
+are duplicated or skipped based on their capture timestamps and the recording
+plays back at the speed it was captured at.
+
+H264Passthrough records the drone's original H.264 stream.  It receives the
+video UDP packets, appends them to a .h264 file as they are and forwards them to
+a local port for the decoder.  Nothing is decoded or re-encoded for the
+recording, so a long flight costs almost no CPU.  Packet arrival times are
+written to a timestamp file that mkvmerge understands.  When the recording
+stops, mkvmerge muxes the stream with those times and ffmpeg -c copy turns the
+result into an .mp4, without re-encoding.  With only ffmpeg installed the
+pictures are spaced at the mean recorded frame rate.
+
+"""
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+LOGGER = logging.getLogger()
+
+TELLO_VIDEO_PORT = 11111
+
+# local port the passthrough forwards the video packets to for decoding
+DECODER_VIDEO_PORT = 11112
+
+# nominal Tello camera frame rate
+RECORD_FPS = 30
+
+# H.264 NAL unit types that start a new picture
+_PICTURE_NAL_TYPES = (1, 5)
+
+
+def video_file_name(extension="mp4"):
+    return f"video_{datetime.now().strftime('%d-%m-%Y_%I-%M-%S_%p')}.{extension}"
+
+
+class VideoRecorder:
+    """
+    Write frames from a mailbox to a video file on a background thread.
+
+    :param mailbox: FrameMailbox to read frames from
+    :type mailbox: FrameMailbox
+    :param video_file: Output file name. None - generate one from the current time
+    :type video_file: str
+    :param fps: Frame rate of the output file
+    :type fps: int
+    """
+
+    def __init__(self, mailbox, video_file=None, fps=RECORD_FPS):
+        self.mailbox = mailbox
+        self.video_file = video_file or video_file_name()
+        self.fps = fps
+        self._writer = None
+        # held while the writer is opened, written to or released
+        self._writer_lock = threading.Lock()
+        self._first_timestamp = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.frames_received = 0
+        self.frames_written = 0
+        self.frames_duplicated = 0
+        self.frames_skipped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._record_loop, name="video-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        """
+        Stop recording.  When the recording thread is still writing after timeout seconds,
+        it closes the file itself once the frame is written.
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                LOGGER.info(f"Still writing {self.video_file}, it is closed when the frame is done")
+                return
+        self._release()
+
+    def _release(self):
+        with self._writer_lock:
+            if self._writer is None:
+                return
+            LOGGER.debug("**** RELEASE VIDEO WRITER")
+            self._writer.release()
+            self._writer = None
+        LOGGER.info(f"Recorded {self.video_file}: frames received: {self.frames_received}, "
+                    f"written: {self.frames_written}, duplicated: {self.frames_duplicated}, "
+                    f"skipped: {self.frames_skipped}")
+
+    def write(self, image, timestamp):
+        """
+        Write one frame, repeating it or dropping it so that its position in the
+        file matches its capture time.  Does nothing after stop.
+        """
+        with self._writer_lock:
+            self._write(image, timestamp)
+
+    def _write(self, image, timestamp):
+        import cv2
+
+        if self._writer is None:
+            if self._stop_event.is_set():
+                # opening the file again would truncate the recording
+                return
+            (h, w) = image.shape[:2]
+            self._writer = cv2.VideoWriter(self.video_file, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (w, h), True)
+            self._first_timestamp = timestamp
+
+        self.frames_received += 1
+        # index of the last frame slot this frame covers
+        target = int((timestamp - self._first_timestamp) * self.fps)
+        if target < self.frames_written:
+            self.frames_skipped += 1
+            return
+
+        repeats = target - self.frames_written + 1
+        self.frames_duplicated += repeats - 1
+        for _ in range(repeats):
+            self._writer.write(image)
+        self.frames_written += repeats
+
+    def _record_loop(self):
+        last_seq = 0
+        try:
+            while not self._stop_event.is_set():
+                frame = self.mailbox.get(last_seq, timeout=0.1)
+                if frame is None:
+                    continue
+                last_seq = frame.seq
+                try:
+                    self.write(frame.image, frame.timestamp)
+                except Exception as exc:
+                    LOGGER.error(f"Writing video error: {exc}")
+        finally:
+            # stop may have given up waiting, the file is closed here once the last frame is written
+            self._release()
+
+
+class H264Passthrough:
+    """
+    Record the raw Tello H.264 stream and forward it to the decoder.
+
+    :param video_file: Output .h264 file name. None - generate one from the current time
+    :type video_file: str
+    :param listen_port: UDP port the drone sends the video to
+    :type listen_port: int
+    :param forward_port: Local UDP port the packets are forwarded to. None - do not forward
+    :type forward_port: int
+    :param remux: Put the recording into an .mp4 container when the recording stops.  With mkvmerge the
+                    recorded picture times are kept, with only ffmpeg the mean frame rate is used
+    :type remux: bool
+    """
+
+    def __init__(self, video_file=None, listen_port=TELLO_VIDEO_PORT, forward_port=DECODER_VIDEO_PORT, remux=True):
+        self.video_file = video_file or video_file_name("h264")
+        self.timestamp_file = self.video_file + ".timestamps.txt"
+        self.forward_port = forward_port
+        self.remux = remux
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._socket.bind(('', listen_port))
+        self._socket.settimeout(0.2)
+        self._forward_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if forward_port else None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.bytes_written = 0
+        self.pictures = 0
+        # seconds from the first to the last picture
+        self.duration = 0.0
+
+    @property
+    def decoder_address(self):
+        """
+        Address to open with cv2.VideoCapture to decode the forwarded stream.
+        """
+        return f"udp://@127.0.0.1:{self.forward_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._record_loop, name="h264-passthrough", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._socket.close()
+        if self._forward_socket:
+            self._forward_socket.close()
+        LOGGER.info(f"Recorded {self.video_file}: {self.pictures} pictures, {self.bytes_written} bytes")
+
+        if self.remux and self.pictures:
+            self._remux()
+
+    def _remux(self):
+        mkvmerge = shutil.which('mkvmerge')
+        ffmpeg = shutil.which('ffmpeg')
+        base_name = self.video_file.rsplit('.', 1)[0]
+        mp4_file = base_name + ".mp4"
+
+        if mkvmerge:
+            # the drone's frame rate varies, mkvmerge gives every picture its recorded time
+            mkv_file = base_name + ".mkv"
+            rtn = subprocess.run([mkvmerge, '-q', '-o', mkv_file, '--timestamps', f"0:{self.timestamp_file}",
+                                  self.video_file])
+            # 1 - finished with warnings
+            if rtn.returncode in (0, 1):
+                if ffmpeg is None:
+                    LOGGER.info(f"Remuxed recording to {mkv_file}")
+                    return
+                rtn = subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-i', mkv_file, '-c', 'copy', mp4_file])
+                if rtn.returncode == 0:
+                    os.remove(mkv_file)
+                    LOGGER.info(f"Remuxed recording to {mp4_file}")
+                else:
+                    LOGGER.info(f"Remuxed recording to {mkv_file}")
+                return
+
+        if ffmpeg is None:
+            LOGGER.info("Neither mkvmerge nor ffmpeg found, leaving the raw .h264 recording")
+            return
+        # without mkvmerge the length is right but the pictures are evenly spaced
+        fps = (self.pictures - 1) / self.duration if self.pictures > 1 and self.duration > 0 else RECORD_FPS
+        rtn = subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-framerate', f"{fps:.3f}",
+                              '-i', self.video_file, '-c', 'copy', mp4_file])
+        if rtn.returncode == 0:
+            LOGGER.info(f"Remuxed recording to {mp4_file} at {fps:.2f} fps, install mkvmerge to keep the "
+                        f"recorded picture times")
+
+    def _record_loop(self):
+        first_picture_time = None
+        with open(self.video_file, 'wb') as video, open(self.timestamp_file, 'w') as timestamps:
+            # mkvmerge timestamp file, one line per picture in milliseconds
+            timestamps.write("# timestamp format v2\n")
+            while not self._stop_event.is_set():
+                try:
+                    packet = self._socket.recv(2048)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+
+                now = time.time()
+                if self._forward_socket:
+                    self._forward_socket.sendto(packet, ('127.0.0.1', self.forward_port))
+
+                video.write(packet)
+                self.bytes_written += len(packet)
+
+                # the drone starts every NAL unit at the start of a packet
+                if len(packet) > 4 and packet[:4] == b'\x00\x00\x00\x01' and (packet[4] & 0x1f) in _PICTURE_NAL_TYPES:
+                    if first_picture_time is None:
+                        first_picture_time = now
+                    self.duration = now - first_picture_time
+                    timestamps.write(f"{(now - first_picture_time) * 1000.0:.3f}\n")
+                    self.pictures += 1
@@ -0,0 +1,36 @@
+# User Configuration
+SAMPLE_CONFIG_ITEM = 42
+
+
+def init(tello, fly_flag=False):
+    """
+
+    :param tello: Reference to the Tello command dispatcher, see template_user_script.py
+    :type tello: CommandDispatcher
+    :param fly_flag: True - the fly flag was specified and the Tello will take off. False - the Tello will NOT
+                        be instructed to take off
+    :type fly_flag:  bool
+    :return: None
+    :rtype:
+    """
+    print(f"Inside init method.  fly_flag: {fly_flag}, sample config item: {SAMPLE_CONFIG_ITEM}")
+
+
+def process(tello, frame, results, fly_flag=False):
+    """
+    Called on the stage's own worker thread for every frame that reaches this stage.
+
+    :param tello: Reference to the Tello command dispatcher, see template_user_script.py
+    :type tello: CommandDispatcher
+    :param frame: The video frame, shared with the other stages.  Do not draw on it, draw on a copy
+    :type frame: TelloFrame
+    :param results: Return values of the stages before this one for this frame, by module name.
+                        For example results['detector_stage']
+    :type results: dict
+    :param fly_flag: True - the fly flag was specified and the Tello will take off. False - the Tello will NOT
+                        be instructed to take off
+    :type fly_flag:  bool
+    :return: Result handed to the stages after this one
+    :rtype:
+    """
+    return None
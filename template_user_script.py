@@ -19,10 +19,15 @@ def init(tello, fly_flag=False):
 def handler(tello, frame, fly_flag=False):
     """
 
-    :param tello: Reference to the DJITelloPy Tello object.
-    :type tello: Tello
-    :param frame: image
-    :type frame:
+    :param tello: Reference to the Tello command dispatcher.  It has the same methods as the DJITelloPy Tello
+                    object but commands return a Future right away instead of waiting for the drone to reply.
+                    With --sync-commands this is the DJITelloPy Tello object.
+                    tello.telemetry is the TelemetryService with the latest state, for example
+                    tello.telemetry.latest('h') or tello.telemetry.mean('h', 2).
+    :type tello: CommandDispatcher
+    :param frame: image.  A numpy array with cached derived views: frame.gray, frame.hsv, frame.pyramid(level)
+                    and frame.resized(width).  Each view is computed at most once per frame.
+    :type frame: TelloFrame
     :param fly_flag: True - the fly flag was specified and the Tello will take off. False - the Tello will NOT
                         be instructed to take off
     :type fly_flag:  bool
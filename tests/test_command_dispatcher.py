@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from tello_command_dispatcher import CommandDispatcher
+
+
+class FakeTello:
+    """
+    Records the commands it gets.  move_* blocks until release is set, like a drone that has not answered yet.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.rc = []
+        self.release = threading.Event()
+        self.release.set()
+        self.is_flying = True
+
+    def move_up(self, x):
+        self.release.wait(5)
+        self.calls.append(('move_up', x))
+        return 'ok'
+
+    def rotate_clockwise(self, x):
+        self.calls.append(('rotate_clockwise', x))
+        return 'ok'
+
+    def emergency(self):
+        self.calls.append(('emergency',))
+
+    def flip_left(self):
+        raise RuntimeError("no response")
+
+    def query_battery(self):
+        self.calls.append(('query_battery',))
+        return 87
+
+    def get_battery(self):
+        return 88
+
+    def send_rc_control(self, *setpoint):
+        self.rc.append(setpoint)
+
+
+@pytest.fixture
+def tello():
+    return FakeTello()
+
+
+@pytest.fixture
+def dispatcher(tello):
+    dispatcher = CommandDispatcher(tello, rc_rate_hz=100).start()
+    yield dispatcher
+    tello.release.set()
+    dispatcher.stop()
+
+
+def test_commands_run_in_order_and_return_futures(dispatcher, tello):
+    first = dispatcher.move_up(20)
+    second = dispatcher.rotate_clockwise(90)
+    assert second.result(1) == 'ok'
+    assert first.result(1) == 'ok'
+    assert tello.calls == [('move_up', 20), ('rotate_clockwise', 90)]
+
+
+def test_command_call_does_not_block(dispatcher, tello):
+    tello.release.clear()
+    start = time.time()
+    future = dispatcher.move_up(20)
+    assert time.time() - start < 0.5
+    assert not future.done()
+    tello.release.set()
+    assert future.result(1) == 'ok'
+
+
+def test_get_and_attributes_pass_through(dispatcher, tello):
+    assert dispatcher.get_battery() == 88
+    assert dispatcher.is_flying is True
+    assert tello.calls == []
+
+
+def test_query_is_queued(dispatcher, tello):
+    future = dispatcher.query_battery()
+    assert future.result(1) == 87
+    assert tello.calls == [('query_battery',)]
+
+
+def test_failed_command_sets_the_exception(dispatcher):
+    with pytest.raises(RuntimeError):
+        dispatcher.flip_left().result(1)
+
+
+def test_emergency_cancels_queued_commands(dispatcher, tello):
+    tello.release.clear()
+    running = dispatcher.move_up(20)
+    # wait until the worker is blocked in move_up, so the next command stays queued
+    deadline = time.time() + 1
+    while dispatcher.pending() and time.time() < deadline:
+        time.sleep(0.01)
+    queued = dispatcher.rotate_clockwise(90)
+    dispatcher.emergency()
+    assert tello.calls == [('emergency',)]
+    with pytest.raises(CancelledError):
+        queued.result(1)
+    tello.release.set()
+    assert running.result(1) == 'ok'
+    assert ('rotate_clockwise', 90) not in tello.calls
+
+
+def test_submit_after_stop_fails(tello):
+    dispatcher = CommandDispatcher(tello).start()
+    dispatcher.stop()
+    with pytest.raises(RuntimeError):
+        dispatcher.move_up(20).result(1)
+
+
+def test_rc_setpoints_are_coalesced(tello):
+    # not started, so the setpoints pile up until the rc loop runs once
+    dispatcher = CommandDispatcher(tello, rc_rate_hz=100)
+    for speed in range(10):
+        dispatcher.send_rc_control(speed, 0, 0, 0)
+    assert tello.rc == []
+    dispatcher.start()
+    deadline = time.time() + 1
+    while not tello.rc and time.time() < deadline:
+        time.sleep(0.01)
+    dispatcher.stop()
+    assert tello.rc[0] == (9, 0, 0, 0)
+    assert dispatcher.rc_updates == 10
+
+
+def test_hover_setpoint_is_sent_once(tello):
+    dispatcher = CommandDispatcher(tello, rc_rate_hz=100).start()
+    dispatcher.send_rc_control(0, 0, 0, 0)
+    time.sleep(0.1)
+    dispatcher.stop()
+    assert tello.rc == [(0, 0, 0, 0)]
+
+
+def test_listeners_see_every_command(dispatcher):
+    seen = []
+    dispatcher.listeners.append(lambda name, args, kwargs: seen.append((name, args)))
+    dispatcher.move_up(20).result(1)
+    dispatcher.send_rc_control(1, 2, 3, 4)
+    assert seen == [('move_up', (20,)), ('send_rc_control', (1, 2, 3, 4))]
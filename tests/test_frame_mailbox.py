@@ -0,0 +1,98 @@
+import threading
+import time
+
+from tello_frame_source import Frame, FrameMailbox
+
+
+def frame(seq):
+    return Frame(seq, time.time(), None)
+
+
+def test_get_returns_the_newest_frame():
+    mailbox = FrameMailbox()
+    for seq in (1, 2, 3):
+        mailbox.put(frame(seq))
+    assert mailbox.get(timeout=0).seq == 3
+    assert mailbox.latest.seq == 3
+
+
+def test_get_waits_for_a_newer_frame():
+    mailbox = FrameMailbox()
+    mailbox.put(frame(1))
+    assert mailbox.get(after_seq=1, timeout=0) is None
+    threading.Timer(0.05, mailbox.put, (frame(2),)).start()
+    assert mailbox.get(after_seq=1, timeout=1).seq == 2
+
+
+def test_get_times_out():
+    mailbox = FrameMailbox()
+    start = time.time()
+    assert mailbox.get(timeout=0.05) is None
+    assert time.time() - start >= 0.04
+
+
+def test_close_wakes_readers():
+    mailbox = FrameMailbox()
+    threading.Timer(0.05, mailbox.close).start()
+    assert mailbox.get(timeout=1) is None
+
+
+def test_close_keeps_an_unread_frame():
+    mailbox = FrameMailbox()
+    mailbox.put(frame(1))
+    mailbox.close()
+    assert mailbox.get(timeout=0).seq == 1
+    assert mailbox.get(after_seq=1, timeout=0) is None
+
+
+def test_drops_are_counted_per_reader():
+    mailbox = FrameMailbox()
+    mailbox.put(frame(1))
+    assert mailbox.get(reader='a').seq == 1
+    assert mailbox.get(reader='b').seq == 1
+    for seq in (2, 3, 4):
+        mailbox.put(frame(seq))
+    mailbox.get(after_seq=1, reader='a')
+    mailbox.put(frame(5))
+    mailbox.get(after_seq=4, reader='a')
+    mailbox.get(after_seq=1, reader='b')
+    assert mailbox.stats() == {'puts': 5, 'dropped': 5, 'reader_drops': {'a': 2, 'b': 3}}
+
+
+def test_drops_ignore_seq_gaps():
+    # a producer that skips seq numbers, like the MJPEG encoder, does not drop frames
+    mailbox = FrameMailbox()
+    for seq in (1, 5, 9):
+        mailbox.put(frame(seq))
+        mailbox.get(after_seq=seq - 1, reader='a')
+    assert mailbox.dropped == 0
+
+
+def test_reader_defaults_to_the_thread_name():
+    mailbox = FrameMailbox()
+    mailbox.put(frame(1))
+
+    def read(after_seq):
+        mailbox.get(after_seq=after_seq, timeout=1)
+
+    t = threading.Thread(target=read, args=(0,), name='display')
+    t.start()
+    t.join()
+    mailbox.put(frame(2))
+    mailbox.put(frame(3))
+    t = threading.Thread(target=read, args=(1,), name='display')
+    t.start()
+    t.join()
+    assert mailbox.reader_drops == {'display': 1}
+
+
+def test_wait_taken_blocks_until_the_reader_took_the_newest_frame():
+    mailbox = FrameMailbox()
+    assert mailbox.wait_taken('runner', timeout=0)
+    mailbox.put(frame(1))
+    assert not mailbox.wait_taken('runner', timeout=0.01)
+    threading.Timer(0.05, mailbox.get, kwargs={'reader': 'runner'}).start()
+    assert mailbox.wait_taken('runner', timeout=1)
+    mailbox.put(frame(2))
+    threading.Timer(0.05, mailbox.close).start()
+    assert mailbox.wait_taken('runner', timeout=1)
@@ -0,0 +1,86 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from tello_handler_process import TelloProxy, serve_tello_commands  # noqa: E402
+
+
+def done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class Telemetry:
+    def latest(self, field=None):
+        return 42
+
+    def __reduce__(self):
+        raise TypeError("the telemetry service cannot be pickled")
+
+
+class FakeDispatcher:
+    """
+    Returns Futures like the command dispatcher.
+    """
+
+    is_flying = False
+
+    def __init__(self):
+        self.telemetry = Telemetry()
+
+    def move_up(self, x):
+        return done('ok')
+
+    def query_battery(self):
+        return done(87)
+
+    def flip_left(self):
+        future = Future()
+        future.set_exception(RuntimeError("no response"))
+        return future
+
+    def get_battery(self):
+        return 88
+
+    def make_lock(self):
+        return threading.Lock()
+
+
+@pytest.fixture
+def tello():
+    conn, served = multiprocessing.Pipe()
+    thread = threading.Thread(target=serve_tello_commands, args=(served, FakeDispatcher()), daemon=True)
+    thread.start()
+    yield TelloProxy(conn)
+    conn.close()
+    thread.join(1)
+
+
+def test_futures_are_resolved_before_the_reply(tello):
+    assert tello.move_up(20) == 'ok'
+    assert tello.query_battery() == 87
+    assert tello.get_battery() == 88
+
+
+def test_failed_command_raises(tello):
+    with pytest.raises(RuntimeError, match="no response"):
+        tello.flip_left()
+
+
+def test_unpicklable_result_raises(tello):
+    with pytest.raises(RuntimeError, match="cannot be sent"):
+        tello.make_lock()
+
+
+def test_attributes(tello):
+    assert tello.is_flying is False
+    # objects are proxied
+    assert tello.telemetry.latest('bat') == 42
+    with pytest.raises(AttributeError):
+        tello.no_such_attribute
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from tello_mission import MissionExecutor, expand_plan, format_timeline, load_plan, planned_duration
+
+MISSIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'missions')
+
+
+class FakeTello:
+    """
+    Records the commands it gets, and how many ran at the same time.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.telemetry = None
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(*args):
+            with self.lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            try:
+                self.calls.append((name,) + args)
+                if name == 'flip_left':
+                    raise RuntimeError("no response")
+                if name == 'query_battery':
+                    time.sleep(0.1)
+                    return 87
+                if name.startswith('move_'):
+                    time.sleep(0.02)
+                return 'ok'
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        return command
+
+
+def test_step_forms():
+    steps = expand_plan(['takeoff', 'move_up 40', {'move_up': 40},
+                         {'command': 'rotate_clockwise', 'args': [180], 'duration': 3, 'settle': False},
+                         {'move_left': [30]}, {'land': None}])
+    assert [(s['command'], s['args']) for s in steps] == [
+        ('takeoff', []), ('move_up', [40]), ('move_up', [40]), ('rotate_clockwise', [180]),
+        ('move_left', [30]), ('land', [])]
+    assert steps[3]['settle'] is False
+
+
+def test_repeat_is_flattened():
+    steps = expand_plan([{'repeat': 2, 'steps': ['move_up 20', {'repeat': 2, 'steps': ['get_height']}]}])
+    assert [s['command'] for s in steps] == ['move_up', 'get_height', 'get_height'] * 2
+    # the repeated steps are copies
+    assert steps[0] is not steps[3]
+
+
+def test_bad_steps():
+    with pytest.raises(ValueError):
+        expand_plan([42])
+    with pytest.raises(ValueError):
+        expand_plan([{'move_up': 40, 'move_down': 40}])
+
+
+def test_load_json_plan(tmp_path):
+    path = tmp_path / 'plan.json'
+    path.write_text(json.dumps(['takeoff', 'land']))
+    assert [s['command'] for s in load_plan(str(path))] == ['takeoff', 'land']
+    assert load_plan(os.path.join(MISSIONS, 'test_tello_setup.json'))[-1]['command'] == 'land'
+
+
+def test_planned_duration():
+    assert planned_duration({'command': 'takeoff', 'args': []}) == 5.0
+    assert planned_duration({'command': 'move_up', 'args': [50]}) == pytest.approx(1.5)
+    assert planned_duration({'command': 'rotate_clockwise', 'args': [-180]}) == pytest.approx(2.5)
+    assert planned_duration({'command': 'get_height', 'args': []}) == 0.0
+    assert planned_duration({'command': 'move_up', 'args': [50], 'duration': 4}) == 4.0
+
+
+def test_run_without_telemetry():
+    tello = FakeTello()
+    timeline = MissionExecutor(tello).run(['takeoff', 'move_up 40', 'land'])
+    assert tello.calls == [('takeoff',), ('move_up', 40), ('land',)]
+    assert [e['result'] for e in timeline] == ['ok'] * 3
+    # no state stream to wait on
+    assert timeline[1]['settled'] is None
+    assert 'settled' not in timeline[2]
+    assert timeline[-1]['planned_end'] == pytest.approx(10.0 + 0.5 + 40 / 50.0)
+    assert 'planned' in format_timeline(timeline)
+
+
+def test_failed_step_stops_the_plan():
+    tello = FakeTello()
+    timeline = MissionExecutor(tello).run(['takeoff', 'flip_left', 'land'])
+    assert timeline[-1]['error'] == 'no response'
+    assert ('land',) not in tello.calls
+
+
+def test_query_runs_next_to_the_following_steps():
+    tello = FakeTello()
+    start = time.time()
+    timeline = MissionExecutor(tello).run(['query_battery', 'move_up 20'])
+    assert tello.calls[-1] == ('move_up', 20)
+    assert timeline[0]['result'] == 87
+    assert timeline[1]['start'] < 0.1
+    assert time.time() - start >= 0.1
+
+
+def test_query_and_move_do_not_overlap():
+    tello = FakeTello()
+    timeline = MissionExecutor(tello).run(['move_up 20', 'query_battery', 'move_up 20', 'move_down 20',
+                                          'query_battery', 'move_down 20'])
+    # the djitellopy Tello would mix up the replies of two commands in flight
+    assert tello.max_active == 1
+    assert [e['result'] for e in timeline] == ['ok', 87, 'ok', 'ok', 87, 'ok']
+
+
+@pytest.fixture
+def telemetry():
+    pytest.importorskip('numpy')
+    from tello_telemetry import TelemetryService
+    return TelemetryService()
+
+
+def fill(telemetry, **values):
+    now = time.time()
+    for age in (0.2, 0.1, 0.0):
+        telemetry.append(dict({'h': 100, 'yaw': 0, 'vgx': 0, 'vgy': 0, 'vgz': 0, 'bat': 80}, **values), now - age)
+
+
+def test_settled(telemetry):
+    fill(telemetry, yaw=179)
+    assert MissionExecutor(FakeTello(), telemetry).wait_settled() is True
+
+
+def test_settled_across_the_yaw_wrap(telemetry):
+    now = time.time()
+    for age, yaw in ((0.2, 179), (0.1, -180), (0.0, -179)):
+        telemetry.append({'h': 100, 'yaw': yaw, 'vgx': 0, 'vgy': 0, 'vgz': 0}, now - age)
+    assert MissionExecutor(FakeTello(), telemetry).wait_settled() is True
+
+
+def test_moving_times_out(telemetry):
+    fill(telemetry, vgx=10)
+    start = time.time()
+    assert MissionExecutor(FakeTello(), telemetry).wait_settled(timeout=0.1) is False
+    assert time.time() - start >= 0.1
+
+
+def test_get_is_answered_from_telemetry(telemetry):
+    fill(telemetry)
+    tello = FakeTello()
+    timeline = MissionExecutor(tello, telemetry).run(['get_battery', 'get_temperature'])
+    assert timeline[0]['result'] == 80
+    assert tello.calls == []
@@ -0,0 +1,130 @@
+import sys
+import textwrap
+import time
+
+import pytest
+
+from tello_frame_source import Frame
+from tello_pipeline import Pipeline
+
+
+@pytest.fixture
+def write_stage(tmp_path, monkeypatch):
+    """
+    Write a stage module to a temporary directory on sys.path and return its name.
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = []
+
+    def write(name, source):
+        (tmp_path / f"{name}.py").write_text(textwrap.dedent(source))
+        names.append(name)
+        return name
+
+    yield write
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+def frame(seq):
+    return Frame(seq, time.time(), None)
+
+
+def wait_for(condition, timeout=1.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_needs_a_stage():
+    with pytest.raises(ValueError):
+        Pipeline([], None)
+
+
+def test_results_flow_down_the_chain(write_stage):
+    first = write_stage('double_stage', """
+        def init(tello, fly_flag=False):
+            global fly
+            fly = fly_flag
+
+        def process(tello, frame, results, fly_flag=False):
+            return frame.seq * 2
+    """)
+    second = write_stage('collect_stage', """
+        seen = []
+
+        def process(tello, frame, results, fly_flag=False):
+            seen.append(dict(results))
+            return results['double_stage'] + 1
+    """)
+    pipeline = Pipeline([first + '.py', second], tello=None, fly=True).start()
+    for seq in (1, 2):
+        pipeline.submit(frame(seq))
+        assert wait_for(lambda: pipeline.stages[1].processed == seq)
+    pipeline(None, None)
+    pipeline.stop()
+
+    assert sys.modules[first].fly is True
+    assert sys.modules[second].seen == [{'double_stage': 2}, {'double_stage': 4}]
+    assert pipeline.stats()['collect_stage']['processed'] == 2
+    assert pipeline.frames_submitted == 2
+
+
+def test_stop_ends_every_stage(write_stage):
+    names = [write_stage(f'idle_stage_{i}', """
+        def process(tello, frame, results, fly_flag=False):
+            return None
+    """) for i in range(3)]
+    pipeline = Pipeline(names, tello=None).start()
+    pipeline.submit(frame(1))
+    pipeline.stop(timeout=1)
+    assert not any(t.is_alive() for t in pipeline._threads)
+
+
+def test_failed_stage_skips_the_frame(write_stage):
+    failing = write_stage('failing_stage', """
+        def process(tello, frame, results, fly_flag=False):
+            if frame.seq == 1:
+                raise RuntimeError("bad frame")
+            return frame.seq
+    """)
+    counting = write_stage('counting_stage', """
+        seen = []
+
+        def process(tello, frame, results, fly_flag=False):
+            seen.append(frame.seq)
+    """)
+    pipeline = Pipeline([failing, counting], tello=None).start()
+    for seq in (1, 2):
+        pipeline.submit(frame(seq))
+        assert wait_for(lambda: sum(s.processed + s.errors for s in pipeline.stages[:1]) == seq)
+    pipeline.stop()
+    assert sys.modules[counting].seen == [2]
+    assert pipeline.stats()['failing_stage']['errors'] == 1
+
+
+def test_busy_entry_keeps_the_newest_frame(write_stage):
+    gated = write_stage('gated_stage', """
+        import threading
+
+        started = threading.Event()
+        gate = threading.Event()
+        seen = []
+
+        def process(tello, frame, results, fly_flag=False):
+            started.set()
+            gate.wait(2)
+            seen.append(frame.seq)
+    """)
+    pipeline = Pipeline([gated], tello=None, queue_size=1).start()
+    module = sys.modules[gated]
+    pipeline.submit(frame(1))
+    assert module.started.wait(1)
+    for seq in range(2, 6):
+        pipeline.submit(frame(seq))
+    module.gate.set()
+    assert wait_for(lambda: pipeline.stages[0].processed == 2)
+    pipeline.stop()
+    assert module.seen == [1, 5]
+    assert pipeline.frames_replaced == 3
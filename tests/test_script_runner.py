@@ -0,0 +1,64 @@
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+import tello_script_runner  # noqa: E402
+from tello_frame_gate import FrameGate  # noqa: E402
+from tello_frame_source import FrameMailbox, FrameSource  # noqa: E402
+
+
+@pytest.fixture
+def handler_module(tmp_path, monkeypatch):
+    """
+    Handler that records whether it got a frame or the None heartbeat.
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'recording_handler.py').write_text(textwrap.dedent("""
+        calls = []
+
+        def init(tello, fly_flag=False):
+            pass
+
+        def handler(tello, frame, fly_flag=False):
+            calls.append(frame is not None)
+    """))
+    yield 'recording_handler'
+    sys.modules.pop('recording_handler', None)
+    tello_script_runner.frame_source = None
+
+
+def still_source(frames, fps=100):
+    """
+    Frames that differ in a few pixels, so the gate sees them as still, not as duplicates.
+    """
+    image = np.full((240, 320, 3), 100, dtype=np.uint8)
+    count = [0]
+
+    def read_frame():
+        if count[0] >= frames:
+            raise EOFError
+        count[0] += 1
+        time.sleep(1.0 / fps)
+        copy = image.copy()
+        copy[:8, :8] = count[0] % 2 * 255
+        return copy
+
+    return FrameSource(read_frame, name="still-source")
+
+
+def test_still_frames_get_the_heartbeat(handler_module):
+    gate = FrameGate(motion_threshold=5.0, skip_still=True)
+    tello_script_runner.process_tello_video_feed(handler_module, FrameMailbox(), threading.Event(), threading.Event(),
+                                                 video_source=still_source(60), frame_gate=gate)
+    calls = sys.modules[handler_module].calls
+    assert gate.still > 50
+    # the first frame changed, the still ones only bring a heartbeat every NO_VIDEO_HANDLER_PERIOD
+    assert calls[0] is True
+    assert calls[1:].count(False) >= 3
+    assert len(calls) < 20
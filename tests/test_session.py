@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from tello_session import RECORD_COMMAND, RECORD_FRAME, RECORD_STATE, SessionReader, SessionWriter  # noqa: E402
+
+
+@pytest.fixture
+def session(tmp_path):
+    base = time.time() - 10
+    image = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    writer = SessionWriter(str(tmp_path), frame_format='raw')
+    writer.record_frame(image, 1, base)
+    writer.record_state({'bat': 80, 'h': 120}, base + 1)
+    writer.record_frame(image[:, :, 0], 2, base + 2)
+    writer.record_command('move_up', (20,), {})
+    writer.close()
+    return str(tmp_path), base, image
+
+
+def test_round_trip(session):
+    path, base, image = session
+    reader = SessionReader(path)
+    records = list(reader.records())
+    assert [r[1] for r in records] == [RECORD_FRAME, RECORD_STATE, RECORD_FRAME, RECORD_COMMAND]
+    assert [r[2] for r in records[:3]] == [1, 0, 2]
+    assert records[0][3] == base
+    assert np.array_equal(reader.frame(0), image)
+    assert np.array_equal(reader.frame(2), image[:, :, 0])
+    assert reader.state(1) == {'bat': 80, 'h': 120}
+    assert reader.command(3) == {'name': 'move_up', 'args': [20], 'kwargs': {}}
+    assert reader.summary()['frame'] == 2
+
+
+def test_seek_by_time_offset(session):
+    reader = SessionReader(session[0])
+    assert reader.seek(0) == 0
+    assert reader.seek(1.5) == 2
+    # the command is stamped when it was written, after the frames
+    assert reader.seek(5) == 3
+    assert [r[0] for r in reader.records(start=1, end=5)] == [1, 2]
+
+
+def test_raw_frame_is_copy_on_write(session):
+    path, _, image = session
+    reader = SessionReader(path)
+    reader.frame(0)[:] = 0
+    assert np.array_equal(SessionReader(path).frame(0), image)
+
+
+def test_truncated_index_entry_is_ignored(session):
+    path = session[0]
+    with open(os.path.join(path, 'index.bin'), 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    assert len(SessionReader(path)) == 4
+
+
+def test_index_entries_past_the_data_are_ignored(session):
+    path = session[0]
+    data_path = os.path.join(path, 'data.bin')
+    # the command record, the last one, is cut short
+    os.truncate(data_path, os.path.getsize(data_path) - 1)
+    reader = SessionReader(path)
+    assert len(reader) == 3
+    assert reader.summary()['command'] == 0
+
+
+def test_data_is_on_disk_before_the_index(tmp_path):
+    writer = SessionWriter(str(tmp_path), frame_format='raw')
+    writer.record_frame(np.zeros((4, 6, 3), dtype=np.uint8), 1, time.time())
+    writer.record_state({'h': 10}, time.time())
+    # nothing is closed or flushed by hand, as after a crash
+    assert os.path.getsize(os.path.join(str(tmp_path), 'data.bin')) == writer._offset
+    writer.close()
+
+
+def test_commands_from_several_threads_are_ordered(tmp_path):
+    writer = SessionWriter(str(tmp_path), frame_format='raw')
+
+    def send(name):
+        for _ in range(50):
+            writer.record_command(name, (), {})
+
+    threads = [threading.Thread(target=send, args=(f'cmd{i}',)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.close()
+
+    reader = SessionReader(str(tmp_path))
+    assert list(reader.index['seq']) == list(range(1, 201))
+    assert np.all(np.diff(reader.index['timestamp']) >= 0)
+
+
+def test_empty_session(tmp_path):
+    SessionWriter(str(tmp_path)).close()
+    reader = SessionReader(str(tmp_path))
+    assert len(reader) == 0
+    assert reader.seek(10) == 0
+    assert reader.summary()['records'] == 0
@@ -0,0 +1,49 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from tello_telemetry import TelemetryService, parse_state_packet  # noqa: E402
+
+PACKET = b"pitch:1;roll:-2;yaw:90;vgx:0;vgy:0;vgz:0;templ:60;temph:62;tof:10;h:120;bat:87;baro:12.5;time:5;" \
+         b"agx:1.0;agy:2.0;agz:-999.0;\r\n"
+
+
+def test_parse_state_packet():
+    values = parse_state_packet(PACKET)
+    assert values['h'] == 120.0
+    assert values['baro'] == 12.5
+    assert parse_state_packet("mid:-1;h:bad;x:3;") == {}
+
+
+def test_latest_and_window():
+    telemetry = TelemetryService(clock=lambda: 10.0)
+    assert telemetry.latest() is None
+    for t, h in ((8.0, 100), (9.5, 110), (10.0, 120)):
+        telemetry.append({'h': h}, t)
+    assert telemetry.latest('h') == 120
+    assert list(telemetry.window(1.0)['h']) == [110, 120]
+    assert telemetry.mean('h', 1.0) == 115
+    assert telemetry.age() == 0.0
+
+
+def test_ring_wraps():
+    telemetry = TelemetryService(capacity=3)
+    for h in range(5):
+        telemetry.append({'h': h}, float(h))
+    assert list(telemetry.window(10.0, now=4.0)['h']) == [2, 3, 4]
+
+
+def test_missing_fields_do_not_keep_old_values():
+    telemetry = TelemetryService(capacity=2)
+    telemetry.feed(PACKET, 1.0)
+    telemetry.append({'h': 50}, 2.0)
+    # reuses the row of the full packet
+    telemetry.append({'yaw': 10}, 3.0)
+    row = telemetry.latest()
+    assert row['yaw'] == 10
+    assert row['h'] == 0
+    assert row['bat'] == 0
+    assert math.isnan(row['baro'])
+    assert math.isnan(telemetry.latest('agx'))
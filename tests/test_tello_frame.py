@@ -0,0 +1,86 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from tello_frame import BufferPool, TelloFrame  # noqa: E402
+
+
+def test_free_buffer_is_reused():
+    pool = BufferPool()
+    first = pool.acquire((4, 4, 3))
+    second = pool.acquire((4, 4, 3))
+    assert second is not first
+    del first
+    pool.acquire((4, 4, 3))
+    assert pool.stats() == {'allocated': 2, 'reused': 1}
+
+
+def test_view_keeps_the_buffer_busy():
+    pool = BufferPool()
+    view = pool.acquire((4, 4))[1:]
+    pool.acquire((4, 4))
+    assert pool.stats() == {'allocated': 2, 'reused': 0}
+    del view
+
+
+def test_shapes_and_dtypes_are_pooled_separately():
+    pool = BufferPool()
+    pool.acquire((4, 4))
+    pool.acquire((4, 4), np.float32)
+    pool.acquire((2, 2))
+    assert pool.stats() == {'allocated': 3, 'reused': 0}
+
+
+def test_buffers_over_the_limit_are_not_kept():
+    pool = BufferPool(max_per_shape=1)
+    held = [pool.acquire((4, 4)) for _ in range(3)]
+    del held
+    reused = pool.acquire((4, 4))
+    allocated = pool.acquire((4, 4))
+    assert allocated is not reused
+    # only the first buffer went into the pool, so the second acquire allocates again
+    assert pool.stats() == {'allocated': 4, 'reused': 1}
+
+
+def test_from_image_resizes_into_the_pool():
+    pool = BufferPool()
+    source = np.zeros((240, 320, 3), dtype=np.uint8)
+    frame = TelloFrame.from_image(source, 160, seq=7, timestamp=1.5, pool=pool)
+    assert frame.shape == (120, 160, 3)
+    assert (frame.seq, frame.timestamp, frame.unchanged, frame.inference) == (7, 1.5, False, None)
+    assert frame.source is source
+    assert pool.allocated == 1
+
+
+def test_same_width_is_not_copied():
+    source = np.zeros((120, 160, 3), dtype=np.uint8)
+    frame = TelloFrame.from_image(source, 160)
+    assert np.shares_memory(frame, source)
+
+
+def test_views_are_cached():
+    source = np.full((240, 320, 3), 255, dtype=np.uint8)
+    frame = TelloFrame.from_image(source, 160, pool=BufferPool())
+    assert frame.gray is frame.gray
+    assert frame.gray.shape == (120, 160)
+    assert frame.hsv.shape == (120, 160, 3)
+    assert frame.pyramid(1) is frame.pyramid(1)
+    assert frame.pyramid(2).shape == (30, 40, 3)
+    assert frame.resized(80).shape == (60, 80, 3)
+
+
+def test_frame_without_a_pool():
+    source = np.zeros((240, 320, 3), dtype=np.uint8)
+    frame = TelloFrame.from_image(source, 160, pool=None)
+    assert frame.gray.shape == (120, 160)
+    assert frame.pyramid(1).shape == (60, 80, 3)
+
+
+def test_slices_do_not_share_views():
+    frame = TelloFrame.from_image(np.zeros((240, 320, 3), dtype=np.uint8), 160, seq=3, pool=BufferPool())
+    frame.gray
+    part = frame[10:20]
+    assert part.seq == 3
+    assert part.source is None
+    assert part.gray.shape == (10, 160)
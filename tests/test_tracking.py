@@ -0,0 +1,139 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+import tello_tracking  # noqa: E402
+from tello_tracking import DetectTrackScheduler, iou  # noqa: E402
+
+
+class FakeTracker:
+    """
+    Follows a box that moves by (dx, dy) every frame, or loses it when lost is set.
+    """
+
+    lost = False
+    dx = 0
+    dy = 0
+
+    def init(self, frame, box):
+        self.box = box
+
+    def update(self, frame):
+        if FakeTracker.lost:
+            return False, None
+        x, y, w, h = self.box
+        self.box = (x + FakeTracker.dx, y + FakeTracker.dy, w, h)
+        return True, self.box
+
+
+@pytest.fixture(autouse=True)
+def fake_tracker(monkeypatch):
+    FakeTracker.lost = False
+    FakeTracker.dx = FakeTracker.dy = 0
+    monkeypatch.setattr(tello_tracking, 'create_tracker', lambda kind: FakeTracker())
+
+
+class Detector:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self, frame):
+        self.calls += 1
+        return self.results.pop(0) if self.results else []
+
+
+def test_iou():
+    assert iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert iou((0, 0, 10, 10), (5, 0, 10, 10)) == pytest.approx(50 / 150)
+    assert iou((0, 0, 10, 10), (10, 0, 10, 10)) == 0.0
+    assert iou((0, 0, 10, 10), (20, 20, 5, 5)) == 0.0
+
+
+def test_unknown_tracker():
+    with pytest.raises(ValueError):
+        DetectTrackScheduler(Detector(), tracker='boosting')
+
+
+def test_detects_every_few_frames():
+    detector = Detector(*[[((0, 0, 10, 10), 'person', 0.9)]] * 3)
+    tracking = DetectTrackScheduler(detector, detect_every=3, workers=1)
+    for _ in range(7):
+        tracking.update(None)
+    # frames 1, 4 and 7, the others are tracked
+    assert detector.calls == 3
+    assert tracking.stats()['frames'] == 7
+
+
+def test_track_id_survives_a_detection():
+    detector = Detector([((0, 0, 10, 10), 'person', 0.9)], [((2, 0, 10, 10), 'person', 0.8)])
+    tracking = DetectTrackScheduler(detector, detect_every=2, workers=1)
+    FakeTracker.dx = 1
+    first = tracking.update(None)
+    tracking.update(None)
+    tracking.update(None)
+    second = tracking.update(None)
+    assert [t.track_id for t in first] == [1]
+    assert [t.track_id for t in second] == [1]
+    assert second[0].score == 0.8
+
+
+def test_best_overlap_is_matched_first():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9), ((20, 0, 10, 10), 'b', 0.9)],
+                        [((21, 0, 10, 10), 'b', 0.9), ((1, 0, 10, 10), 'a', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=1, workers=1)
+    tracking.update(None)
+    tracking.update(None)
+    assert {t.label: t.track_id for t in tracking.tracks} == {'a': 1, 'b': 2}
+
+
+def test_unmatched_detection_starts_a_track():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9)], [((0, 0, 10, 10), 'a', 0.9), ((50, 50, 10, 10), 'b', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=1, workers=1)
+    tracking.update(None)
+    tracks = tracking.update(None)
+    assert [(t.track_id, t.label) for t in tracks] == [(1, 'a'), (2, 'b')]
+
+
+def test_missing_track_is_dropped_after_max_misses():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=1, max_misses=1, workers=1)
+    tracking.update(None)
+    # one missed detection keeps it
+    assert len(tracking.update(None)) == 1
+    assert tracking.update(None) == []
+
+
+def test_lost_track_is_not_returned():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=10, workers=1)
+    tracking.update(None)
+    FakeTracker.lost = True
+    assert tracking.update(None) == []
+    # kept until the next detection, which does not find it and is unsure of it
+    assert len(tracking.tracks) == 1
+    assert tracking.update(None) == []
+    assert tracking.tracks == []
+    assert detector.calls == 2
+
+
+def test_confidence_decays_and_area_jumps_halve_it():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=10, confidence_decay=0.9, workers=1)
+    tracking.update(None)
+    track = tracking.update(None)[0]
+    assert track.confidence == pytest.approx(0.9)
+    track._tracker.box = (0, 0, 20, 20)
+    FakeTracker.dx = 0
+    tracking.update(None)
+    assert track.confidence == pytest.approx(0.9 * 0.9 * 0.5)
+
+
+def test_tracks_update_on_the_pool():
+    detector = Detector([((0, 0, 10, 10), 'a', 0.9), ((50, 0, 10, 10), 'b', 0.9)])
+    tracking = DetectTrackScheduler(detector, detect_every=10, workers=2)
+    FakeTracker.dx = 3
+    tracking.update(None)
+    tracks = tracking.update(None)
+    tracking.close()
+    assert [t.box for t in tracks] == [(3, 0, 10, 10), (53, 0, 10, 10)]
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+from tello_frame_source import Frame, FrameMailbox  # noqa: E402
+from tello_video_recorder import VideoRecorder  # noqa: E402
+
+
+def frame_count(path):
+    capture = cv2.VideoCapture(path)
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return count
+
+
+def test_frames_are_spaced_by_timestamp(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    recorder = VideoRecorder(FrameMailbox(), path, fps=10)
+    image = np.zeros((48, 64, 3), dtype=np.uint8)
+    for timestamp in (0.0, 0.3, 0.31, 0.55):
+        recorder.write(image, timestamp)
+    recorder.stop()
+    assert (recorder.frames_written, recorder.frames_duplicated, recorder.frames_skipped) == (6, 3, 1)
+    assert frame_count(path) == 6
+
+
+def test_stop_without_waiting_keeps_the_recording(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    mailbox = FrameMailbox()
+    recorder = VideoRecorder(mailbox, path).start()
+    running = threading.Event()
+    running.set()
+
+    def produce():
+        seq = 0
+        while running.is_set():
+            seq += 1
+            mailbox.put(Frame(seq, time.time(), np.full((48, 64, 3), seq % 255, dtype=np.uint8)))
+            time.sleep(0.005)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.3)
+    recorder.stop(0.0)
+    time.sleep(0.2)
+    running.clear()
+    producer.join()
+    recorder._thread.join(1)
+    written = recorder.frames_written
+    assert written > 0
+    assert frame_count(path) == written
+    # stopped recorders do not open the file again
+    recorder.write(np.zeros((48, 64, 3), dtype=np.uint8), time.time())
+    assert frame_count(path) == written